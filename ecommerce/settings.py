@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from datetime import timedelta
 from pathlib import Path
+
+from corsheaders.defaults import default_headers
+from django.core.exceptions import ImproperlyConfigured
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -33,6 +36,9 @@ PHONEPE_CLIENT_VERSION = 1
 PHONEPE_SANDBOX = False  # Set to False for production
 PHONEPE_WEBHOOK_USERNAME = "greenminds"
 PHONEPE_WEBHOOK_PASSWORD = "greenminds123"
+# Payment gateway backend. Set PAYMENT_GATEWAY=ecommerce_app.fake_gateway.FakeGateway
+# to run against the local stand-in (tuned via FAKE_GATEWAY) for load testing
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'ecommerce_app.phonepe_payments.PhonePeGateway')
 
 ALLOWED_HOSTS = []
 
@@ -70,8 +76,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ecommerce_app.query_budget.QueryBudgetMiddleware',
 ]
 
+# Per-endpoint SQL budgets (see ecommerce_app/query_budget.py).
+# 'off' disables the middleware, 'log' warns, 'raise' fails the request.
+QUERY_BUDGET_MODE = 'log' if DEBUG else 'off'
+
 ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
@@ -108,6 +119,39 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# Cached payloads and the version stamps that invalidate them (see
+# ecommerce_app/caching.py) must be shared by every web and worker process,
+# so the per-process local memory cache can't be used. Set REDIS_URL (e.g.
+# redis://127.0.0.1:6379/1, needs the redis package) to use Redis.
+#
+# Without it, development (DEBUG) falls back to the database cache table
+# created by migration 0021. That puts every version bump on the database
+# and its incr() is a read then a write, so two concurrent bumps can count as
+# one and leave stale entries until they expire - fine for a developer's
+# machine, not for production, which must set REDIS_URL.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'ecommerce_cache',
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+else:
+    raise ImproperlyConfigured("Set REDIS_URL: production needs a shared cache with atomic increments")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -194,6 +238,8 @@ SIMPLE_JWT = {
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # In production, specify your frontend domains
 CORS_ALLOW_CREDENTIALS = True
+# Checkout clients send an Idempotency-Key header (see ecommerce_app/idempotency.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 CSRF_COOKIE_SECURE = False
 
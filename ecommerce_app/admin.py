@@ -5,6 +5,7 @@ from .models import (
     ProductAttribute, Cart, CartItem, Wishlist, Coupon, CouponUsage, Order,
     OrderItem, Review, Notification
 )
+from .checkout import cancel_order
 
 from django import forms
 from ckeditor.widgets import CKEditorWidget
@@ -232,8 +233,8 @@ class OrderAdmin(admin.ModelAdmin):
     mark_as_delivered.short_description = 'Mark selected orders as Delivered'
     
     def mark_as_cancelled(self, request, queryset):
-        """Mark selected orders as cancelled"""
-        updated = queryset.update(status='cancelled')
+        """Mark selected orders as cancelled, giving back their stock"""
+        updated = sum(cancel_order(order) for order in queryset)
         self.message_user(request, f'{updated} order(s) marked as cancelled.')
     mark_as_cancelled.short_description = 'Mark selected orders as Cancelled'
 
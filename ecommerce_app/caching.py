@@ -0,0 +1,170 @@
+# caching.py
+# Version-stamped cache keys. Instead of tracking and deleting every cached
+# entry that depends on (say) products, each namespace has a version number
+# that is part of the cache key; bumping the version orphans the old entries
+# and they expire on their own.
+import hashlib
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'cache-version:{}'
+MODIFIED_KEY = 'cache-modified:{}'
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+BRANDS = 'brands'
+BANNERS = 'banners'
+COUPONS = 'coupons'
+
+
+def cart_namespace(cart_id):
+    """Per-cart namespace, bumped by CartItem writes"""
+    return f'cart-{cart_id}'
+
+
+def _clock_version():
+    # Seeding from the clock means an evicted counter can't restart at a value
+    # that old entries were stored under
+    return int(time.time() * 1000)
+
+
+def get_versions(namespaces):
+    """Current version of each namespace, in one cache round trip"""
+    keys = {namespace: VERSION_KEY.format(namespace) for namespace in namespaces}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for namespace, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            cache.add(key, _clock_version(), None)
+            version = cache.get(key, 0)
+        versions[namespace] = version
+    return versions
+
+
+def get_version(namespace):
+    return get_versions([namespace])[namespace]
+
+
+def get_last_modified(namespaces):
+    """Unix timestamp of the most recent bump across namespaces"""
+    keys = [MODIFIED_KEY.format(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Unknown (cache was cleared) - assume it changed now
+            now = int(time.time())
+            cache.add(key, now, None)
+            found[key] = cache.get(key, now)
+    return max(found.values())
+
+
+def _incr(namespace):
+    key = VERSION_KEY.format(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _clock_version(), None)
+    cache.set(MODIFIED_KEY.format(namespace), int(time.time()), None)
+
+
+def bump_version(*namespaces):
+    """
+    Invalidate everything cached under these namespaces.
+
+    Bumped immediately and again on commit: the second bump discards entries
+    a concurrent request may have rebuilt from pre-commit data.
+    """
+    for namespace in namespaces:
+        _incr(namespace)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda namespace=namespace: _incr(namespace))
+
+
+def versioned_key(prefix, namespaces, *parts):
+    """Cache key embedding the current version of each namespace plus a digest of parts"""
+    versions = '.'.join(f'{ns}{version}' for ns, version in get_versions(namespaces).items())
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return f'{prefix}:{versions}:{digest}'
+
+
+def get_or_build(key, build, timeout, lock_timeout=30, wait=5.0, poll=0.05):
+    """
+    Return the cached value for key, building it on a miss.
+
+    Single-flight: only the request that wins the cache.add() lock runs
+    build(); concurrent misses poll for its result instead of all hitting
+    the database at once. If the builder doesn't finish within `wait`
+    seconds (or dies), the waiter builds the value itself.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = build()
+            cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(poll)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            break
+
+    logger.warning(f"Cache rebuild of {key} did not complete in time, building locally")
+    value = build()
+    cache.set(key, value, timeout)
+    return value
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified for read endpoints whose output only depends on the
+    version-stamped `conditional_namespaces`, the query string and whether the
+    user is staff. A matching If-None-Match / If-Modified-Since gets a 304
+    before any queryset or serializer runs.
+    """
+    conditional_namespaces = []
+
+    def get_conditional_validators(self, request):
+        user = request.user
+        audience = 'staff' if user.is_authenticated and (user.is_staff or getattr(user, 'is_admin', False)) else 'public'
+        versions = sorted(get_versions(self.conditional_namespaces).items())
+        digest = hashlib.md5(repr((
+            type(self).__name__, request.path, sorted(request.query_params.lists()), audience, versions
+        )).encode('utf-8')).hexdigest()
+        return f'W/"{digest}"', get_last_modified(self.conditional_namespaces)
+
+    def conditional_get(self, request, build_response):
+        etag, last_modified = self.get_conditional_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = build_response()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Authorization', 'Cookie'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(request, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,166 @@
+# cart.py
+# Cart read path. The cart payload (items, variants, products, categories and
+# main images) is assembled in a constant number of queries and cached per
+# cart under a version stamp that CartItem writes bump. Product and variant
+# changes (price, images) bump the global products version, which is part of
+# the key too. Stock moves with every order, so it isn't trusted from the
+# cache: each read overlays the variants' current stock in one query.
+#
+# Reads never create a cart: a user without one gets the prebuilt empty
+# payload, and the Cart row is created by the first write that needs it, so
+# browsing doesn't take the database write lock.
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+from . import caching
+from .models import Cart, CartItem, ProductCard, ProductImage, ProductVariant
+from .pricing import ZERO
+from .serializers import CartSerializer
+
+CART_CACHE_TIMEOUT = 60 * 30
+
+EMPTY_CART_PAYLOAD = {'id': None, 'items': [], 'total': ZERO, 'created_at': None}
+
+
+def get_cart(user):
+    """The user's cart or None; never writes"""
+    return Cart.objects.filter(user=user).first()
+
+
+def get_or_create_cart(user):
+    """The user's cart, created on the first write that needs one"""
+    return Cart.objects.get_or_create(user=user)[0]
+
+
+def empty_cart_payload():
+    return {**EMPTY_CART_PAYLOAD, 'items': []}
+
+
+def cart_items_queryset():
+    return CartItem.objects.select_related(
+        'product_variant__product__category', 'product_variant__product__card'
+    ).order_by('pk')
+
+
+def load_cart(cart):
+    """Prefetch items with their variants, products, categories and cards (one query)"""
+    prefetch_related_objects([cart], Prefetch('items', queryset=cart_items_queryset()))
+    return cart
+
+
+def _main_image(product, request):
+    try:
+        url = product.card.main_image_url
+    except ProductCard.DoesNotExist:
+        image = ProductImage.objects.filter(product=product).order_by('pk').first()
+        url = image.image.url if image else None
+    return request.build_absolute_uri(url) if url else None
+
+
+def build_cart_payload(cart, request):
+    cart = load_cart(cart)
+    data = CartSerializer(cart).data
+    items_by_id = {item.pk: item for item in cart.items.all()}
+
+    for item_data in data['items']:
+        item = items_by_id.get(item_data['id'])
+        if item is None:
+            continue
+        product = item.product_variant.product
+        item_data['product'] = {
+            'id': str(product.id),
+            'name': product.name,
+            'slug': product.slug,
+            'description': product.description,
+            'category': {
+                'id': str(product.category.id),
+                'name': product.category.name,
+                'slug': product.category.slug
+            } if product.category else None,
+            'main_image': _main_image(product, request)
+        }
+    return data
+
+
+def with_current_stock(payload):
+    """Overwrite each line's variant stock with its current value"""
+    variants = [item['product_variant'] for item in payload['items']]
+    if not variants:
+        return payload
+    stock = dict(ProductVariant.objects.filter(pk__in=[v['id'] for v in variants]).values_list('pk', 'stock'))
+    for variant in variants:
+        variant['stock'] = stock.get(variant['id'], 0)
+    return payload
+
+
+def get_cart_payload(cart, request):
+    """Cached cart payload; absolute image URLs make it per scheme + host"""
+    cache_key = caching.versioned_key(
+        'cart', [caching.cart_namespace(cart.pk), caching.PRODUCTS], cart.pk, request.scheme, request.get_host()
+    )
+    payload = caching.get_or_build(cache_key, lambda: build_cart_payload(cart, request), CART_CACHE_TIMEOUT)
+    return with_current_stock(payload)
+
+
+class UnknownVariants(Exception):
+    def __init__(self, variant_ids):
+        self.variant_ids = sorted(variant_ids)
+        super().__init__(f"Unknown product variants: {self.variant_ids}")
+
+
+def apply_cart_operations(cart, operations):
+    """
+    Apply a list of {'op', 'product_variant_id', 'quantity'} operations in order:
+    add (increase quantity), set (replace quantity, 0 removes) and remove.
+
+    Variants are validated in one query and the resulting changes are written
+    with one bulk_create, one bulk_update and one delete inside a transaction.
+    Returns a {'created', 'updated', 'removed'} summary.
+    """
+    variant_ids = {operation['product_variant_id'] for operation in operations}
+    known = set(ProductVariant.objects.filter(pk__in=variant_ids).values_list('pk', flat=True))
+    if variant_ids - known:
+        raise UnknownVariants(variant_ids - known)
+
+    with transaction.atomic():
+        # Lock the cart row itself: locking its lines alone doesn't stop two
+        # batches from adding the same variant to a cart with no lines yet
+        Cart.objects.select_for_update().get(pk=cart.pk)
+        existing = {
+            item.product_variant_id: item
+            for item in CartItem.objects.select_for_update().filter(cart=cart)
+        }
+        quantities = {variant_id: item.quantity for variant_id, item in existing.items()}
+
+        for operation in operations:
+            variant_id = operation['product_variant_id']
+            if operation['op'] == 'add':
+                quantities[variant_id] = quantities.get(variant_id, 0) + operation['quantity']
+            elif operation['op'] == 'set' and operation['quantity'] > 0:
+                quantities[variant_id] = operation['quantity']
+            else:
+                quantities.pop(variant_id, None)
+
+        to_create = [
+            CartItem(cart=cart, product_variant_id=variant_id, quantity=quantity)
+            for variant_id, quantity in quantities.items() if variant_id not in existing
+        ]
+        to_update = []
+        for variant_id, item in existing.items():
+            if variant_id in quantities and quantities[variant_id] != item.quantity:
+                item.quantity = quantities[variant_id]
+                to_update.append(item)
+        to_remove = [item.pk for variant_id, item in existing.items() if variant_id not in quantities]
+
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+        if to_remove:
+            CartItem.objects.filter(pk__in=to_remove).delete()
+
+        # bulk_create and bulk_update skip the CartItem signals
+        if to_create or to_update:
+            caching.bump_version(caching.cart_namespace(cart.pk))
+
+    return {'created': len(to_create), 'updated': len(to_update), 'removed': len(to_remove)}
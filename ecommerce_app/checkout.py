@@ -0,0 +1,163 @@
+# checkout.py
+# Order creation pipeline shared by the COD and online checkout views:
+#   1. pricing.price_cart: the cart lines with their variants and products in
+#      one query, priced once per request (see pricing.py)
+#   2. check_product_discount / apply_coupon: the client's claimed discounts
+#      against those totals
+#   3. place_order: inside the caller's transaction, the order row, one bulk
+#      insert for its items, one guarded UPDATE taking the stock (see
+#      inventory.py), the coupon usage and one DELETE for the cart
+# Only step 3 runs inside the transaction, so write locks are held for a
+# handful of statements instead of the whole request.
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import caching, coupons, inventory
+from .models import CartItem, Coupon, CouponUsage, Order, OrderItem, StockReservation
+
+TOLERANCE = Decimal('0.01')
+
+
+class CheckoutError(Exception):
+    """A checkout that can't go ahead; `payload` is the 400 response body"""
+
+    def __init__(self, payload):
+        self.payload = payload
+        super().__init__(payload.get('error'))
+
+
+def check_product_discount(cart_pricing, claimed):
+    if abs(claimed - cart_pricing.product_discount) > TOLERANCE:
+        raise CheckoutError({
+            "error": "Product discount mismatch",
+            "expected": str(cart_pricing.product_discount),
+            "received": str(claimed)
+        })
+
+
+def apply_coupon(cart_pricing, coupon, user, claimed):
+    """
+    The cart priced with `coupon` (discount on the total after product
+    discounts), matched against the client's claim
+    """
+    if coupon is None:
+        return cart_pricing
+    if not coupon.is_valid(user=user, cart_total=cart_pricing.total):
+        raise CheckoutError({"error": "Coupon is no longer valid"})
+    if not coupons.get_rule_for(coupon).applies_to_lines(cart_pricing.lines):
+        raise CheckoutError({"error": "Coupon does not apply to the items in your cart"})
+
+    cart_pricing = cart_pricing.with_coupon(coupon)
+    if abs(cart_pricing.coupon_discount - claimed) > TOLERANCE:
+        raise CheckoutError({
+            "error": "Coupon discount mismatch",
+            "expected": str(cart_pricing.coupon_discount),
+            "received": str(claimed)
+        })
+    return cart_pricing
+
+
+def record_coupon_usage(user, coupon):
+    """
+    Record one use of `coupon` by `user`. Returns False if the user already
+    used it or its usage limit was reached in the meantime; the increment is
+    conditional so concurrent checkouts can't overshoot the limit.
+    """
+    try:
+        with transaction.atomic():
+            CouponUsage.objects.create(user=user, coupon=coupon)
+            if not Coupon.objects.filter(pk=coupon.pk, used_count__lt=F('usage_limit')).update(
+                used_count=F('used_count') + 1
+            ):
+                # Limit reached: don't keep a usage that wasn't counted
+                transaction.set_rollback(True)
+                return False
+    except IntegrityError:
+        return False
+    # `coupon` may be the index's copy with a stale used_count: read the new count
+    used_count, usage_limit = Coupon.objects.filter(pk=coupon.pk).values_list('used_count', 'usage_limit').get()
+    coupon.used_count = used_count
+    if used_count >= usage_limit:
+        # Used up: rebuild the coupon index so coupon checks report it (see coupons.py)
+        caching.bump_version(caching.COUPONS)
+    return True
+
+
+def place_order(user, address, cart_pricing, payment_method, record_coupon=True, clear_cart=True,
+                hold_stock=False):
+    """
+    Write the order and its items and take their stock. For orders that are
+    final on placement (COD) the stock is taken for good, the coupon use is
+    recorded and the priced cart lines are removed; online orders only hold
+    the stock (hold_stock=True) and leave the rest to the payment confirmation.
+
+    Must be called inside transaction.atomic() - a CheckoutError rolls the
+    whole order back. The coupon, if any, is the one `cart_pricing` was
+    priced with.
+    """
+    coupon = cart_pricing.coupon
+    order = Order.objects.create(
+        user=user,
+        address=address,
+        total_price=cart_pricing.final_price,
+        payment_method=payment_method,
+        status='pending',
+        coupon=coupon,
+        discount_amount=cart_pricing.total_discount
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product_variant=line.variant,
+            quantity=line.quantity,
+            price=line.effective_unit_price
+        )
+        for line in cart_pricing.lines
+    ])
+
+    try:
+        if hold_stock:
+            inventory.hold_stock(order, cart_pricing.quantities())
+        else:
+            inventory.reserve_stock(cart_pricing.quantities())
+    except inventory.OutOfStock as e:
+        raise CheckoutError({'error': 'Insufficient stock', 'product_variant_ids': e.variant_ids})
+
+    if coupon and record_coupon and not record_coupon_usage(user, coupon):
+        raise CheckoutError({'error': 'Coupon usage limit reached'})
+
+    if clear_cart:
+        # Only the lines that were priced: an item added meanwhile stays in the cart
+        CartItem.objects.filter(pk__in=[line.cart_item_id for line in cart_pricing.lines]).delete()
+
+    return order
+
+
+def cancel_order(order):
+    """
+    Cancel an order and give back the stock it took: an online order's held
+    or sold reservations are released, and the items of an order placed
+    without reservations (COD) are restocked. Returns False, changing
+    nothing, if the order was already cancelled.
+    """
+    with transaction.atomic():
+        current = Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).first()
+        if current in (None, 'cancelled'):
+            return False
+
+        if StockReservation.objects.filter(order=order).exists():
+            inventory.release_order_reservations(order, statuses=(inventory.HELD, inventory.COMMITTED))
+        else:
+            quantities = Counter()
+            items = OrderItem.objects.filter(order=order).values_list('product_variant_id', 'quantity')
+            for variant_id, quantity in items:
+                quantities[variant_id] += quantity
+            inventory.restock(quantities)
+
+        Order.objects.filter(pk=order.pk).update(status='cancelled', updated_at=timezone.now())
+        order.status = 'cancelled'
+    return True
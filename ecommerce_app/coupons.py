@@ -0,0 +1,132 @@
+# coupons.py
+# In-process coupon index. Coupon checks run on every keystroke of the coupon
+# box, so instead of a Coupon query (plus its category/product joins) per check
+# each process keeps every active coupon in memory, keyed by code, with the
+# products and categories (including subcategories) it applies to precomputed
+# as sets. Checking a cart against a coupon is then O(items) without queries.
+#
+# The index is rebuilt when the coupons or categories cache version changes
+# (Coupon and Category signals bump them) or after INDEX_MAX_AGE as a backstop
+# for changes made by other processes. Unknown codes are remembered in the
+# shared cache for NEGATIVE_TTL, so repeated invalid codes don't reach the
+# database either.
+import copy
+import threading
+import time
+
+from django.core.cache import cache
+
+from . import caching
+from .models import Category, Coupon
+
+NAMESPACES = [caching.COUPONS, caching.CATEGORIES]
+
+INDEX_MAX_AGE = 60 * 5
+NEGATIVE_TTL = 60
+
+_lock = threading.Lock()
+_index = None
+
+
+class CouponRule:
+    """A coupon with its applicability precomputed"""
+
+    def __init__(self, coupon, product_ids, category_ids):
+        self.coupon = coupon
+        self.product_ids = frozenset(product_ids)
+        self.category_ids = frozenset(category_ids)
+
+    @property
+    def is_restricted(self):
+        return bool(self.product_ids or self.category_ids)
+
+    def applies_to(self, product):
+        if not self.is_restricted:
+            return True
+        return product.pk in self.product_ids or product.category_id in self.category_ids
+
+    def applies_to_lines(self, lines):
+        """Whether any priced cart line (see pricing.py) is covered by the coupon"""
+        if not self.is_restricted:
+            return True
+        return any(self.applies_to(line.variant.product) for line in lines)
+
+
+class CouponIndex:
+    def __init__(self, versions, rules):
+        self.versions = versions
+        self.built_at = time.monotonic()
+        self.by_code = {rule.coupon.code: rule for rule in rules}
+        self.by_pk = {rule.coupon.pk: rule for rule in rules}
+
+    def is_current(self, versions):
+        return self.versions == versions and time.monotonic() - self.built_at < INDEX_MAX_AGE
+
+
+def build_index(versions):
+    """Every active coupon with its product and category sets (at most four queries)"""
+    coupons = list(
+        Coupon.objects.filter(is_active=True).prefetch_related('applicable_categories', 'applicable_products')
+    )
+    category_paths = None
+    if any(coupon.applicable_categories.all() for coupon in coupons):
+        category_paths = list(Category.objects.values_list('pk', 'path'))
+
+    rules = []
+    for coupon in coupons:
+        category_ids = set()
+        roots = [category.path for category in coupon.applicable_categories.all() if category.path]
+        if roots:
+            # The coupon covers the whole subtree of each of its categories
+            category_ids = {pk for pk, path in category_paths if path.startswith(tuple(roots))}
+        category_ids.update(category.pk for category in coupon.applicable_categories.all())
+        rules.append(CouponRule(coupon, [product.pk for product in coupon.applicable_products.all()], category_ids))
+    return CouponIndex(versions, rules)
+
+
+def get_index(force=False):
+    global _index
+    versions = caching.get_versions(NAMESPACES)
+    index = _index
+    if not force and index is not None and index.is_current(versions):
+        return index
+    with _lock:
+        # Another thread may have rebuilt it while this one waited
+        if not force and _index is not None and _index.is_current(versions):
+            return _index
+        _index = build_index(versions)
+        return _index
+
+
+def get_rule(code):
+    """The active coupon rule for `code`, or None"""
+    if not code or len(code) > Coupon._meta.get_field('code').max_length:
+        # No such coupon can exist; don't let arbitrary input into cache keys
+        return None
+    rule = get_index().by_code.get(code)
+    if rule is not None:
+        return rule
+
+    negative_key = caching.versioned_key('coupon-miss', NAMESPACES, code)
+    if cache.get(negative_key):
+        return None
+    # Not in this process' index: possibly created by another process since it was built
+    if Coupon.objects.filter(code=code, is_active=True).exists():
+        return get_index(force=True).by_code.get(code)
+    cache.set(negative_key, True, NEGATIVE_TTL)
+    return None
+
+
+def get_rule_for(coupon):
+    """The rule for a Coupon instance, or None if the coupon isn't active"""
+    rule = get_index().by_pk.get(coupon.pk)
+    if rule is None and coupon.is_active:
+        # Possibly activated by another process since the index was built
+        rule = get_index(force=True).by_pk.get(coupon.pk)
+    return rule
+
+
+def get_coupon(code):
+    """A private copy of the active coupon for `code` (safe to modify), or None"""
+    rule = get_rule(code)
+    return copy.copy(rule.coupon) if rule else None
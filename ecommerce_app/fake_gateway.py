@@ -0,0 +1,161 @@
+# fake_gateway.py
+# A local stand-in for PhonePe, for benchmarking online checkout offline.
+# Select it with PAYMENT_GATEWAY=ecommerce_app.fake_gateway.FakeGateway and
+# tune it through settings.FAKE_GATEWAY (keys as in DEFAULTS):
+#
+# - every call sleeps for a random latency in LATENCY_MS and errors out at
+#   FAILURE_RATE, like a slow or flaky gateway;
+# - a started payment settles WEBHOOK_DELAY_SECONDS later, to FAILED at
+#   DECLINE_RATE and COMPLETED otherwise, and the fake then POSTs a signed
+#   callback to WEBHOOK_URL - our own webhook - the way PhonePe does. With
+#   WEBHOOK_URL set to None no callback is sent and only status checks see
+#   the outcome.
+#
+# Orders live in this process's memory, so run the server as a single process
+# when load testing against it (see the loadtest_checkout command).
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from urllib import request as urllib_request
+
+from django.conf import settings
+
+from .payment_gateway import PaymentGateway
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'LATENCY_MS': (50, 250),
+    'FAILURE_RATE': 0.0,
+    'DECLINE_RATE': 0.0,
+    'WEBHOOK_DELAY_SECONDS': 2.0,
+    'WEBHOOK_URL': 'http://127.0.0.1:8000/api/payment/webhook/phonepe/',
+    'SEED': None,
+}
+
+
+def callback_authorization():
+    """The Authorization header PhonePe sends with callbacks: SHA256(username:password)"""
+    credentials = f"{settings.PHONEPE_WEBHOOK_USERNAME}:{settings.PHONEPE_WEBHOOK_PASSWORD}"
+    return hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+
+
+class FakeGateway(PaymentGateway):
+
+    def __init__(self, **overrides):
+        self.config = {**DEFAULTS, **getattr(settings, 'FAKE_GATEWAY', {}), **overrides}
+        self.random = random.Random(self.config['SEED'])
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def _simulate_call(self):
+        """Sleep like a network round trip; returns an error message for a simulated failure"""
+        with self.lock:
+            latency = self.random.uniform(*self.config['LATENCY_MS']) / 1000
+            failed = self.random.random() < self.config['FAILURE_RATE']
+        time.sleep(latency)
+        return "Fake gateway error" if failed else None
+
+    def pay(self, amount_in_paise, merchant_order_id, redirect_url):
+        error = self._simulate_call()
+        if error:
+            return {"success": False, "error": error}
+
+        delay = self.config['WEBHOOK_DELAY_SECONDS']
+        with self.lock:
+            outcome = 'FAILED' if self.random.random() < self.config['DECLINE_RATE'] else 'COMPLETED'
+            order = self.orders[merchant_order_id] = {
+                'pg_txn_id': f"FAKE{uuid.uuid4().hex[:16].upper()}",
+                'amount': amount_in_paise,
+                'state': 'PENDING',
+                'outcome': outcome,
+                'settles_at': time.monotonic() + delay,
+            }
+        if self.config['WEBHOOK_URL']:
+            timer = threading.Timer(delay, self._send_callback, args=(merchant_order_id,))
+            timer.daemon = True
+            timer.start()
+
+        # There is no hosted payment page: the customer "returns" straight away
+        return {
+            "success": True,
+            "redirect_url": redirect_url,
+            "merchant_order_id": merchant_order_id,
+            "pg_txn_id": order['pg_txn_id'],
+        }
+
+    def _settled(self, merchant_order_id):
+        with self.lock:
+            order = self.orders.get(merchant_order_id)
+            if order and order['state'] == 'PENDING' and time.monotonic() >= order['settles_at']:
+                order['state'] = order['outcome']
+            return dict(order) if order else None
+
+    def order_status(self, merchant_order_id, details=False):
+        error = self._simulate_call()
+        if error:
+            return {'success': False, 'error': f"Status check failed: {error}"}
+
+        order = self._settled(merchant_order_id)
+        if order is None:
+            return {'success': False, 'error': f"Status check failed: unknown order {merchant_order_id}"}
+        return {
+            'success': True,
+            'data': {
+                'orderId': order['pg_txn_id'],
+                'state': order['state'],
+                'amount': order['amount'],
+                'expireAt': None,
+                'metaInfo': None,
+                'errorCode': None,
+                'detailedErrorCode': None,
+                'paymentDetails': [] if details else None,
+            }
+        }
+
+    def _send_callback(self, merchant_order_id):
+        order = self._settled(merchant_order_id)
+        payload = {
+            'merchantTransactionId': merchant_order_id,
+            'transactionId': order['pg_txn_id'],
+            'state': order['state'],
+            'amount': order['amount'],
+            'timestamp': int(time.time() * 1000),
+        }
+        event = 'checkout.order.completed' if order['state'] == 'COMPLETED' else 'checkout.order.failed'
+        body = json.dumps({'event': event, 'payload': payload}).encode('utf-8')
+        callback = urllib_request.Request(
+            self.config['WEBHOOK_URL'], data=body, method='POST',
+            headers={'Content-Type': 'application/json', 'Authorization': callback_authorization()}
+        )
+        try:
+            with urllib_request.urlopen(callback, timeout=10) as response:
+                response.read()
+        except Exception as e:
+            logger.warning(f"Fake gateway callback for {merchant_order_id} failed: {e}")
+
+    def verify_callback(self, request):
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), callback_authorization()):
+            logger.warning("Invalid Authorization header in fake gateway callback")
+            return False, None
+        try:
+            data = json.loads(request.body)
+            payload = data['payload']
+            return True, {
+                'event': data['event'],
+                'state': payload['state'],
+                'merchant_transaction_id': payload['merchantTransactionId'],
+                'transaction_id': payload['transactionId'],
+                'amount': payload['amount'],
+                'expire_at': None,
+                'timestamp': payload.get('timestamp'),
+                '_raw': payload
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Malformed fake gateway callback: {e}")
+            return False, None
@@ -0,0 +1,198 @@
+# gateway_resilience.py
+# Building blocks payment_gateway wraps around every gateway call:
+#
+# - call_with_timeout() runs the call on a bounded pool and stops waiting at
+#   its latency budget, since neither the SDK nor a hung socket will; a call
+#   still queued behind hung ones when its budget runs out is dropped;
+# - CircuitBreaker watches recent calls and, once too many of them fail or
+#   are slow, fails calls fast for a cool-down period instead of letting
+#   request workers queue up behind a struggling gateway. After the cool-down
+#   one probe call is let through: success closes the breaker, failure opens
+#   it again;
+# - LatencyHistogram counts call latencies in fixed buckets, with outcomes,
+#   for the payment gateway metrics endpoint.
+#
+# All state is per process, like the gateway client itself.
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_call_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PAYMENT_GATEWAY_POOL_SIZE', 16), thread_name_prefix='payment-gateway'
+)
+
+
+def call_with_timeout(func, timeout, *args, **kwargs):
+    """
+    Run func(*args, **kwargs), raising concurrent.futures.TimeoutError after
+    `timeout` seconds. A call that hasn't started by then never starts, so a
+    payment the caller already gave up on can't be opened later; one that is
+    already running can't be stopped and finishes in the background.
+    """
+    deadline = time.monotonic() + timeout
+    abandoned = threading.Event()
+
+    def run():
+        if abandoned.is_set() or time.monotonic() >= deadline:
+            raise FutureTimeout()
+        return func(*args, **kwargs)
+
+    future = _call_pool.submit(run)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        abandoned.set()
+        future.cancel()
+        raise
+
+
+class CircuitBreaker:
+
+    def __init__(self, window_seconds=60, min_calls=10, error_rate=0.5, slow_call_seconds=3.0,
+                 slow_rate=0.5, open_seconds=30, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.clock = clock
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.trips = 0
+        self.calls = deque()  # (finished_at, ok, slow) within the window
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        while self.calls and self.calls[0][0] < now - self.window_seconds:
+            self.calls.popleft()
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        self.probing = False
+
+    def _cooling_down(self, now):
+        return self.state == OPEN and now - self.opened_at < self.open_seconds
+
+    def is_open(self):
+        """True while calls are being rejected (open and still cooling down)"""
+        with self.lock:
+            return self._cooling_down(self.clock())
+
+    def allow(self):
+        """Whether a call may go out now; a True in the half-open state reserves the probe"""
+        with self.lock:
+            now = self.clock()
+            if self._cooling_down(now):
+                return False
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def record(self, ok, elapsed):
+        """Record a finished call that allow() let through"""
+        slow = elapsed >= self.slow_call_seconds
+        with self.lock:
+            now = self.clock()
+            if self.state == HALF_OPEN:
+                if ok and not slow:
+                    self.state = CLOSED
+                    self.calls.clear()
+                    self.probing = False
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                # Started before the breaker tripped
+                return
+
+            self.calls.append((now, ok, slow))
+            self._prune(now)
+            if len(self.calls) >= self.min_calls:
+                errors = sum(1 for _, call_ok, _ in self.calls if not call_ok)
+                slows = sum(1 for _, _, call_slow in self.calls if call_slow)
+                if errors / len(self.calls) >= self.error_rate or slows / len(self.calls) >= self.slow_rate:
+                    self._open(now)
+
+    def retry_after(self):
+        """Seconds until a probe call is allowed, 0 if calls are allowed now"""
+        with self.lock:
+            now = self.clock()
+            if not self._cooling_down(now):
+                return 0
+            return max(self.open_seconds - (now - self.opened_at), 0)
+
+    def snapshot(self):
+        with self.lock:
+            now = self.clock()
+            self._prune(now)
+            calls = len(self.calls)
+            errors = sum(1 for _, ok, _ in self.calls if not ok)
+            slows = sum(1 for _, _, slow in self.calls if slow)
+            state = HALF_OPEN if self.state == OPEN and not self._cooling_down(now) else self.state
+            return {
+                'state': state,
+                'trips': self.trips,
+                'window_calls': calls,
+                'error_rate': round(errors / calls, 3) if calls else 0.0,
+                'slow_rate': round(slows / calls, 3) if calls else 0.0,
+                'retry_after_seconds': round(
+                    max(self.open_seconds - (now - self.opened_at), 0), 1
+                ) if self._cooling_down(now) else 0,
+            }
+
+
+class LatencyHistogram:
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.outcomes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, outcome):
+        elapsed_ms = seconds * 1000
+        with self.lock:
+            self.counts[bisect_left(self.BUCKETS_MS, elapsed_ms)] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def reject(self):
+        """Count a call the breaker refused; it has no latency"""
+        with self.lock:
+            self.outcomes['rejected'] = self.outcomes.get('rejected', 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            # Cumulative, Prometheus style: le_250 counts every call up to 250 ms
+            buckets, running = {}, 0
+            for bound, count in zip(self.BUCKETS_MS + ('inf',), self.counts):
+                running += count
+                buckets[f"le_{bound}"] = running
+            return {
+                'count': self.count,
+                'avg_ms': round(self.total_ms / self.count, 1) if self.count else 0.0,
+                'buckets_ms': buckets,
+                'outcomes': dict(self.outcomes),
+            }
@@ -0,0 +1,146 @@
+# idempotency.py
+# Idempotency-Key support for the checkout endpoints. The first request with
+# a given key claims an IdempotencyRecord and runs; its response is stored and
+# replayed for every retry with the same key within IDEMPOTENCY_WINDOW_SECONDS.
+# A duplicate that arrives while the first is still running polls for its
+# outcome instead of placing a second order (or opening a second payment
+# session). Reusing a key with a different body is rejected, and server
+# errors aren't stored so the client can retry them.
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+# A key held in progress longer than this is presumed abandoned (worker died) and can be claimed again
+LEASE = timedelta(minutes=2)
+POLL_SECONDS = 0.1
+
+
+def replay_window():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_WINDOW_SECONDS', 60 * 60 * 24))
+
+
+def wait_seconds():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+
+
+def request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode('utf-8')).hexdigest()
+
+
+def claim(user, endpoint, key, fingerprint):
+    """
+    Returns (record, True) if this request now owns the key, (record, False)
+    if another request does, or (None, False) if the record vanished meanwhile.
+    """
+    now = timezone.now()
+    fresh = {
+        'request_hash': fingerprint, 'status': IN_PROGRESS, 'response_status': None, 'response_body': None,
+        'locked_until': now + LEASE, 'expires_at': now + replay_window(),
+    }
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(user=user, endpoint=endpoint, key=key, **fresh), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyRecord.objects.filter(user=user, endpoint=endpoint, key=key).first()
+    if record is None:
+        return None, False
+    if record.expires_at <= now or (record.status == IN_PROGRESS and record.locked_until <= now):
+        # Expired, or its owner died: take it over, unless a concurrent retry got there first
+        taken = IdempotencyRecord.objects.filter(
+            pk=record.pk, status=record.status, locked_until=record.locked_until
+        ).update(**fresh)
+        record.refresh_from_db()
+        return record, bool(taken)
+    return record, False
+
+
+def replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def run_idempotent(request, endpoint, handler):
+    """Run handler() at most once per Idempotency-Key; without the header it just runs"""
+    key = request.headers.get(HEADER)
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    fingerprint = request_hash(request)
+    deadline = time.monotonic() + wait_seconds()
+    while True:
+        record, claimed = claim(request.user, endpoint, key, fingerprint)
+        if claimed:
+            break
+        if record is not None:
+            if record.request_hash != fingerprint:
+                return Response(
+                    {'error': f'{HEADER} was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status == COMPLETED:
+                return replay(record)
+            if time.monotonic() >= deadline:
+                return Response(
+                    {'error': f'A request with this {HEADER} is still being processed'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            time.sleep(POLL_SECONDS)
+
+    try:
+        response = handler()
+    except Exception:
+        record.delete()
+        raise
+
+    if response.status_code >= 500:
+        # Not a final outcome: let a retry with the same key run again
+        record.delete()
+        return response
+
+    record.status = COMPLETED
+    record.response_status = response.status_code
+    # Stored as rendered, so a replay is byte-for-byte what the first client got
+    record.response_body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+    record.save(update_fields=['status', 'response_status', 'response_body'])
+    return response
+
+
+def purge_expired(now=None):
+    deleted, _ = IdempotencyRecord.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
+
+class IdempotentMixin:
+    """
+    For APIViews whose POST must not run twice for the same Idempotency-Key:
+    post() wraps the real work with self.idempotent(request, handler).
+    """
+    idempotency_endpoint = None
+
+    def idempotent(self, request, handler):
+        return run_idempotent(request, self.idempotency_endpoint or type(self).__name__, handler)
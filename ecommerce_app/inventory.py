@@ -0,0 +1,145 @@
+# inventory.py
+# Stock reservation for checkout. Stock is taken with one guarded UPDATE for
+# all of an order's variants:
+#     UPDATE variant SET stock = stock - CASE id WHEN .. END
+#     WHERE id IN (..) AND stock >= CASE id WHEN .. END
+# so two buyers racing for the last unit can't both get it - the loser's
+# UPDATE matches fewer rows and the whole reservation is rolled back.
+#
+# COD orders take stock for good. Online orders hold it (StockReservation
+# rows) until the payment is confirmed (commit) or fails / expires (release).
+# Cancelling an order gives its stock back, committed reservations included.
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import caching
+from .models import ProductVariant, StockReservation
+
+logger = logging.getLogger(__name__)
+
+HELD = 'held'
+COMMITTED = 'committed'
+RELEASED = 'released'
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+
+
+class OutOfStock(Exception):
+    def __init__(self, variant_ids):
+        self.variant_ids = sorted(variant_ids)
+        super().__init__(f"Insufficient stock for product variants: {self.variant_ids}")
+
+
+def _per_variant(quantities):
+    return Case(
+        *[When(pk=variant_id, then=Value(quantity)) for variant_id, quantity in quantities.items()],
+        output_field=IntegerField()
+    )
+
+
+def reserve_stock(quantities):
+    """
+    Take {variant_id: quantity} off stock in one statement, all or nothing.
+    Raises OutOfStock listing the variants that can't cover their quantity.
+    """
+    quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+
+    with transaction.atomic():
+        updated = ProductVariant.objects.filter(
+            pk__in=quantities, stock__gte=_per_variant(quantities)
+        ).update(stock=F('stock') - _per_variant(quantities))
+        if updated != len(quantities):
+            # Undo the variants that did fit
+            transaction.set_rollback(True)
+
+    if updated != len(quantities):
+        available = dict(ProductVariant.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+        short = [variant_id for variant_id, quantity in quantities.items() if available.get(variant_id, 0) < quantity]
+        raise OutOfStock(short or quantities)
+
+    # The catalog payloads show variant stock
+    caching.bump_version(caching.PRODUCTS)
+
+
+def restock(quantities):
+    """Put {variant_id: quantity} back on stock in one statement"""
+    quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    ProductVariant.objects.filter(pk__in=quantities).update(stock=F('stock') + _per_variant(quantities))
+    caching.bump_version(caching.PRODUCTS)
+
+
+def hold_stock(order, quantities, ttl=None):
+    """Reserve stock for a pending order and record the hold so it can be committed or released"""
+    reserve_stock(quantities)
+    expires_at = timezone.now() + (ttl or reservation_ttl())
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+        for variant_id, quantity in quantities.items() if quantity > 0
+    ])
+
+
+def release_reservations(reservations, statuses=(HELD,)):
+    """
+    Return the stock of the reservations in `reservations` that are in one of
+    `statuses` (held ones by default; a cancelled paid order also gives back
+    its committed ones). Returns how many were released.
+    """
+    with transaction.atomic():
+        held = list(
+            reservations.select_for_update().filter(status__in=statuses)
+            .values_list('pk', 'product_variant_id', 'quantity')
+        )
+        if not held:
+            return 0
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in held]).update(
+            status=RELEASED, updated_at=timezone.now()
+        )
+        quantities = Counter()
+        for _, variant_id, quantity in held:
+            quantities[variant_id] += quantity
+        restock(quantities)
+    return len(held)
+
+
+def release_order_reservations(order, statuses=(HELD,)):
+    return release_reservations(StockReservation.objects.filter(order=order), statuses)
+
+
+def release_expired_reservations(now=None):
+    return release_reservations(StockReservation.objects.filter(expires_at__lte=now or timezone.now()))
+
+
+def commit_reservations(order):
+    """
+    The order is paid: its held stock is sold. If a hold already lapsed (or
+    was released by an earlier failure report) the stock is taken again when
+    available; otherwise the oversell is logged for manual follow-up.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        StockReservation.objects.filter(order=order, status=HELD).update(status=COMMITTED, updated_at=now)
+
+        lapsed = list(StockReservation.objects.select_for_update().filter(order=order, status=RELEASED))
+        if not lapsed:
+            return
+        quantities = Counter()
+        for reservation in lapsed:
+            quantities[reservation.product_variant_id] += reservation.quantity
+        try:
+            reserve_stock(quantities)
+        except OutOfStock as e:
+            logger.error(f"Order {order.id} was paid after its stock hold lapsed; variants {e.variant_ids} are oversold")
+            return
+        StockReservation.objects.filter(pk__in=[r.pk for r in lapsed]).update(status=COMMITTED, updated_at=now)
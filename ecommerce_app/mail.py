@@ -0,0 +1,91 @@
+# mail.py
+# Outgoing mail over a persistent SMTP connection per thread. Django's
+# send_mail() opens (and TLS-negotiates) a new connection for every message;
+# here each thread - a request worker or an outbox delivery thread - keeps
+# one connection open, checks it with NOOP after it has been idle, and
+# reconnects once if the server dropped it. Batches go out over a single
+# connection with send_messages().
+import logging
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+
+logger = logging.getLogger(__name__)
+
+# Idle connections are NOOP-checked before reuse; servers drop them after a while
+IDLE_CHECK_SECONDS = 30
+
+_local = threading.local()
+
+
+def _is_alive(connection):
+    smtp = getattr(connection, 'connection', None)
+    if smtp is None:
+        # Not an open SMTP connection (locmem/console backends): nothing to check
+        return True
+    try:
+        return smtp.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def get_thread_connection():
+    """This thread's open mail connection, (re)opened if missing or dead"""
+    connection = getattr(_local, 'connection', None)
+    now = time.monotonic()
+    if connection is not None and now - _local.last_used > IDLE_CHECK_SECONDS and not _is_alive(connection):
+        close_thread_connection()
+        connection = None
+    if connection is None:
+        connection = get_connection(fail_silently=False)
+        connection.open()
+        _local.connection = connection
+    _local.last_used = now
+    return connection
+
+
+def close_thread_connection():
+    connection = getattr(_local, 'connection', None)
+    _local.connection = None
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            logger.debug("Error closing mail connection", exc_info=True)
+
+
+def send_messages(messages):
+    """Send EmailMessages over this thread's connection; returns the number sent"""
+    if not messages:
+        return 0
+    try:
+        try:
+            return get_thread_connection().send_messages(messages) or 0
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Dropped between the health check and the send: reconnect once
+            close_thread_connection()
+            return get_thread_connection().send_messages(messages) or 0
+    except Exception:
+        # Don't reuse a connection left in an unknown state
+        close_thread_connection()
+        raise
+
+
+def build_message(subject, message, from_email, recipient_list, html_message=None):
+    email = EmailMultiAlternatives(subject, message, from_email or settings.DEFAULT_FROM_EMAIL, recipient_list)
+    if html_message:
+        email.attach_alternative(html_message, 'text/html')
+    return email
+
+
+def send_mail(subject, message, from_email, recipient_list, fail_silently=False, html_message=None):
+    """Drop-in for django.core.mail.send_mail that reuses the thread's connection"""
+    try:
+        return send_messages([build_message(subject, message, from_email, recipient_list, html_message)])
+    except Exception:
+        if not fail_silently:
+            raise
+        return 0
@@ -0,0 +1,146 @@
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce_app.checkout import place_order
+from ecommerce_app.models import (
+    Address, Cart, CartItem, Category, Order, OrderItem, Product, ProductVariant, User,
+)
+from ecommerce_app.pricing import price_cart
+
+
+def legacy_checkout(user, address):
+    """The pre-pipeline COD flow: everything in one transaction, one INSERT and two lazy loads per line"""
+    with transaction.atomic():
+        cart = Cart.objects.get(user=user)
+        cart_items = cart.items.all()
+        cart_items.exists()
+
+        subtotal = product_discount = Decimal('0.00')
+        for item in cart_items:
+            variant = item.product_variant
+            subtotal += variant.price * item.quantity
+            if variant.is_discount_active and variant.discount_price:
+                product_discount += (variant.price - variant.discount_price) * item.quantity
+
+        order = Order.objects.create(
+            user=user, address=address, total_price=subtotal - product_discount,
+            payment_method='cash_on_delivery', status='pending', discount_amount=product_discount
+        )
+        for item in cart_items:
+            OrderItem.objects.create(
+                order=order, product_variant=item.product_variant, quantity=item.quantity,
+                price=item.product_variant.price * item.quantity
+            )
+            item.product_variant.product.name
+        cart_items.delete()
+    return order
+
+
+class Timer:
+    def __init__(self):
+        self.ms = 0.0
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ms += (time.perf_counter() - start) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare checkout latency, transaction (lock-hold) time and query count of the legacy "
+        "per-line COD flow with the checkout pipeline for 1-, 10- and 50-line carts. Emails are "
+        "not sent. Generated rows are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Real transactions (not one rolled-back outer block), so the measured
+        # atomic() blocks are the ones that hold locks
+        self.seed(max(options['lines']))
+        try:
+            self.run(options['lines'], options['repeat'])
+        finally:
+            self.user.delete()
+            self.category.delete()
+            self.vendor.delete()
+        self.stdout.write("Generated rows deleted.")
+
+    def seed(self, line_count):
+        tag = uuid.uuid4().hex[:8]
+        self.vendor = User.objects.create_user(f'bench-vendor-{tag}@example.com', 'unused')
+        self.user = User.objects.create_user(f'bench-buyer-{tag}@example.com', 'unused')
+        self.address = Address.objects.create(
+            user=self.user, address_line1='1 Bench St', city='Pune', state='MH', zip_code='411001', country='India'
+        )
+        self.cart = Cart.objects.create(user=self.user)
+        self.category = Category.objects.create(name='Benchmark', slug=f'benchmark-{tag}')
+
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench product {i}', slug=f'bench-{tag}-{i}', description='',
+                    category=self.category, vendor=self.vendor)
+            for i in range(line_count)
+        ])
+        variants = []
+        for i, product in enumerate(products):
+            variant = ProductVariant(
+                product=product, size='100g', price=Decimal(100 + i), stock=1000, sku=f'{product.slug}-100',
+                is_discount_active=i % 3 == 0, discount_price=Decimal(90 + i) if i % 3 == 0 else None
+            )
+            variant.effective_price = variant.get_effective_price()
+            variants.append(variant)
+        self.variants = ProductVariant.objects.bulk_create(variants)
+
+    def fill_cart(self, line_count):
+        CartItem.objects.filter(cart=self.cart).delete()
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product_variant=variant, quantity=2)
+            for variant in self.variants[:line_count]
+        ])
+
+    def run_legacy(self):
+        total, locked = Timer(), Timer()
+        with CaptureQueriesContext(connection) as queries, total.measure(), locked.measure():
+            legacy_checkout(self.user, self.address)
+        return total.ms, locked.ms, len(queries)
+
+    def run_pipeline(self):
+        total, locked = Timer(), Timer()
+        with CaptureQueriesContext(connection) as queries, total.measure():
+            cart_pricing = price_cart(self.user)
+            with locked.measure(), transaction.atomic():
+                place_order(self.user, self.address, cart_pricing, payment_method='cash_on_delivery')
+        return total.ms, locked.ms, len(queries)
+
+    def measure(self, checkout, line_count, repeat):
+        results = []
+        for _ in range(repeat):
+            self.fill_cart(line_count)
+            results.append(checkout())
+        return [statistics.median(values) for values in zip(*results)]
+
+    def run(self, line_counts, repeat):
+        self.stdout.write(
+            f"{'lines':>6}{'legacy ms':>12}{'pipeline ms':>13}{'legacy txn ms':>15}{'pipeline txn ms':>17}"
+            f"{'legacy q':>10}{'pipeline q':>12}"
+        )
+        for line_count in line_counts:
+            legacy_ms, legacy_txn_ms, legacy_queries = self.measure(self.run_legacy, line_count, repeat)
+            pipeline_ms, pipeline_txn_ms, pipeline_queries = self.measure(self.run_pipeline, line_count, repeat)
+            self.stdout.write(
+                f"{line_count:>6}{legacy_ms:>12.1f}{pipeline_ms:>13.1f}{legacy_txn_ms:>15.1f}{pipeline_txn_ms:>17.1f}"
+                f"{legacy_queries:>10.0f}{pipeline_queries:>12.0f}"
+            )
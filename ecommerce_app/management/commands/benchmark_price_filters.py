@@ -0,0 +1,142 @@
+import random
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, DecimalField, Exists, Max, Min, OuterRef, Q, When
+from django.db.models.functions import Coalesce
+
+from ecommerce_app.models import Category, Product, ProductCard, ProductVariant, User
+
+
+def legacy_price_filter(queryset, min_price, max_price):
+    """The pre-effective_price filter: OR over discount columns through a join, then distinct"""
+    variant_filter = (
+        Q(variants__is_discount_active=True, variants__discount_price__gte=min_price) |
+        Q(variants__is_discount_active=False, variants__price__gte=min_price)
+    ) & (
+        Q(variants__is_discount_active=True, variants__discount_price__lte=max_price) |
+        Q(variants__is_discount_active=False, variants__price__lte=max_price)
+    )
+    return queryset.filter(variant_filter).distinct()
+
+
+def legacy_price_sort(queryset, descending=False):
+    effective = Case(
+        When(variants__is_discount_active=True, then=Coalesce('variants__discount_price', 'variants__price')),
+        default='variants__price',
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    )
+    if descending:
+        return queryset.annotate(max_effective_price=Max(effective)).order_by('-max_effective_price', 'id')
+    return queryset.annotate(min_effective_price=Min(effective)).order_by('min_effective_price', 'id')
+
+
+def indexed_price_filter(queryset, min_price, max_price):
+    """Same filter as ProductViewSet.apply_filters"""
+    return queryset.filter(card__max_price__gte=min_price, card__min_price__lte=max_price).filter(
+        Exists(ProductVariant.objects.filter(
+            product_id=OuterRef('pk'), effective_price__gte=min_price, effective_price__lte=max_price
+        ))
+    )
+
+
+def indexed_price_sort(queryset, descending=False):
+    if descending:
+        return queryset.order_by('-card__max_price', 'id')
+    return queryset.order_by('card__min_price', 'id')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the legacy join+distinct price filter/sort with the indexed effective-price "
+        "path on a generated catalog. All generated rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--variants', type=int, default=50000)
+        parser.add_argument('--per-product', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--min-price', type=Decimal, default=Decimal('200'))
+        parser.add_argument('--max-price', type=Decimal, default=Decimal('400'))
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['variants'], options['per_product'])
+            self.run(options)
+            transaction.set_rollback(True)
+        self.stdout.write("Generated catalog rolled back.")
+
+    def seed(self, variant_count, per_product):
+        rng = random.Random(42)
+        vendor = User.objects.create_user(f'bench-{uuid.uuid4().hex[:8]}@example.com', 'unused')
+        category = Category.objects.create(name='Benchmark', slug=f'benchmark-{uuid.uuid4().hex[:8]}')
+
+        product_count = max(1, variant_count // per_product)
+        self.stdout.write(f"Seeding {product_count} products / {product_count * per_product} variants...")
+        start = time.perf_counter()
+
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench product {i}', slug=f'bench-{category.slug}-{i}', description='',
+                    category=category, vendor=vendor)
+            for i in range(product_count)
+        ], batch_size=1000)
+
+        variants, cards = [], []
+        for product in products:
+            effective_prices = []
+            for j in range(per_product):
+                price = Decimal(rng.randrange(50, 1000))
+                discounted = rng.random() < 0.3
+                discount_price = (price * Decimal('0.8')).quantize(Decimal('0.01')) if discounted else None
+                variant = ProductVariant(
+                    product=product, size=f'{j}', price=price, stock=10,
+                    sku=f'{product.slug}-{j}', is_discount_active=discounted, discount_price=discount_price
+                )
+                variant.effective_price = variant.get_effective_price()
+                effective_prices.append(variant.effective_price)
+                variants.append(variant)
+            cards.append(ProductCard(
+                product=product, min_price=min(effective_prices), max_price=max(effective_prices),
+                variants_count=per_product
+            ))
+        ProductVariant.objects.bulk_create(variants, batch_size=1000)
+        ProductCard.objects.bulk_create(cards, batch_size=1000)
+        self.stdout.write(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    def time_query(self, build, repeat, page_size):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset = build()
+            count = queryset.count()
+            list(queryset.values_list('pk', flat=True)[:page_size])
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), count
+
+    def run(self, options):
+        base = Product.objects.filter(is_active=True)
+        low, high = options['min_price'], options['max_price']
+        repeat, page_size = options['repeat'], options['page_size']
+
+        cases = [
+            ('price filter', lambda: legacy_price_filter(base, low, high).order_by('-created_at', 'id'),
+             lambda: indexed_price_filter(base, low, high).order_by('-created_at', 'id')),
+            ('price sort asc', lambda: legacy_price_sort(base), lambda: indexed_price_sort(base)),
+            ('price sort desc', lambda: legacy_price_sort(base, True), lambda: indexed_price_sort(base, True)),
+        ]
+
+        self.stdout.write(f"{'case':<18}{'legacy ms':>12}{'indexed ms':>12}{'speedup':>10}{'rows':>10}")
+        for name, legacy, indexed in cases:
+            legacy_ms, legacy_count = self.time_query(legacy, repeat, page_size)
+            indexed_ms, indexed_count = self.time_query(indexed, repeat, page_size)
+            if legacy_count != indexed_count:
+                self.stdout.write(self.style.ERROR(
+                    f"{name}: row count mismatch (legacy {legacy_count}, indexed {indexed_count})"
+                ))
+            speedup = legacy_ms / indexed_ms if indexed_ms else 0
+            self.stdout.write(f"{name:<18}{legacy_ms:>12.1f}{indexed_ms:>12.1f}{speedup:>9.1f}x{indexed_count:>10}")
@@ -0,0 +1,168 @@
+import json
+import math
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib import error as urllib_error
+from urllib import request as urllib_request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from ecommerce_app.models import Address, ProductVariant, User
+
+FINAL_STATUSES = ('SUCCESS', 'FAILED')
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    return samples[max(math.ceil(pct / 100 * len(samples)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive online checkout -> webhook -> payment status against a running server at a "
+        "target rate and report p50/p95/p99 latencies. Meant for a server started with "
+        "PAYMENT_GATEWAY=ecommerce_app.fake_gateway.FakeGateway on a disposable database: "
+        "it creates load-test users and places real orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--rate', type=float, default=5.0, help='Checkouts started per second')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to keep starting checkouts')
+        parser.add_argument('--concurrency', type=int, default=32, help='Checkout flows in flight at most')
+        parser.add_argument('--variant', type=int, help='ProductVariant to buy (default: the most stocked one)')
+        parser.add_argument('--status-interval', type=float, default=1.0,
+                            help='Seconds between payment status polls')
+        parser.add_argument('--settle-timeout', type=float, default=60.0,
+                            help='Give up on a payment still pending after this many seconds')
+
+    def handle(self, *args, **options):
+        variant = self.get_variant(options['variant'])
+        self.base_url = options['base_url'].rstrip('/')
+        self.options = options
+        self.samples = {'cart-add': [], 'checkout-online': [], 'payment-status': [], 'settle': []}
+        self.outcomes = {}
+        self.lock = threading.Lock()
+
+        # A user can only check out one cart at a time, so each flow borrows one
+        users = queue.Queue()
+        for user, address_id in self.get_users(options['concurrency']):
+            users.put((str(RefreshToken.for_user(user).access_token), address_id))
+
+        total = int(options['rate'] * options['duration'])
+        interval = 1 / options['rate']
+        self.stdout.write(f"Starting {total} checkout(s) at {options['rate']}/s against {self.base_url}")
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for i in range(total):
+                # Open loop: start on schedule however slow earlier flows are
+                time.sleep(max(started + i * interval - time.monotonic(), 0))
+                pool.submit(self.run_flow, users, variant.pk)
+            launched = time.monotonic() - started
+        finished = time.monotonic() - started
+
+        self.report(total, launched, finished)
+
+    def get_variant(self, variant_id):
+        variants = ProductVariant.objects.filter(stock__gt=0)
+        variant = variants.filter(pk=variant_id).first() if variant_id else variants.order_by('-stock').first()
+        if variant is None:
+            raise CommandError("No product variant in stock to buy")
+        return variant
+
+    def get_users(self, count):
+        for i in range(count):
+            user, created = User.objects.get_or_create(
+                email=f"loadtest-{i}@example.com", defaults={'first_name': 'Load', 'last_name': f"Test {i}"}
+            )
+            if created:
+                user.set_unusable_password()
+                user.save()
+            address = Address.objects.filter(user=user).first() or Address.objects.create(
+                user=user, name='Load Test', phone='9999999999', address_line1='1 Test Street',
+                city='Pune', state='Maharashtra', zip_code='411001', country='India'
+            )
+            yield user, address.pk
+
+    def call(self, name, token, data, headers=None):
+        """POST to a named endpoint; returns (status_code, body) and records the latency"""
+        req = urllib_request.Request(
+            self.base_url + reverse(name), data=json.dumps(data).encode('utf-8'), method='POST',
+            headers={'Content-Type': 'application/json', 'Authorization': f"Bearer {token}", **(headers or {})}
+        )
+        started = time.monotonic()
+        try:
+            with urllib_request.urlopen(req, timeout=60) as response:
+                status_code, body = response.status, response.read()
+        except urllib_error.HTTPError as e:
+            status_code, body = e.code, e.read()
+        except OSError as e:
+            status_code, body = None, str(e).encode('utf-8')
+        self.record(name, time.monotonic() - started)
+        try:
+            return status_code, json.loads(body)
+        except ValueError:
+            return status_code, {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.samples[name].append(seconds * 1000)
+
+    def outcome(self, name):
+        with self.lock:
+            self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+    def run_flow(self, users, variant_id):
+        token, address_id = users.get()
+        try:
+            status_code, _ = self.call('cart-add', token, {'product_variant_id': variant_id, 'quantity': 1})
+            if status_code != 201:
+                return self.outcome(f"cart-add {status_code}")
+
+            status_code, body = self.call(
+                'checkout-online', token, {'address_id': address_id},
+                headers={'Idempotency-Key': uuid.uuid4().hex}
+            )
+            # 202: the gateway timed out and the payment is pending; its status settles it
+            if status_code not in (201, 202) or 'merchant_order_id' not in body:
+                return self.outcome(f"checkout {status_code}")
+
+            # The fake "redirects" straight back: poll like the payment status page does
+            started = time.monotonic()
+            deadline = started + self.options['settle_timeout']
+            while time.monotonic() < deadline:
+                time.sleep(self.options['status_interval'])
+                status_code, status_body = self.call(
+                    'payment-status', token, {'merchant_order_id': body['merchant_order_id']}
+                )
+                if status_code == 200 and status_body.get('status') in FINAL_STATUSES:
+                    self.record('settle', time.monotonic() - started)
+                    return self.outcome(status_body['status'].lower())
+            self.outcome('still pending')
+        except Exception as e:
+            self.outcome(f"error {type(e).__name__}")
+        finally:
+            users.put((token, address_id))
+
+    def report(self, total, launched, finished):
+        self.stdout.write(
+            f"\nStarted {total} checkout(s) in {launched:.1f}s ({total / max(launched, 0.001):.1f}/s), "
+            f"all done after {finished:.1f}s"
+        )
+        self.stdout.write(f"{'step':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, samples in self.samples.items():
+            samples = sorted(samples)
+            self.stdout.write(
+                f"{name:<18}{len(samples):>7}{percentile(samples, 50):>10.1f}{percentile(samples, 95):>10.1f}"
+                f"{percentile(samples, 99):>10.1f}{samples[-1] if samples else 0.0:>10.1f}"
+            )
+        outcomes = ', '.join(f"{count} {name}" for name, count in sorted(self.outcomes.items()))
+        self.stdout.write(self.style.SUCCESS(f"Outcomes: {outcomes or 'none'}"))
@@ -0,0 +1,48 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ecommerce_app import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued side effects (order emails) from the outbox table. Runs until "
+        "interrupted; failed messages are retried with exponential backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Delivery threads')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when nothing is due')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        total_claimed = total_delivered = 0
+        # One pool for the worker's lifetime so each thread keeps its SMTP connection
+        pool = ThreadPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        try:
+            while True:
+                claimed, delivered = outbox.drain(
+                    batch_size=options['batch_size'], workers=options['workers'],
+                    max_attempts=options['max_attempts'], pool=pool
+                )
+                total_claimed += claimed
+                total_delivered += delivered
+                if claimed:
+                    self.stdout.write(f"Delivered {delivered}/{claimed} message(s)")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {total_claimed} message(s), {total_delivered} delivered"
+        ))
@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ecommerce_app import webhook_inbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply stored PhonePe webhooks from the inbox table, in arrival order per order. Runs "
+        "until interrupted; failed events are retried with exponential backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent events (one per order)')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=webhook_inbox.MAX_ATTEMPTS)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when nothing is due')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        total_claimed = total_processed = 0
+        pool = ThreadPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        try:
+            while True:
+                claimed, processed = webhook_inbox.drain(
+                    batch_size=options['batch_size'], workers=options['workers'],
+                    max_attempts=options['max_attempts'], pool=pool
+                )
+                total_claimed += claimed
+                total_processed += processed
+                if claimed:
+                    self.stdout.write(f"Applied {processed}/{claimed} webhook(s)")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {total_claimed} webhook(s), {total_processed} applied"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce_app.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored checkout responses whose Idempotency-Key replay window has passed. "
+        "Run it daily (cron/scheduler)."
+    )
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency record(s)"))
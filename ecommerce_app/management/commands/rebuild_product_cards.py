@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce_app.models import Product, ProductCard
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized product cards used by catalog list endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', action='append', dest='products',
+                            help='Only rebuild the card for this product id (repeatable)')
+
+    def handle(self, *args, **options):
+        product_ids = options.get('products')
+        queryset = Product.objects.all()
+        if product_ids:
+            queryset = queryset.filter(pk__in=product_ids)
+
+        rebuilt = 0
+        for product_id in queryset.values_list('pk', flat=True).iterator(chunk_size=500):
+            ProductCard.refresh(product_id, create=True)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} product card(s)"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ecommerce_app import search
+
+
+class Command(BaseCommand):
+    help = "Drop and rebuild the full-text product search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not search.is_supported(connection):
+            self.stdout.write(self.style.WARNING(
+                f"Full-text search is not supported on '{connection.vendor}', "
+                "product search uses icontains lookups"
+            ))
+            return
+
+        with transaction.atomic():
+            indexed = search.rebuild(connection, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} product(s)"))
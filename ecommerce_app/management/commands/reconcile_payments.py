@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ecommerce_app import reconciliation
+
+
+class Command(BaseCommand):
+    help = (
+        "Check PENDING online payments with PhonePe and confirm or cancel their orders, for "
+        "payments whose webhook never arrived. Runs until interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent gateway status checks')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--min-age', type=int, default=int(reconciliation.MIN_AGE.total_seconds()),
+                            help='Only check payments started at least this many seconds ago')
+        parser.add_argument('--poll-interval', type=float, default=30.0,
+                            help='Seconds to sleep when nothing is due')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        min_age = timedelta(seconds=options['min_age'])
+        totals = {'checked': 0, 'success': 0, 'failed': 0}
+        pool = ThreadPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        try:
+            while True:
+                stats = reconciliation.reconcile_once(
+                    batch_size=options['batch_size'], workers=options['workers'], min_age=min_age, pool=pool
+                )
+                for key in totals:
+                    totals[key] += stats[key]
+                if stats['checked']:
+                    self.stdout.write(
+                        f"Checked {stats['checked']}: {stats['success']} paid, {stats['failed']} failed, "
+                        f"{stats['pending']} pending, {stats['skipped']} skipped, {stats['error']} error(s) "
+                        f"in {stats['duration_ms']} ms (gateway avg {stats['check_ms_avg']} ms, "
+                        f"max {stats['check_ms_max']} ms)"
+                    )
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {totals['checked']} payment(s): {totals['success']} paid, {totals['failed']} failed"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce_app.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Return the stock held for unpaid online orders whose reservation has expired. "
+        "Run it every few minutes (cron/scheduler)."
+    )
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired stock reservation(s)"))
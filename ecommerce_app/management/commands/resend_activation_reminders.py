@@ -0,0 +1,52 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from ecommerce_app.mail import send_messages
+from ecommerce_app.models import User
+from ecommerce_app.views import activation_reminder_message
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Email an activation reminder to every user who never activated their account "
+        "(inactive, with an unused activation token). Accounts deactivated by an admin "
+        "have no token and are skipped. Users are streamed in chunks and each chunk is "
+        "sent as one batch over a single SMTP connection."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help='Count recipients without sending')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        sent = failed = 0
+        last_pk = None
+
+        while True:
+            # Activation clears the token, so only never-activated accounts still have one
+            queryset = User.objects.filter(
+                is_active=False, activation_token__isnull=False
+            ).exclude(activation_token='').order_by('pk')
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            users = list(queryset[:chunk_size])
+            if not users:
+                break
+            last_pk = users[-1].pk
+
+            if options['dry_run']:
+                sent += len(users)
+                continue
+
+            try:
+                sent += send_messages([activation_reminder_message(user) for user in users])
+            except Exception as e:
+                failed += len(users)
+                logger.error(f"Activation reminder batch after {users[0].pk} failed: {e}")
+
+        verb = 'Would send' if options['dry_run'] else 'Sent'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sent} activation reminder(s), {failed} failed"))
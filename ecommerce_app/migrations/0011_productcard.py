@@ -0,0 +1,67 @@
+# Generated by Django 5.2 on 2026-10-18 12:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_product_cards(apps, schema_editor):
+    Product = apps.get_model('ecommerce_app', 'Product')
+    ProductVariant = apps.get_model('ecommerce_app', 'ProductVariant')
+    ProductImage = apps.get_model('ecommerce_app', 'ProductImage')
+    ProductCard = apps.get_model('ecommerce_app', 'ProductCard')
+
+    variants_by_product = {}
+    for variant in ProductVariant.objects.order_by('pk'):
+        variants_by_product.setdefault(variant.product_id, []).append(variant)
+
+    first_image = {}
+    for image in ProductImage.objects.order_by('pk'):
+        first_image.setdefault(image.product_id, image.image.name)
+
+    cards = []
+    for product_id in Product.objects.values_list('pk', flat=True):
+        variants = variants_by_product.get(product_id, [])
+        effective_prices = [
+            v.discount_price if v.is_discount_active and v.discount_price else v.price
+            for v in variants
+        ]
+        discounts = [v.discount_percentage or 0 for v in variants if v.is_discount_active]
+        first = variants[0] if variants else None
+        cards.append(ProductCard(
+            product_id=product_id,
+            min_price=min(effective_prices) if effective_prices else None,
+            max_price=max(effective_prices) if effective_prices else None,
+            price=first.price if first else None,
+            discount_price=first.discount_price if first and first.is_discount_active else None,
+            main_image=first_image.get(product_id, ''),
+            variants_count=len(variants),
+            has_discount=bool(discounts),
+            discount_percentage=max(discounts) if discounts else 0,
+        ))
+    ProductCard.objects.bulk_create(cards, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0010_alter_user_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='ecommerce_app.product')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('discount_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('main_image', models.CharField(blank=True, default='', max_length=255)),
+                ('variants_count', models.PositiveIntegerField(default=0)),
+                ('has_discount', models.BooleanField(default=False)),
+                ('discount_percentage', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_product_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from ecommerce_app import search
+
+    connection = schema_editor.connection
+    if not search.is_supported(connection):
+        return
+    search.create_index(connection)
+
+    Product = apps.get_model('ecommerce_app', 'Product')
+    products = Product.objects.using(connection.alias).select_related('category', 'brand')
+    search.write_documents(connection, products.iterator(chunk_size=500))
+
+
+def drop_search_index(apps, schema_editor):
+    from ecommerce_app import search
+
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0011_productcard'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 12:29
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_effective_price(apps, schema_editor):
+    ProductVariant = apps.get_model('ecommerce_app', 'ProductVariant')
+    ProductVariant.objects.update(effective_price=F('price'))
+    ProductVariant.objects.filter(
+        is_discount_active=True, discount_price__isnull=False
+    ).exclude(discount_price=0).update(effective_price=F('discount_price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0012_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(backfill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['min_price'], name='card_min_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['max_price'], name='card_max_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['product', 'effective_price'], name='variant_product_eff_price_idx'),
+        ),
+    ]
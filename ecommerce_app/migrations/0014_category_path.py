@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+def build_category_paths(apps, schema_editor):
+    Category = apps.get_model('ecommerce_app', 'Category')
+    categories = {c.pk: c for c in Category.objects.all()}
+    children = {}
+    for category in categories.values():
+        children.setdefault(category.parent_id if category.parent_id in categories else None, []).append(category)
+
+    # Walk down from the roots; anything unreachable (a parent cycle) becomes a root
+    stack = [(root, '') for root in children.get(None, [])]
+    visited = set()
+    while stack or len(visited) < len(categories):
+        if not stack:
+            orphan = next(c for pk, c in categories.items() if pk not in visited)
+            orphan.parent_id = None
+            stack.append((orphan, ''))
+        category, parent_path = stack.pop()
+        if category.pk in visited:
+            continue
+        visited.add(category.pk)
+        category.path = f'{parent_path}{category.pk.hex}/'
+        category.depth = category.path.count('/') - 1
+        stack.extend((child, category.path) for child in children.get(category.pk, []))
+
+    Category.objects.bulk_update(categories.values(), ['parent', 'path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0013_variant_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1000),
+        ),
+        migrations.RunPython(build_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2 on 2026-10-18 12:34
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_review_aggregates(apps, schema_editor):
+    Product = apps.get_model('ecommerce_app', 'Product')
+    Review = apps.get_model('ecommerce_app', 'Review')
+    stars = {f'rating_{star}': Count('pk', filter=Q(rating=star)) for star in range(1, 6)}
+    rows = Review.objects.values('product_id').annotate(count=Count('pk'), total=Sum('rating'), **stars)
+    for row in rows.iterator():
+        average = (Decimal(row['total']) / row['count']).quantize(Decimal('0.01')) if row['count'] else 0
+        Product.objects.filter(pk=row['product_id']).update(
+            reviews_count=row['count'], rating_sum=row['total'] or 0, average_rating=average,
+            **{f'rating_{star}': row[f'rating_{star}'] for star in range(1, 6)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0014_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_review_aggregates, migrations.RunPython.noop),
+    ]
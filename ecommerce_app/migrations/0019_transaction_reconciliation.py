@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0018_idempotency_records'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='next_reconcile_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='reconcile_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'created_at'], name='transaction_status_created_idx'),
+        ),
+    ]
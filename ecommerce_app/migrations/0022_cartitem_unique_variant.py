@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 13:32
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold duplicate lines of a variant into the cart's first line for it"""
+    CartItem = apps.get_model('ecommerce_app', 'CartItem')
+    items = CartItem.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        items.values('cart_id', 'product_variant_id')
+        .annotate(lines=Count('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        lines = items.filter(
+            cart_id=duplicate['cart_id'], product_variant_id=duplicate['product_variant_id']
+        ).order_by('pk')
+        keep = lines.first()
+        lines.exclude(pk=keep.pk).delete()
+        keep.quantity = duplicate['total']
+        keep.save(update_fields=['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce_app', '0021_cache_table'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product_variant'), name='unique_cart_variant'),
+        ),
+    ]
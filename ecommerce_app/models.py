@@ -1,13 +1,19 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils.text import slugify
+from django.utils import timezone
 from ckeditor.fields import RichTextField
-from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 import uuid
 import os
+from decimal import Decimal
 import shutil
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Concat, Substr
+from . import caching
 
 
 class UserManager(BaseUserManager):
@@ -105,6 +111,10 @@ class Category(models.Model):
     is_active = models.BooleanField(default=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     display_order = models.IntegerField(default=0)
+    # Materialized path: the hex ids of every ancestor and the category itself,
+    # each followed by '/'. Descendants of X are the rows whose path starts with X.path.
+    path = models.CharField(max_length=1000, db_index=True, editable=False, default='')
+    depth = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -113,11 +123,44 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def is_descendant_of(self, other):
+        return bool(other.path) and self.path.startswith(other.path)
+
+    def get_ancestor_ids(self):
+        """Ids of the ancestors, root first (excluding this category)"""
+        return [uuid.UUID(segment) for segment in self.path.split('/')[:-2]]
+
+    def get_descendants(self, include_self=True):
+        queryset = Category.objects.filter(path__startswith=self.path)
+        return queryset if include_self else queryset.exclude(pk=self.pk)
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+
+        parent_path = ''
+        if self.parent_id:
+            parent = Category.objects.only('path').get(pk=self.parent_id)
+            if self.parent_id == self.pk or (self.path and parent.path.startswith(self.path)):
+                raise ValidationError({'parent': 'A category cannot be moved under itself or one of its descendants.'})
+            parent_path = parent.path
+
+        old_path = self.path
+        self.path = f'{parent_path}{self.pk.hex}/'
+        self.depth = self.path.count('/') - 1
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'path', 'depth'}
         super().save(*args, **kwargs)
 
+        if old_path and old_path != self.path:
+            # Moved: rewrite the path prefix of the whole subtree in one statement
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - (old_path.count('/') - 1)),
+            )
+
 
 class Brand(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -141,11 +184,46 @@ class Product(models.Model):
     is_featured = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Review aggregates, maintained incrementally by the Review signals below
     reviews_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, db_index=True)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, f'rating_{star}') for star in range(1, 6)}
+
+    @staticmethod
+    def apply_review_delta(product_id, rating, sign):
+        """
+        Add (sign=1) or remove (sign=-1) one review of `rating` stars from the
+        product's aggregates in a single UPDATE, so concurrent reviews can't
+        lose each other's counts.
+        """
+        count = F('reviews_count') + sign
+        total = F('rating_sum') + sign * rating
+        values = {
+            'reviews_count': count,
+            'rating_sum': total,
+            # Evaluated against the pre-update row, like the other F() deltas
+            'average_rating': Case(
+                When(reviews_count__lte=-sign, then=Value(0)),
+                default=Cast(total, FloatField()) / Cast(count, FloatField()),
+                output_field=models.DecimalField(max_digits=3, decimal_places=2)
+            ),
+        }
+        if 1 <= rating <= 5:
+            values[f'rating_{rating}'] = F(f'rating_{rating}') + sign
+        Product.objects.filter(pk=product_id).update(**values)
+
     def save(self, *args, **kwargs):
         is_new = self.pk is None
         old_name = None
@@ -239,10 +317,29 @@ class ProductVariant(models.Model):
     is_discount_active = models.BooleanField(default=False)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     discount_percentage = models.PositiveIntegerField(blank=True, null=True)
+    # Maintained in save(): discount_price while a discount is active, else price
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'effective_price'], name='variant_product_eff_price_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.size}"
 
+    def get_effective_price(self):
+        if self.is_discount_active and self.discount_price:
+            return self.discount_price
+        return self.price
+
+    def save(self, *args, **kwargs):
+        self.effective_price = self.get_effective_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'effective_price' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['effective_price']
+        super().save(*args, **kwargs)
+
 
 def product_image_upload_path(instance, filename):
     """
@@ -266,6 +363,80 @@ class ProductImage(models.Model):
         return f"Image for {self.product.name}"
 
 
+class ProductCard(models.Model):
+    """
+    Denormalized read model used by ProductListSerializer so catalog list
+    endpoints don't have to query variants/images once per product.
+    Kept current by the ProductVariant / ProductImage signals below.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    main_image = models.CharField(max_length=255, blank=True, default='')
+    variants_count = models.PositiveIntegerField(default=0)
+    has_discount = models.BooleanField(default=False)
+    discount_percentage = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['min_price'], name='card_min_price_idx'),
+            models.Index(fields=['max_price'], name='card_max_price_idx'),
+        ]
+
+    def __str__(self):
+        return f"Card for {self.product_id}"
+
+    @property
+    def main_image_url(self):
+        if not self.main_image:
+            return None
+        return ProductImage._meta.get_field('image').storage.url(self.main_image)
+
+    @staticmethod
+    def compute(product_id):
+        """Build the card values for a product from its variants and first image"""
+        variants = list(
+            ProductVariant.objects.filter(product_id=product_id).order_by('pk').values(
+                'price', 'is_discount_active', 'discount_price', 'discount_percentage', 'effective_price'
+            )
+        )
+        main_image = ProductImage.objects.filter(product_id=product_id).order_by('pk').values_list(
+            'image', flat=True
+        ).first()
+
+        effective_prices = [v['effective_price'] for v in variants]
+        discounts = [v['discount_percentage'] or 0 for v in variants if v['is_discount_active']]
+        first = variants[0] if variants else None
+
+        return {
+            'min_price': min(effective_prices) if effective_prices else None,
+            'max_price': max(effective_prices) if effective_prices else None,
+            'price': first['price'] if first else None,
+            'discount_price': first['discount_price'] if first and first['is_discount_active'] else None,
+            'main_image': main_image or '',
+            'variants_count': len(variants),
+            'has_discount': bool(discounts),
+            'discount_percentage': max(discounts) if discounts else 0,
+        }
+
+    @classmethod
+    def refresh(cls, product_id, create=False):
+        """
+        Recompute the card for a product. Signals only update existing cards
+        (create=False) so a cascading product delete can't resurrect one.
+        """
+        values = cls.compute(product_id)
+        if cls.objects.filter(product_id=product_id).update(updated_at=timezone.now(), **values):
+            return None
+        if create and Product.objects.filter(pk=product_id).exists():
+            card, _ = cls.objects.update_or_create(product_id=product_id, defaults=values)
+            return card
+        return None
+
+
 class ProductAttribute(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='attributes')
     attribute_type = models.CharField(max_length=100)
@@ -288,6 +459,12 @@ class CartItem(models.Model):
     product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # One line per variant: adding an existing variant increases its quantity
+            models.UniqueConstraint(fields=['cart', 'product_variant'], name='unique_cart_variant'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product_variant.product.name} - {self.product_variant.size}"
 
@@ -326,6 +503,29 @@ class Coupon(models.Model):
     def __str__(self):
         return self.code
 
+    def is_valid(self, user=None, cart_total=None):
+        """Active, in its validity window, under its usage limit and not yet used by `user`"""
+        now = timezone.now()
+        if not self.is_active or now < self.valid_from or now > self.valid_to:
+            return False
+        if self.used_count >= self.usage_limit:
+            return False
+        if cart_total is not None and cart_total < self.min_purchase_amount:
+            return False
+        if user is not None and self.usages.filter(user=user).exists():
+            return False
+        return True
+
+    def calculate_discount(self, amount):
+        """Discount on `amount`: percentage capped at max_discount, or flat capped at the amount"""
+        if self.discount_type == 'percent':
+            discount = amount * self.discount_value / Decimal('100')
+            if self.max_discount and discount > self.max_discount:
+                discount = self.max_discount
+        else:
+            discount = min(self.discount_value, amount)
+        return discount.quantize(Decimal('0.01'))
+
 
 class CouponUsage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coupon_usages')
@@ -420,6 +620,9 @@ class Transaction(models.Model):
     pg_response_message = models.TextField(blank=True, null=True)
     pg_response_payload = models.JSONField(null=True, blank=True)
     payment_response = models.JSONField(null=True, blank=True)
+    # Background reconciliation (see reconciliation.py): status checks made and when the next is due
+    reconcile_attempts = models.PositiveIntegerField(default=0)
+    next_reconcile_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -429,6 +632,123 @@ class Transaction(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Transactions"
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='transaction_status_created_idx'),
+        ]
+
+
+class StockReservation(models.Model):
+    """Stock taken off a variant for a pending online order until its payment settles or the hold expires"""
+    STATUS_CHOICES = [
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations')
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='stock_reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_exp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_variant} for Order {self.order_id} ({self.status})"
+
+
+class OutboxMessage(models.Model):
+    """A side effect (e.g. an email) written in the same transaction as the change that triggers it"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk} ({self.status})"
+
+
+class PaymentWebhookEvent(models.Model):
+    """A verified PhonePe callback, stored on receipt and applied by the process_payment_webhooks worker"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    merchant_order_id = models.CharField(max_length=255)
+    state = models.CharField(max_length=50)
+    phonepe_transaction_id = models.CharField(max_length=255, blank=True, null=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            # PhonePe retries callbacks: one event per order and state
+            models.UniqueConstraint(fields=['merchant_order_id', 'state'], name='unique_webhook_event'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='webhook_status_received_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.merchant_order_id} {self.state} ({self.status})"
+
+
+class IdempotencyRecord(models.Model):
+    """The outcome of a request sent with an Idempotency-Key, replayed for retries of it"""
+    STATUS_CHOICES = [
+        ('in_progress', 'In Progress'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_records')
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    locked_until = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status})"
 
 class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews')
@@ -546,11 +866,164 @@ def delete_product_folder(sender, instance, **kwargs):
         print(f"Error deleting product folder: {e}")
 
 
-@receiver([post_save, post_delete], sender=Review)
-def update_product_reviews_count(sender, instance, **kwargs):
+@receiver(pre_save, sender=Review)
+def remember_previous_review_rating(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored rating/product so post_save can apply the difference.
+    """
+    instance._previous_review = None
+    if not raw and instance.pk:
+        instance._previous_review = Review.objects.filter(pk=instance.pk).values('rating', 'product_id').first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_product_aggregates(sender, instance, created, raw=False, **kwargs):
+    """
+    Update the product's review count, rating sum and histogram with F() deltas.
+    """
+    if raw:
+        return
+    previous = getattr(instance, '_previous_review', None)
+    if not created and previous:
+        if previous['rating'] == instance.rating and previous['product_id'] == instance.product_id:
+            return
+        Product.apply_review_delta(previous['product_id'], previous['rating'], -1)
+    Product.apply_review_delta(instance.product_id, instance.rating, 1)
+    caching.bump_version(caching.PRODUCTS)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_product_aggregates(sender, instance, **kwargs):
+    Product.apply_review_delta(instance.product_id, instance.rating, -1)
+    caching.bump_version(caching.PRODUCTS)
+
+# ============================================================================
+# SIGNALS FOR PRODUCT CARD READ MODEL
+# ============================================================================
+
+@receiver(post_save, sender=Product)
+def create_product_card(sender, instance, created, raw=False, **kwargs):
+    """
+    Create the (empty) product card when a product is created.
+    """
+    if created and not raw:
+        ProductCard.refresh(instance.pk, create=True)
+
+
+@receiver([post_save, post_delete], sender=ProductVariant)
+@receiver([post_save, post_delete], sender=ProductImage)
+def refresh_product_card(sender, instance, raw=False, **kwargs):
+    """
+    Recompute the product card when a variant or image changes.
+    """
+    if raw:
+        return
+    ProductCard.refresh(instance.product_id)
+
+# ============================================================================
+# SIGNALS FOR FULL-TEXT SEARCH INDEX
+# ============================================================================
+
+SEARCH_INDEXED_FIELDS = {'name', 'description', 'category', 'brand'}
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Keep the product's search document in sync. Saves that only touch
+    non-indexed fields (e.g. reviews_count) are skipped.
+    """
+    if raw or (update_fields and not SEARCH_INDEXED_FIELDS.intersection(update_fields)):
+        return
+    from . import search
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    from . import search
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Brand)
+def reindex_products_for_search(sender, instance, created, raw=False, **kwargs):
+    """
+    Category and brand names are part of the product documents.
+    """
+    if created or raw:
+        return
+    from . import search
+    lookup = 'category' if sender is Category else 'brand'
+    product_ids = Product.objects.filter(**{lookup: instance}).values_list('pk', flat=True)
+    search.index_products(list(product_ids))
+
+# ============================================================================
+# SIGNALS FOR CACHE VERSIONS
+# ============================================================================
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductVariant)
+@receiver([post_save, post_delete], sender=ProductImage)
+def bump_products_cache_version(sender, raw=False, **kwargs):
+    if not raw:
+        caching.bump_version(caching.PRODUCTS)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def bump_categories_cache_version(sender, raw=False, **kwargs):
+    if not raw:
+        caching.bump_version(caching.CATEGORIES)
+
+
+@receiver([post_save, post_delete], sender=Brand)
+def bump_brands_cache_version(sender, raw=False, **kwargs):
+    if not raw:
+        caching.bump_version(caching.BRANDS)
+
+
+@receiver([post_save, post_delete], sender=PromotionalBanner)
+def bump_banners_cache_version(sender, raw=False, **kwargs):
+    if not raw:
+        caching.bump_version(caching.BANNERS)
+
+
+@receiver([post_save, post_delete], sender=Coupon)
+@receiver(m2m_changed, sender=Coupon.applicable_categories.through)
+@receiver(m2m_changed, sender=Coupon.applicable_products.through)
+def bump_coupons_cache_version(sender, raw=False, action=None, **kwargs):
+    if raw or (action is not None and not action.startswith('post_')):
+        return
+    caching.bump_version(caching.COUPONS)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def bump_cart_cache_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        caching.bump_version(caching.cart_namespace(instance.cart_id))
+
+
+# ============================================================================
+# SIGNALS FOR STOCK RESERVATIONS
+# ============================================================================
+
+@receiver(pre_delete, sender=Order)
+def release_deleted_order_stock(sender, instance, **kwargs):
+    """Held stock would otherwise vanish with the order's reservations"""
+    from . import inventory
+    inventory.release_order_reservations(instance)
+
+
+# ============================================================================
+# SIGNALS FOR CATEGORY TREE
+# ============================================================================
+
+@receiver(pre_delete, sender=Category)
+def reroot_child_categories(sender, instance, **kwargs):
     """
-    Update product reviews count when a review is added or deleted.
+    Children of a deleted category become roots (parent is SET_NULL);
+    re-save them so their subtree paths stay consistent.
     """
-    product = instance.product
-    product.reviews_count = product.reviews.count()
-    product.save(update_fields=['reviews_count'])
\ No newline at end of file
+    for child in Category.objects.filter(parent=instance):
+        child.parent = None
+        child.save()
@@ -0,0 +1,149 @@
+# outbox.py
+# Transactional outbox. Side effects that talk to the outside world (emails)
+# are written as OutboxMessage rows in the same transaction as the order
+# change that causes them, so they commit or roll back with it and requests
+# never wait on SMTP. The process_outbox command drains the table: it claims
+# due messages, runs their handlers on a thread pool and retries failures
+# with exponential backoff. A message is leased to one worker at a time, and
+# only the worker holding the lease records its outcome (see take_leases).
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+SENT = 'sent'
+FAILED = 'failed'
+
+# topic -> dotted path of a callable taking the message payload
+HANDLERS = {
+    'order.confirmation_email': 'ecommerce_app.views.deliver_order_confirmation_email',
+    'order.admin_email': 'ecommerce_app.views.deliver_new_order_admin_email',
+    'order.status_email': 'ecommerce_app.views.deliver_order_status_email',
+}
+
+MAX_ATTEMPTS = 8
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 60 * 60
+# A claimed message whose worker died becomes claimable again after this
+LEASE = timedelta(minutes=5)
+
+
+def enqueue(topic, payload, delay=None):
+    """Record a side effect; call inside the transaction that makes it necessary"""
+    if topic not in HANDLERS:
+        raise ValueError(f"Unknown outbox topic: {topic}")
+    return OutboxMessage.objects.create(
+        topic=topic, payload=payload, available_at=timezone.now() + (delay or timedelta())
+    )
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def take_leases(model, rows, seen_fields, **changes):
+    """
+    Apply `changes` (the lease) to rows read for claiming inside the current
+    transaction and return the ones this worker won. Without SKIP LOCKED
+    (SQLite) two workers can read the same rows before either writes, so each
+    row is only taken if its `seen_fields` are still what was read.
+    """
+    if not rows:
+        return []
+    if connection.features.has_select_for_update_skip_locked:
+        # Read with select_for_update(skip_locked=True): nobody else has them
+        model.objects.filter(pk__in=[row.pk for row in rows]).update(**changes)
+        won = rows
+    else:
+        won = [
+            row for row in rows
+            if model.objects.filter(pk=row.pk, **{field: getattr(row, field) for field in seen_fields}).update(**changes)
+        ]
+    for row in won:
+        for field, value in changes.items():
+            setattr(row, field, value)
+    return won
+
+
+def claim(batch_size, lease=LEASE):
+    """Mark up to batch_size due messages as processing and return them"""
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = OutboxMessage.objects.filter(
+            Q(status=PENDING, available_at__lte=now) | Q(status=PROCESSING, locked_until__lte=now)
+        ).order_by('available_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            # Concurrent workers take different rows instead of queueing on the same ones
+            queryset = queryset.select_for_update(skip_locked=True)
+        return take_leases(
+            OutboxMessage, list(queryset[:batch_size]), ('status', 'locked_until'),
+            status=PROCESSING, locked_until=now + lease
+        )
+
+
+def _owned(message):
+    """The message, if this worker's lease on it still holds"""
+    return OutboxMessage.objects.filter(pk=message.pk, status=PROCESSING, locked_until=message.locked_until)
+
+
+def deliver(message, max_attempts=MAX_ATTEMPTS):
+    """Run the message's handler and record the outcome; returns True if it succeeded"""
+    attempts = message.attempts + 1
+    try:
+        import_string(HANDLERS[message.topic])(message.payload)
+    except Exception as e:
+        if attempts >= max_attempts:
+            logger.error(f"Outbox message {message.pk} ({message.topic}) failed permanently: {e}")
+            changes = {'status': FAILED, 'processed_at': timezone.now()}
+        else:
+            logger.warning(f"Outbox message {message.pk} ({message.topic}) failed, attempt {attempts}: {e}")
+            changes = {'status': PENDING, 'available_at': timezone.now() + backoff(attempts)}
+        if not _owned(message).update(attempts=attempts, locked_until=None, last_error=str(e), **changes):
+            logger.warning(f"Outbox message {message.pk} was re-claimed by another worker; outcome not recorded")
+        return False
+
+    if not _owned(message).update(
+        status=SENT, attempts=attempts, locked_until=None, last_error='', processed_at=timezone.now()
+    ):
+        logger.warning(f"Outbox message {message.pk} was re-claimed by another worker; outcome not recorded")
+    return True
+
+
+def _deliver_in_thread(message, max_attempts):
+    try:
+        return deliver(message, max_attempts)
+    finally:
+        connection.close()
+
+
+def drain(batch_size=50, workers=4, max_attempts=MAX_ATTEMPTS, pool=None):
+    """
+    Claim one batch of due messages and deliver it, on a thread pool when
+    workers > 1. Pass a long-lived `pool` to keep each thread's SMTP
+    connection (see mail.py) open across batches. Returns (claimed, delivered).
+    """
+    messages = claim(batch_size)
+    if not messages:
+        return 0, 0
+    if pool is None and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return _drain_claimed(messages, max_attempts, pool)
+    return _drain_claimed(messages, max_attempts, pool)
+
+
+def _drain_claimed(messages, max_attempts, pool=None):
+    if pool is not None:
+        results = list(pool.map(lambda message: _deliver_in_thread(message, max_attempts), messages))
+    else:
+        results = [deliver(message, max_attempts) for message in messages]
+    return len(messages), results.count(True)
@@ -0,0 +1,194 @@
+# pagination.py
+# Opt-in keyset (cursor) pagination for the product and order listings.
+# The default stays PageNumberPagination so existing clients are unaffected;
+# ?pagination=cursor (or any ?cursor=) switches to keyset mode, which pages
+# with a WHERE on the last row's sort key instead of COUNT(*) + OFFSET.
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import F, Q
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_CACHE_TIMEOUT = 60
+
+
+def _encode_value(value):
+    # Full precision on purpose: a truncated timestamp would skip or repeat rows
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+class KeysetPagination:
+    """
+    Keyset pagination over whatever ordering the view already applied.
+
+    The queryset's order_by (or the model's Meta.ordering) is used as the sort
+    key, with `id` appended as a unique tie-breaker if it's missing. Fields can
+    be concrete, related (`category__name`) or annotations (`min_effective_price`).
+    NULLs sort last in both directions so the keyset condition stays simple.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+        self.next_values = None
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        fields = []
+        for field in ordering:
+            if not isinstance(field, str):
+                # Expressions can't be turned back into a keyset; fall back to the default
+                return [('created_at', True), ('id', False)]
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            fields.append(('id' if name == 'pk' else name, descending))
+        if not any(name == 'id' for name, _ in fields):
+            fields.append(('id', False))
+        return fields
+
+    def decode_cursor(self, request, ordering):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound('Invalid cursor')
+        return values
+
+    def encode_cursor(self, values):
+        payload = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def keyset_filter(self, ordering, values):
+        """Rows strictly after `values` in `ordering` (NULLs last)"""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending), value in zip(ordering, values):
+            if value is None:
+                # Only rows with NULL here (and later tie-breakers) can follow
+                after = Q(pk__in=[])
+                same = Q(**{f'{name}__isnull': True})
+            else:
+                lookup = 'lt' if descending else 'gt'
+                after = Q(**{f'{name}__{lookup}': value}) | Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+            condition |= equal & after
+            equal &= same
+        return condition
+
+    @staticmethod
+    def row_value(obj, name):
+        value = obj
+        for part in name.split('__'):
+            value = getattr(value, part, None)
+            if value is None:
+                return None
+        return value
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(queryset)
+        order_by = [
+            F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True)
+            for name, descending in ordering
+        ]
+        queryset = queryset.order_by(*order_by)
+
+        values = self.decode_cursor(request, ordering)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        page = rows[:self.page_size]
+        if len(rows) > self.page_size:
+            self.next_values = [self.row_value(page[-1], name) for name, _ in ordering]
+        return page
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, 'cursor')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_values))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class PageNumberOrKeysetPagination(PageNumberPagination):
+    """
+    PageNumberPagination by default; keyset pagination when the client sends
+    ?pagination=cursor or a ?cursor= token. Keyset pages have no `count` -
+    use the view's /meta/count/ action for a (cached) total.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (request.query_params.get(KeysetPagination.mode_query_param) == 'cursor'
+                or request.query_params.get(KeysetPagination.cursor_query_param)):
+            if self.page_size is None:
+                return None
+            self.keyset = KeysetPagination(self.page_size)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    COUNT(*) for a queryset, cached briefly per distinct SQL statement.
+    Returns (count, from_cache).
+    """
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        # Can't match anything (e.g. pk__in=[]): Django doesn't even build the SQL
+        return 0, False
+    key = 'count:' + hashlib.md5(f'{sql}|{params!r}'.encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is not None:
+        return count, True
+    count = queryset.order_by().count()
+    cache.set(key, count, timeout)
+    return count, False
+
+
+class ApproximateCountMixin:
+    """
+    Adds a /meta/count/ list action returning the (briefly cached) number of
+    rows the current filters match, for clients using keyset pagination. Two
+    path segments, so it can't shadow the detail route of a row whose slug is
+    "count".
+    """
+
+    @action(detail=False, methods=['get'], url_path='meta/count', url_name='count')
+    def count(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        count, approximate = cached_count(queryset)
+        return Response({'count': count, 'approximate': approximate})
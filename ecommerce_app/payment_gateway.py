@@ -0,0 +1,179 @@
+# payment_gateway.py
+# The payment gateway behind online checkout. Views and workers call the
+# module-level functions below, which delegate to the backend named by
+# settings.PAYMENT_GATEWAY (a dotted path to a PaymentGateway subclass). The
+# backend is built on first use, so importing this module never touches the
+# PhonePe SDK. phonepe_payments.PhonePeGateway is the real backend;
+# fake_gateway.FakeGateway stands in for it when load and latency testing.
+#
+# Every network call to the gateway runs under a latency budget (TIMEOUTS,
+# overridable through settings.PAYMENT_GATEWAY_TIMEOUTS) and a circuit
+# breaker (see gateway_resilience.py). Status checks are idempotent and are
+# retried with jittered backoff; starting a payment is not retried. While the
+# breaker is open calls fail fast with "unavailable": True, and checkout
+# offers Cash on Delivery only (online_payments_available()).
+import logging
+import random
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .gateway_resilience import CircuitBreaker, LatencyHistogram, call_with_timeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GATEWAY = 'ecommerce_app.phonepe_payments.PhonePeGateway'
+
+# Seconds each call may take before the caller stops waiting
+TIMEOUTS = {'pay': 8, 'order_status': 4}
+STATUS_RETRIES = 2
+RETRY_BASE_SECONDS = 0.2
+RETRY_MAX_SECONDS = 1.0
+
+UNAVAILABLE_ERROR = 'Online payments are temporarily unavailable.'
+
+
+class PaymentGateway:
+    """
+    What a gateway backend provides. Every call returns a plain dict and
+    never raises:
+
+    pay() -> {"success": True, "redirect_url", "merchant_order_id", "pg_txn_id"}
+    order_status() -> {"success": True, "data": {"state", ...}}
+    verify_callback() -> (is_valid, callback_data)
+
+    On failure pay() and order_status() return {"success": False, "error"}.
+    The module-level functions add "timed_out": True when the call ran out
+    of time and "unavailable": True when the breaker did not make it.
+    """
+
+    def pay(self, amount_in_paise, merchant_order_id, redirect_url):
+        raise NotImplementedError
+
+    def order_status(self, merchant_order_id, details=False):
+        raise NotImplementedError
+
+    def verify_callback(self, request):
+        raise NotImplementedError
+
+
+_gateway = None
+_breaker = None
+_histograms = {}
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = import_string(getattr(settings, 'PAYMENT_GATEWAY', DEFAULT_GATEWAY))()
+    return _gateway
+
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        with _gateway_lock:
+            if _breaker is None:
+                options = getattr(settings, 'PAYMENT_GATEWAY_BREAKER', {})
+                _breaker = CircuitBreaker(**{key.lower(): value for key, value in options.items()})
+    return _breaker
+
+
+def _histogram(call):
+    with _gateway_lock:
+        return _histograms.setdefault(call, LatencyHistogram())
+
+
+def reset_gateway():
+    """Forget the built backend, breaker and metrics; they are built again from settings"""
+    global _gateway, _breaker
+    with _gateway_lock:
+        _gateway = None
+        _breaker = None
+        _histograms.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('PAYMENT_GATEWAY', 'FAKE_GATEWAY', 'PAYMENT_GATEWAY_BREAKER'):
+        reset_gateway()
+
+
+def _timeout(call):
+    return getattr(settings, 'PAYMENT_GATEWAY_TIMEOUTS', {}).get(call, TIMEOUTS[call])
+
+
+def _call(call, func, *args, **kwargs):
+    """Run one gateway call under the circuit breaker and its latency budget"""
+    breaker = get_breaker()
+    if not breaker.allow():
+        _histogram(call).reject()
+        return {'success': False, 'error': UNAVAILABLE_ERROR, 'unavailable': True}
+
+    started = time.monotonic()
+    try:
+        result = call_with_timeout(func, _timeout(call), *args, **kwargs)
+    except FutureTimeout:
+        result = {'success': False, 'error': 'Payment gateway did not respond in time.', 'timed_out': True}
+    except Exception as e:
+        logger.error(f"Payment gateway {call} call failed: {e}", exc_info=True)
+        result = {'success': False, 'error': str(e)}
+    elapsed = time.monotonic() - started
+
+    breaker.record(result['success'], elapsed)
+    outcome = 'ok' if result['success'] else 'timeout' if result.get('timed_out') else 'error'
+    _histogram(call).observe(elapsed, outcome)
+    if result.get('timed_out'):
+        logger.warning(f"Payment gateway {call} call timed out after {elapsed:.1f}s")
+    return result
+
+
+def online_payments_available():
+    """False while the breaker is failing gateway calls fast: offer Cash on Delivery only"""
+    return not get_breaker().is_open()
+
+
+def retry_after():
+    """Seconds until the gateway is tried again (0 if it is available)"""
+    return get_breaker().retry_after()
+
+
+def get_metrics():
+    with _gateway_lock:
+        histograms = dict(_histograms)
+    return {
+        'gateway': getattr(settings, 'PAYMENT_GATEWAY', DEFAULT_GATEWAY),
+        'online_payments_available': online_payments_available(),
+        'breaker': get_breaker().snapshot(),
+        'latency': {call: histogram.snapshot() for call, histogram in histograms.items()},
+    }
+
+
+def initiate_payment(amount_in_paise: int, merchant_order_id: str, redirect_url: str) -> dict:
+    """Start a payment session for an order; amount is in paise (Rs 100.50 is 10050)"""
+    # Not retried: a timed out attempt may still have created the session
+    return _call('pay', get_gateway().pay, amount_in_paise, merchant_order_id, redirect_url)
+
+
+def check_order_status(merchant_order_id: str, details: bool = False) -> dict:
+    """Ask the gateway for the state of an order's payment, retrying failed checks"""
+    retries = getattr(settings, 'PAYMENT_GATEWAY_STATUS_RETRIES', STATUS_RETRIES)
+    for attempt in range(retries + 1):
+        result = _call('order_status', get_gateway().order_status, merchant_order_id, details=details)
+        if result['success'] or result.get('unavailable') or attempt == retries:
+            return result
+        # Full jitter, so callers that failed together don't retry together
+        time.sleep(random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt)))
+
+
+def verify_phonepe_webhook(request) -> tuple[bool, dict]:
+    """Validate a gateway callback; returns (is_valid, callback_data or None)"""
+    return get_gateway().verify_callback(request)
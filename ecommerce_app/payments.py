@@ -0,0 +1,96 @@
+# payments.py
+# What happens to an online order when PhonePe reports its payment state.
+# The webhook inbox worker, the frontend's status check and the reconcile_payments
+# worker all go through apply_payment_state(), so an order is confirmed (or
+# cancelled) the same way - and only once - whichever of them sees it first.
+import logging
+
+from . import inventory, outbox
+from .checkout import record_coupon_usage
+from .models import Cart, Notification
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'PENDING'
+SUCCESS = 'SUCCESS'
+FAILED = 'FAILED'
+
+# PhonePe order state -> Transaction.status
+STATUS_MAPPING = {
+    'COMPLETED': SUCCESS,
+    'SUCCESS': SUCCESS,
+    'FAILED': FAILED,
+    'PENDING': PENDING,
+}
+
+
+def transaction_status(phonepe_status):
+    return STATUS_MAPPING.get(phonepe_status, PENDING)
+
+
+def enqueue_order_confirmation_emails(order):
+    """Queue the customer and admin emails for a placed/paid order, in the caller's transaction"""
+    outbox.enqueue('order.confirmation_email', {'order_id': str(order.id)})
+    outbox.enqueue('order.admin_email', {'order_id': str(order.id)})
+
+
+def apply_payment_state(txn, phonepe_status, payload=None, phonepe_txn_id=None):
+    """
+    Record PhonePe's state for `txn` and move its order along: a successful
+    payment commits the stock hold, records the coupon use, clears the cart,
+    notifies the customer and queues the confirmation emails; a failed one
+    cancels the order and releases its stock.
+
+    A successful Transaction is final, and each transition runs only on the
+    first report of that state. Call inside transaction.atomic() with `txn`
+    locked (select_for_update). Returns the Transaction's status.
+    """
+    old_status = txn.status
+    if old_status == SUCCESS:
+        return old_status
+
+    new_status = transaction_status(phonepe_status)
+    txn.status = new_status
+    if phonepe_txn_id:
+        txn.phonepe_transaction_id = phonepe_txn_id
+    if payload is not None:
+        txn.pg_response_payload = payload
+    txn.save()
+
+    if new_status == old_status:
+        return new_status
+    logger.info(f"Transaction {txn.merchant_order_id}: {old_status} -> {new_status}")
+
+    order = txn.order
+    if new_status == SUCCESS:
+        order.status = 'processing'
+        order.save()
+        inventory.commit_reservations(order)
+
+        # Clear user's cart
+        Cart.objects.filter(user=order.user).delete()
+
+        if order.coupon and record_coupon_usage(order.user, order.coupon):
+            logger.info(f"Coupon {order.coupon.code} marked as used")
+
+        Notification.objects.create(
+            user=order.user,
+            title="Payment Successful",
+            message=f"Your payment for order #{order.id} was successful."
+        )
+        enqueue_order_confirmation_emails(order)
+        logger.info(f"Payment completed for order {order.id}")
+
+    elif new_status == FAILED:
+        order.status = 'cancelled'
+        order.save()
+        inventory.release_order_reservations(order)
+
+        Notification.objects.create(
+            user=order.user,
+            title="Payment Failed",
+            message=f"Your payment for order #{order.id} failed. Please try again."
+        )
+        logger.info(f"Payment failed for order {order.id}")
+
+    return new_status
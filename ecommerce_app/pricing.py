@@ -0,0 +1,117 @@
+# pricing.py
+# The one place cart prices are computed. price_items() takes cart items whose
+# variants are already loaded and an optional coupon, and produces per-line
+# and total breakdowns in a single pass without further queries. The cart
+# serializers, the checkout pipeline and OrderCreateSerializer all use it,
+# and price_cart() memoizes the result on the request so a cart is loaded and
+# priced once per request.
+from decimal import Decimal
+
+from .models import CartItem
+
+ZERO = Decimal('0.00')
+
+REQUEST_MEMO_ATTR = '_cart_pricing'
+
+
+class LinePrice:
+    """One cart line with its prices resolved from the loaded variant"""
+
+    def __init__(self, cart_item):
+        self.cart_item_id = cart_item.pk
+        self.cart_id = cart_item.cart_id
+        self.variant = cart_item.product_variant
+        self.quantity = cart_item.quantity
+        self.unit_price = self.variant.price
+        self.effective_unit_price = self.variant.get_effective_price()
+        self.subtotal = self.unit_price * self.quantity
+        self.total = self.effective_unit_price * self.quantity
+        self.product_discount = self.subtotal - self.total
+
+
+class CartPricing:
+    """
+    Totals for a set of lines: subtotal (list prices), product_discount
+    (variant discounts), total (after product discounts), coupon_discount
+    (applied to total) and final_price.
+    """
+
+    def __init__(self, lines, coupon=None):
+        self.lines = lines
+        self.cart_id = lines[0].cart_id if lines else None
+        self.subtotal = sum((line.subtotal for line in lines), ZERO)
+        self.total = sum((line.total for line in lines), ZERO)
+        self.product_discount = self.subtotal - self.total
+        self.coupon = coupon
+        self.coupon_discount = coupon.calculate_discount(self.total) if coupon else ZERO
+        self.total_discount = self.product_discount + self.coupon_discount
+        self.final_price = max(self.total - self.coupon_discount, ZERO)
+        self._lines_by_item = {line.cart_item_id: line for line in lines}
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def line(self, cart_item_id):
+        return self._lines_by_item.get(cart_item_id)
+
+    def quantities(self):
+        """{variant_id: quantity} across the lines"""
+        quantities = {}
+        for line in self.lines:
+            quantities[line.variant.pk] = quantities.get(line.variant.pk, 0) + line.quantity
+        return quantities
+
+    def with_coupon(self, coupon):
+        """The same lines priced with `coupon` (no queries)"""
+        return CartPricing(self.lines, coupon)
+
+    def breakdown(self):
+        return {
+            'subtotal': str(self.subtotal),
+            'product_discount': str(self.product_discount),
+            'coupon_discount': str(self.coupon_discount),
+            'total_discount': str(self.total_discount),
+            'final_price': str(self.final_price),
+        }
+
+
+def price_items(items, coupon=None):
+    """Price cart items whose product_variant is already loaded"""
+    return CartPricing([LinePrice(item) for item in items], coupon)
+
+
+def cart_items_for_pricing(user):
+    return CartItem.objects.filter(cart__user=user).select_related('product_variant__product').order_by('pk')
+
+
+def price_cart(user, request=None):
+    """
+    The user's cart priced without a coupon (one query), memoized on the
+    request. Apply a coupon with .with_coupon(); call forget() after
+    changing the cart within the same request.
+    """
+    memo = _request_memo(request)
+    if memo is not None and user.pk in memo:
+        return memo[user.pk]
+    cart_pricing = price_items(cart_items_for_pricing(user))
+    if memo is not None:
+        memo[user.pk] = cart_pricing
+    return cart_pricing
+
+
+def forget(request):
+    memo = _request_memo(request)
+    if memo is not None:
+        memo.clear()
+
+
+def _request_memo(request):
+    if request is None:
+        return None
+    # DRF's Request wraps the HttpRequest; keep the memo on the one both share
+    request = getattr(request, '_request', request)
+    memo = getattr(request, REQUEST_MEMO_ATTR, None)
+    if memo is None:
+        memo = {}
+        setattr(request, REQUEST_MEMO_ATTR, memo)
+    return memo
@@ -0,0 +1,216 @@
+# query_budget.py
+# Per-endpoint SQL query budgets. The same budget table is used by the
+# regression suite in tests.py and by QueryBudgetMiddleware on live requests,
+# so an N+1 introduced in views.py shows up as a failing test (or a warning
+# in the logs) instead of a slow production page.
+import logging
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+Budget = namedtuple('Budget', ['queries', 'sql_ms'])
+
+DEFAULT_BUDGET = Budget(queries=20, sql_ms=250)
+
+# Keyed by URL name from ecommerce_app/urls.py (router names included).
+# Every route must have an entry here; tests.py enforces that.
+ENDPOINT_BUDGETS = {
+    'api-root': Budget(2, 50),
+
+    # Auth
+    'register': Budget(12, 250),
+    'activate': Budget(4, 100),
+    'resend-activation': Budget(4, 100),
+    'login': Budget(4, 100),
+    'logout': Budget(2, 50),
+    'check-auth': Budget(2, 50),
+    'token_refresh': Budget(4, 100),
+    'user-profile': Budget(4, 100),
+    'password-change': Budget(4, 100),
+    'password-reset-request': Budget(4, 100),
+    'password-reset-confirm': Budget(4, 100),
+
+    # Catalog
+    'category-list': Budget(3, 100),
+    'category-detail': Budget(3, 100),
+    'category-breadcrumbs': Budget(3, 100),
+    'category-tree': Budget(2, 100),
+    'brand-list': Budget(3, 100),
+    'brand-detail': Budget(3, 100),
+    'product-list': Budget(5, 150),
+    'product-count': Budget(2, 100),
+    'product-facets': Budget(3, 150),
+    'product-detail': Budget(8, 150),
+    'product-variants': Budget(4, 100),
+    'product-reviews': Budget(6, 100),
+    'product-toggle-status': Budget(10, 150),
+    'product-variant-list': Budget(3, 100),
+    'product-variant-detail': Budget(4, 100),
+    'product-image-list': Budget(3, 100),
+    'product-image-detail': Budget(3, 100),
+    'banner-list': Budget(3, 100),
+    'banner-detail': Budget(3, 100),
+    'banner-toggle-status': Budget(6, 100),
+    'homepage-data': Budget(10, 200),
+
+    # Customer
+    'address-list': Budget(3, 100),
+    'address-detail': Budget(3, 100),
+    'cart': Budget(9, 150),
+    'cart-add': Budget(10, 150),
+    'cart-update': Budget(6, 100),
+    'cart-remove': Budget(6, 100),
+    'cart-batch': Budget(10, 200),
+    'wishlist': Budget(4, 100),
+    'wishlist-detail': Budget(6, 100),
+    'notification-list': Budget(3, 100),
+    'notification-detail': Budget(3, 100),
+    'notification-mark-read': Budget(3, 100),
+
+    # Coupons
+    'coupon-list': Budget(6, 100),
+    'coupon-detail': Budget(6, 100),
+    'coupon-validate': Budget(6, 100),
+    'validate-coupon': Budget(6, 100),
+
+    # Orders & payments
+    'order-list': Budget(10, 200),
+    'order-count': Budget(2, 100),
+    'order-detail': Budget(10, 200),
+    'order-update-status': Budget(21, 250),
+    'checkout-cod': Budget(31, 400),
+    'checkout-online': Budget(30, 400),
+    'payment-status': Budget(20, 300),
+    'phonepe-webhook': Budget(6, 100),
+    'payment-methods': Budget(1, 50),
+    'payment-gateway-metrics': Budget(3, 100),
+
+    # Admin
+    'user-list': Budget(3, 100),
+    'user-detail': Budget(3, 100),
+    'user-toggle-status': Budget(6, 100),
+    'user-change-role': Budget(6, 100),
+    'dashboard-overview': Budget(60, 500),
+    'sales-report': Budget(4, 200),
+    'category-sales-report': Budget(6, 200),
+    'export-sales-report': Budget(4, 200),
+}
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised (in 'raise' mode) when a request runs more SQL than its budget allows"""
+
+
+def get_budget(url_name):
+    """Budget for a URL name, allowing settings.QUERY_BUDGETS to override entries"""
+    overrides = getattr(settings, 'QUERY_BUDGETS', {})
+    if url_name in overrides:
+        return Budget(*overrides[url_name])
+    return ENDPOINT_BUDGETS.get(url_name, DEFAULT_BUDGET)
+
+
+def database_cache_tables():
+    """Tables of the database cache backends in settings.CACHES"""
+    return tuple(
+        options['LOCATION'] for options in settings.CACHES.values()
+        if options['BACKEND'] == 'django.core.cache.backends.db.DatabaseCache'
+    )
+
+
+class QueryCounter:
+    """
+    Context manager counting SQL statements and their total execution time
+    on every configured database connection. Statements against a database
+    cache table are cache round trips, not queries, and are not counted.
+    Only the first `keep` statements are kept (in `queries`) for reports.
+    """
+
+    def __init__(self, using=None, keep=50):
+        self.aliases = [using] if using else list(connections)
+        self.ignored_tables = database_cache_tables()
+        self.keep = keep
+        self.count = 0
+        self.sql_time = 0.0
+        self.queries = []
+        self._contexts = []
+
+    @property
+    def sql_ms(self):
+        return self.sql_time * 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        if any(table in sql for table in self.ignored_tables):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.sql_time += time.perf_counter() - start
+            if len(self.queries) < self.keep:
+                self.queries.append(sql)
+
+    def __enter__(self):
+        for alias in self.aliases:
+            ctx = connections[alias].execute_wrapper(self)
+            ctx.__enter__()
+            self._contexts.append(ctx)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self._contexts:
+            self._contexts.pop().__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def over_budget(self, budget):
+        """Return a list of human readable budget violations (empty if within budget)"""
+        problems = []
+        if self.count > budget.queries:
+            problems.append(f"{self.count} queries (budget {budget.queries})")
+        if self.sql_ms > budget.sql_ms:
+            problems.append(f"{self.sql_ms:.1f}ms of SQL (budget {budget.sql_ms}ms)")
+        return problems
+
+
+class QueryBudgetMiddleware:
+    """
+    Optional middleware enforcing ENDPOINT_BUDGETS on live requests.
+
+    settings.QUERY_BUDGET_MODE:
+        'off'   - middleware is disabled
+        'log'   - over-budget requests are logged as warnings
+        'raise' - over-budget requests raise QueryBudgetExceeded
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if self.mode not in ('log', 'raise'):
+            raise MiddlewareNotUsed()
+
+    def __call__(self, request):
+        # Only the count and time are reported: don't hold on to the statements
+        with QueryCounter(keep=0) as counter:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        if match is None or not match.url_name:
+            return response
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(counter.count)
+            response['X-Query-Time-Ms'] = f"{counter.sql_ms:.1f}"
+
+        problems = counter.over_budget(get_budget(match.url_name))
+        if problems:
+            message = f"{request.method} {request.path} ({match.url_name}) over query budget: {', '.join(problems)}"
+            if self.mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
@@ -0,0 +1,172 @@
+# reconciliation.py
+# Background reconciliation of online payments. A payment whose webhook never
+# arrived (and whose customer never came back to the status page) would stay
+# PENDING forever, holding its stock until the hold lapses. The
+# reconcile_payments command periodically picks PENDING transactions older
+# than MIN_AGE - an indexed (status, created_at) scan - asks PhonePe about
+# them on a bounded thread pool, and applies the answer through
+# payments.apply_payment_state, exactly like the webhook. Transactions that
+# are still pending are retried with per-transaction exponential backoff.
+# Batch outcomes are logged and counted in the shared cache (settings.CACHES),
+# where the payment gateway metrics endpoint reads them.
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import payment_gateway, payments
+from .models import Transaction
+from .outbox import take_leases
+
+logger = logging.getLogger(__name__)
+
+# Give the webhook a head start before asking the gateway ourselves
+MIN_AGE = timedelta(minutes=2)
+# Payments this old are abandoned; stop asking
+MAX_AGE = timedelta(days=2)
+BACKOFF_SECONDS = 60
+MAX_BACKOFF_SECONDS = 60 * 60
+# A claimed transaction whose worker died becomes claimable again after this
+LEASE = timedelta(minutes=2)
+
+STATS_CACHE_KEY = 'payments:reconcile:stats'
+STATS_TOTAL_KEY = 'payments:reconcile:total:{}'
+
+OUTCOMES = ('success', 'failed', 'pending', 'skipped', 'error')
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def claim_stale(batch_size, min_age=MIN_AGE):
+    """Lease up to batch_size due PENDING transactions, oldest first"""
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = Transaction.objects.filter(
+            status=payments.PENDING, created_at__lte=now - min_age, created_at__gte=now - MAX_AGE
+        ).filter(
+            Q(next_reconcile_at__isnull=True) | Q(next_reconcile_at__lte=now)
+        ).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        transactions = list(queryset.only(
+            'pk', 'merchant_order_id', 'status', 'reconcile_attempts', 'next_reconcile_at'
+        )[:batch_size])
+        return take_leases(
+            Transaction, transactions, ('status', 'next_reconcile_at'), next_reconcile_at=now + LEASE
+        )
+
+
+def _schedule_retry(txn):
+    """Back off before the next check, unless another worker has leased the transaction since"""
+    attempts = txn.reconcile_attempts + 1
+    Transaction.objects.filter(pk=txn.pk, next_reconcile_at=txn.next_reconcile_at).update(
+        reconcile_attempts=F('reconcile_attempts') + 1, next_reconcile_at=timezone.now() + backoff(attempts)
+    )
+
+
+def reconcile_transaction(txn, check_status):
+    """
+    Ask the gateway about one transaction (outside any database transaction)
+    and apply its answer. Returns (outcome, seconds spent on the gateway call).
+    """
+    started = time.monotonic()
+    try:
+        result = check_status(txn.merchant_order_id)
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    elapsed = time.monotonic() - started
+
+    if not result['success']:
+        logger.warning(f"Reconciliation status check failed for {txn.merchant_order_id}: {result.get('error')}")
+        _schedule_retry(txn)
+        return 'error', elapsed
+
+    phonepe_status = result['data'].get('state') or result['data'].get('status')
+    with transaction.atomic():
+        locked = Transaction.objects.select_for_update().select_related('order').get(pk=txn.pk)
+        if locked.status != payments.PENDING:
+            # The webhook or the status page got there first
+            return 'skipped', elapsed
+        new_status = payments.apply_payment_state(locked, phonepe_status, payload=result['data'])
+        if new_status == payments.PENDING:
+            _schedule_retry(txn)
+    return new_status.lower(), elapsed
+
+
+def _reconcile_in_thread(txn, check_status):
+    try:
+        return reconcile_transaction(txn, check_status)
+    finally:
+        connection.close()
+
+
+def reconcile_once(batch_size=50, workers=4, min_age=MIN_AGE, check_status=None, pool=None):
+    """
+    Claim one batch of stale PENDING transactions and reconcile it, on a
+    thread pool when workers > 1. Returns this batch's stats (see record_stats).
+    """
+    check_status = check_status or payment_gateway.check_order_status
+    started = time.monotonic()
+    transactions = claim_stale(batch_size, min_age)
+
+    if pool is None and workers > 1 and len(transactions) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda txn: _reconcile_in_thread(txn, check_status), transactions))
+    elif pool is not None:
+        results = list(pool.map(lambda txn: _reconcile_in_thread(txn, check_status), transactions))
+    else:
+        results = [reconcile_transaction(txn, check_status) for txn in transactions]
+
+    timings = [elapsed for _, elapsed in results]
+    stats = {outcome: 0 for outcome in OUTCOMES}
+    for outcome, _ in results:
+        stats[outcome] += 1
+    stats.update({
+        'checked': len(results),
+        'duration_ms': round((time.monotonic() - started) * 1000, 1),
+        'check_ms_avg': round(sum(timings) / len(timings) * 1000, 1) if timings else 0.0,
+        'check_ms_max': round(max(timings) * 1000, 1) if timings else 0.0,
+    })
+    record_stats(stats)
+    return stats
+
+
+def _add(key, amount):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, amount, None)
+
+
+def record_stats(stats):
+    """
+    Add a batch's stats to the running totals and keep it as the last run,
+    in the shared cache (see settings.CACHES) so the payment gateway metrics
+    endpoint sees what the reconcile_payments worker did. Each total is its
+    own counter, so concurrent workers don't overwrite each other's counts.
+    """
+    for key in OUTCOMES + ('checked',):
+        if stats.get(key):
+            _add(STATS_TOTAL_KEY.format(key), stats[key])
+    cache.set(STATS_CACHE_KEY, {**stats, 'finished_at': timezone.now().isoformat()}, None)
+    if stats['checked']:
+        logger.info(f"Reconciliation batch: {stats}")
+
+
+def get_stats():
+    """{'totals', 'last_run'}, or None before the first batch"""
+    last_run = cache.get(STATS_CACHE_KEY)
+    if last_run is None:
+        return None
+    keys = {key: STATS_TOTAL_KEY.format(key) for key in OUTCOMES + ('checked',)}
+    found = cache.get_many(list(keys.values()))
+    return {'totals': {key: found.get(cache_key, 0) for key, cache_key in keys.items()}, 'last_run': last_run}
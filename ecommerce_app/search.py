@@ -0,0 +1,247 @@
+# search.py
+# Full-text product search index.
+# SQLite uses an FTS5 virtual table, PostgreSQL a tsvector column with a GIN
+# index. Other databases fall back to DRF's SearchFilter (icontains).
+# Matching and ranking run as subqueries of the product listing query, so the
+# listing's own pagination applies to every match.
+import logging
+import re
+import uuid
+
+from django.db import connection as default_connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+from rest_framework import filters
+
+logger = logging.getLogger(__name__)
+
+SQLITE_TABLE = 'ecommerce_app_product_fts'
+POSTGRES_TABLE = 'ecommerce_app_product_search'
+
+# Column weights: name matters most, then category/brand, then description
+SQLITE_BM25_WEIGHTS = '0.0, 10.0, 5.0, 5.0, 1.0'
+
+def is_supported(connection=None):
+    connection = connection or default_connection
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def create_index(connection):
+    """Create the search index table for this database (no-op elsewhere)"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+                "product_id UNINDEXED, name, category, brand, description, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+                "product_id uuid PRIMARY KEY REFERENCES ecommerce_app_product(id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+                f"ON {POSTGRES_TABLE} USING GIN (document)"
+            )
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+def _document(product):
+    """Indexed text for a product (expects category/brand to be loaded)"""
+    return (
+        product.name or '',
+        product.category.name if product.category_id else '',
+        product.brand.name if product.brand_id else '',
+        strip_tags(product.description or ''),
+    )
+
+
+def _db_id(connection, product_id):
+    # Django stores UUIDs as 32 char hex on SQLite and as native uuid on PostgreSQL
+    product_id = product_id if isinstance(product_id, uuid.UUID) else uuid.UUID(str(product_id))
+    return product_id.hex if connection.vendor == 'sqlite' else str(product_id)
+
+
+def write_documents(connection, products):
+    """Insert or replace index rows for the given product instances"""
+    products = list(products)
+    if not products or not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            ids = [_db_id(connection, p.pk) for p in products]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE} WHERE product_id IN ({placeholders})", ids)
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_TABLE} (product_id, name, category, brand, description) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [(_db_id(connection, p.pk),) + _document(p) for p in products]
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (product_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'D')) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                [(_db_id(connection, p.pk),) + _document(p) for p in products]
+            )
+
+
+def index_products(product_ids, connection=None):
+    """Re-index products by id; ids that no longer exist are removed"""
+    from .models import Product
+
+    connection = connection or default_connection
+    product_ids = list(product_ids)
+    if not product_ids or not is_supported(connection):
+        return
+    products = list(Product.objects.filter(pk__in=product_ids).select_related('category', 'brand'))
+    found = {p.pk for p in products}
+    remove_products([pk for pk in product_ids if pk not in found], connection)
+    write_documents(connection, products)
+
+
+def remove_products(product_ids, connection=None):
+    connection = connection or default_connection
+    product_ids = list(product_ids)
+    if not product_ids or not is_supported(connection):
+        return
+    ids = [_db_id(connection, pk) for pk in product_ids]
+    table = SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE product_id IN ({placeholders})", ids)
+
+
+def rebuild(connection=None, batch_size=500):
+    """Drop and rebuild the whole index. Returns the number of indexed products."""
+    from .models import Product
+
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return 0
+    drop_index(connection)
+    create_index(connection)
+
+    indexed = 0
+    batch = []
+    for product in Product.objects.select_related('category', 'brand').iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            write_documents(connection, batch)
+            indexed += len(batch)
+            batch = []
+    write_documents(connection, batch)
+    return indexed + len(batch)
+
+
+def _terms(query):
+    return re.findall(r'\w+', (query or '').lower())
+
+
+def _table(connection):
+    return SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+
+
+def _match(connection, query):
+    """
+    (condition, params) of the index rows matching every term of the query
+    (prefix match), or None for a query without terms
+    """
+    terms = _terms(query)
+    if not terms:
+        return None
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return f"{SQLITE_TABLE} MATCH %s", [match]
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    return "document @@ to_tsquery('simple', %s)", [tsquery]
+
+
+def matching_ids(query, connection=None):
+    """Subquery of the ids of matching products, for filter(pk__in=...)"""
+    connection = connection or default_connection
+    condition, params = _match(connection, query)
+    return RawSQL(f"SELECT product_id FROM {_table(connection)} WHERE {condition}", params)
+
+
+def rank(query, product_table, connection=None):
+    """
+    Relevance of each product of the outer query as an expression that sorts
+    best match first in ascending order
+    """
+    connection = connection or default_connection
+    condition, params = _match(connection, query)
+    product_id = f"{connection.ops.quote_name(product_table)}.{connection.ops.quote_name('id')}"
+    if connection.vendor == 'sqlite':
+        # product_id is UNINDEXED, so looking each row up would rerun the MATCH
+        # per product: score the matches once and look them up in the result.
+        # bm25() is already lower for better matches.
+        materialized = 'MATERIALIZED ' if connection.Database.sqlite_version_info >= (3, 35) else ''
+        sql = (
+            f"WITH ranked AS {materialized}("
+            f"SELECT product_id, bm25({SQLITE_TABLE}, {SQLITE_BM25_WEIGHTS}) AS score "
+            f"FROM {SQLITE_TABLE} WHERE {condition}"
+            f") SELECT score FROM ranked WHERE product_id = {product_id}"
+        )
+    else:
+        # product_id is the primary key: one index lookup per product
+        sql = (
+            f"SELECT -ts_rank(document, to_tsquery('simple', %s)) FROM {POSTGRES_TABLE} "
+            f"WHERE {condition} AND product_id = {product_id}"
+        )
+        params = params + params
+    return RawSQL(sql, params, output_field=FloatField())
+
+
+_indexed = set()
+
+
+def index_exists(connection=None):
+    """Whether the search index table exists; a found table is remembered per database"""
+    connection = connection or default_connection
+    if connection.alias not in _indexed:
+        if _table(connection) not in connection.introspection.table_names():
+            return False
+        _indexed.add(connection.alias)
+    return True
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    Routes ?search= through the full-text index. Results are ranked by
+    relevance unless the client asked for an explicit ?ordering=.
+    Falls back to SearchFilter's icontains lookups on unsupported databases
+    and while the index table is missing.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not _terms(query):
+            return queryset
+
+        if not is_supported(connection=default_connection):
+            return super().filter_queryset(request, queryset, view)
+        if not index_exists(default_connection):
+            logger.error("Full-text product search index is missing, falling back to icontains")
+            return super().filter_queryset(request, queryset, view)
+
+        queryset = queryset.filter(pk__in=matching_ids(query))
+        if not request.query_params.get('ordering'):
+            queryset = queryset.annotate(
+                search_rank=rank(query, queryset.model._meta.db_table)
+            ).order_by('search_rank', 'id')
+        return queryset
@@ -2,12 +2,14 @@ from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.utils import timezone
 from .models import (
-    User, Address, Category, Brand, Product, ProductVariant, ProductImage,
+    User, Address, Category, Brand, Product, ProductVariant, ProductImage, ProductCard,
     ProductAttribute, Cart, CartItem, Wishlist, Coupon, CouponUsage, Order,
     OrderItem, Review, Notification, PromotionalBanner
 )
 import uuid
 from django.db import transaction
+from django.db.models import Prefetch
+from . import checkout, coupons, pricing
 
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
@@ -161,8 +163,8 @@ class CategorySerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'parent', 'is_active', 'image','image_url' ,'display_order']
-        read_only_fields = ['id', 'slug']
+        fields = ['id', 'name', 'slug', 'parent', 'depth', 'is_active', 'image','image_url' ,'display_order']
+        read_only_fields = ['id', 'slug', 'depth']
     
     def get_image_url(self, obj):
         if obj.image:
@@ -171,6 +173,11 @@ class CategorySerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.image.url)
         return None
 
+    def validate_parent(self, parent):
+        if parent and self.instance and (parent.pk == self.instance.pk or parent.is_descendant_of(self.instance)):
+            raise serializers.ValidationError("A category cannot be moved under itself or one of its descendants.")
+        return parent
+
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
         model = Brand
@@ -300,6 +307,14 @@ class ProductListSerializer(serializers.ModelSerializer):
                   'discount_percentage', 'has_discount', 'variants', 'is_featured','is_active']
         read_only_fields = ['id', 'slug']
     
+    def get_card(self, obj):
+        """Return the denormalized card, building it if the product has none yet"""
+        try:
+            return obj.card
+        except ProductCard.DoesNotExist:
+            obj.card = ProductCard.refresh(obj.pk, create=True) or ProductCard.objects.get(pk=obj.pk)
+            return obj.card
+
     def get_category_name(self, obj):
         return obj.category.name
     
@@ -307,33 +322,27 @@ class ProductListSerializer(serializers.ModelSerializer):
         return obj.brand.name if obj.brand else None
     
     def get_variants_count(self, obj):
-        return obj.variants.count()
+        return self.get_card(obj).variants_count
     
     def get_main_image(self, obj):
-        image = obj.images.first()
-        if image:
+        image_url = self.get_card(obj).main_image_url
+        if image_url:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(image.image.url)
+                return request.build_absolute_uri(image_url)
         return None
     
     def get_price(self, obj):
-        variant = obj.variants.first()
-        if variant:
-            return variant.price
-        return None
+        return self.get_card(obj).price
 
     def get_discount_price(self, obj):
-        variant = obj.variants.first()
-        if variant and variant.is_discount_active:
-            return variant.discount_price
-        return None
+        return self.get_card(obj).discount_price
         
     def get_discount_percentage(self, obj):
-        return obj.discount_percentage
+        return self.get_card(obj).discount_percentage
         
     def get_has_discount(self, obj):
-        return obj.has_discount
+        return self.get_card(obj).has_discount
     
 class ProductDetailSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
@@ -342,23 +351,18 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     attributes = ProductAttributeSerializer(many=True, read_only=True)
     average_rating = serializers.SerializerMethodField()
-    reviews_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.ReadOnlyField()
     
     class Meta:
         model = Product
         fields = ['id', 'name', 'slug', 'description', 'category', 'brand', 'vendor', 
                   'is_active', 'created_at', 'updated_at', 'variants', 'images', 
-                  'attributes', 'average_rating', 'reviews_count']
-        read_only_fields = ['id', 'slug', 'created_at', 'updated_at']
+                  'attributes', 'average_rating', 'reviews_count', 'rating_histogram']
+        read_only_fields = ['id', 'slug', 'created_at', 'updated_at', 'reviews_count']
     
     def get_average_rating(self, obj):
-        reviews = obj.reviews.all()
-        if reviews:
-            return sum(review.rating for review in reviews) / reviews.count()
-        return 0
-    
-    def get_reviews_count(self, obj):
-        return obj.reviews.count()
+        # Maintained on the product by the Review signals
+        return float(obj.average_rating) if obj.reviews_count else 0
 
 
 # serializers.py - Update ProductCreateUpdateSerializer to include id in response
@@ -396,9 +400,10 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'subtotal']
     
     def get_subtotal(self, obj):
-        if obj.product_variant.is_discount_active and obj.product_variant.discount_price:
-            return obj.product_variant.discount_price * obj.quantity
-        return obj.product_variant.price * obj.quantity
+        # Inside a CartSerializer the line was already priced with the rest of the cart
+        cart_pricing = self.context.get(('cart_pricing', obj.cart_id))
+        line = cart_pricing.line(obj.pk) if cart_pricing else None
+        return (line or pricing.LinePrice(obj)).total
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -410,14 +415,30 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'total', 'created_at']
         read_only_fields = ['id', 'created_at']
     
-    def get_total(self, obj):
-        return sum(self.get_item_price(item) for item in obj.items.all())
+    def to_representation(self, instance):
+        # Price all lines in one pass; the item serializers read their line from the context
+        self.context[('cart_pricing', instance.pk)] = pricing.price_items(instance.items.all())
+        return super().to_representation(instance)
     
-    def get_item_price(self, item):
-        variant = item.product_variant
-        if variant.is_discount_active and variant.discount_price:
-            return variant.discount_price * item.quantity
-        return variant.price * item.quantity
+    def get_total(self, obj):
+        return self.context[('cart_pricing', obj.pk)].total
+
+
+class CartBatchOperationSerializer(serializers.Serializer):
+    OPS = ('add', 'set', 'remove')
+
+    op = serializers.ChoiceField(choices=OPS)
+    product_variant_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False, default=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Quantity must be greater than zero'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartBatchOperationSerializer(many=True, allow_empty=False, max_length=100)
 
 
 class WishlistSerializer(serializers.ModelSerializer):
@@ -507,12 +528,10 @@ class CouponValidateSerializer(serializers.Serializer):
     cart_total = serializers.DecimalField(max_digits=10, decimal_places=2, required=True)
 
     def validate(self, attrs):
-        coupon = attrs['coupon']
+        coupon = coupons.get_coupon(attrs['coupon'])
         cart_total = attrs['cart_total']
         
-        try:
-            coupon = Coupon.objects.get(code=coupon, is_active=True)
-        except Coupon.DoesNotExist:
+        if coupon is None:
             raise serializers.ValidationError({"code": "Invalid coupon code."})
         
         # Check if coupon is still valid date-wise
@@ -530,13 +549,22 @@ class CouponValidateSerializer(serializers.Serializer):
         if coupon.used_count >= coupon.usage_limit:
             raise serializers.ValidationError({"code": "Coupon usage limit has been reached."})
         
-        # Additional validation could include checking if user has already used this coupon
-        # and if the coupon applies to the items in the cart
-        
         attrs['coupon'] = coupon
         return attrs
 
 
+def product_images_prefetch(lookup='items__product_variant__product__images'):
+    """Prefetch product images in the same order first_product_image() reads them"""
+    return Prefetch(lookup, queryset=ProductImage.objects.order_by('pk'))
+
+
+def first_product_image(product):
+    """The product's first image, read from a prefetch of its images when there is one"""
+    if 'images' in getattr(product, '_prefetched_objects_cache', {}):
+        return next(iter(product.images.all()), None)
+    return product.images.order_by('pk').first()
+
+
 # In serializers.py
 # Find the OrderItemSerializer and modify it:
 
@@ -555,10 +583,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.product_variant.product.name if obj.product_variant.product else None
     
     def get_product_image(self, obj):
-        if obj.product_variant.product and obj.product_variant.product.images.first():
+        image = first_product_image(obj.product_variant.product) if obj.product_variant.product else None
+        if image:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.product_variant.product.images.first().image.url)
+                return request.build_absolute_uri(image.image.url)
         return None
     
     def get_product_slug(self, obj):
@@ -629,10 +658,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.product_variant.product.name if obj.product_variant.product else None
     
     def get_product_image(self, obj):
-        if obj.product_variant.product and obj.product_variant.product.images.first():
+        image = first_product_image(obj.product_variant.product) if obj.product_variant.product else None
+        if image:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.product_variant.product.images.first().image.url)
+                return request.build_absolute_uri(image.image.url)
         return None
     
     def get_product_slug(self, obj):
@@ -735,10 +765,10 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         if not value:
             return None
             
-        try:
-            return Coupon.objects.get(code=value, is_active=True)
-        except Coupon.DoesNotExist:
+        coupon = coupons.get_coupon(value)
+        if coupon is None:
             raise serializers.ValidationError("Invalid coupon code.")
+        return coupon
     
     def create(self, validated_data):
         user = self.context['request'].user
@@ -750,13 +780,13 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         except Cart.DoesNotExist:
             raise serializers.ValidationError({"cart": "User has no active cart."})
         
+        # Price the cart (one query, shared with the rest of the request)
+        cart_pricing = pricing.price_cart(user, self.context.get('request'))
+        
         # Check if cart is empty
-        if not cart.items.exists():
+        if not cart_pricing:
             raise serializers.ValidationError({"cart": "Cart is empty."})
         
-        # Calculate total price
-        total_price = sum(self.get_item_price(item) for item in cart.items.all())
-        
         # Apply coupon if provided
         coupon = None
         if coupon_code:
@@ -767,46 +797,45 @@ class OrderCreateSerializer(serializers.ModelSerializer):
                     raise serializers.ValidationError({"coupon_code": "You have already used this coupon."})
                 
                 # Check minimum purchase amount
-                if total_price < coupon.min_purchase_amount:
+                if cart_pricing.total < coupon.min_purchase_amount:
                     raise serializers.ValidationError({
                         "coupon_code": f"Minimum purchase amount of ${coupon.min_purchase_amount} not met."
                     })
                 
-                # Apply discount
-                if coupon.discount_type == 'percent':
-                    discount = total_price * (coupon.discount_value / 100)
-                    if coupon.max_discount and discount > coupon.max_discount:
-                        discount = coupon.max_discount
-                else:  # flat discount
-                    discount = coupon.discount_value
+                if not coupons.get_rule_for(coupon).applies_to_lines(cart_pricing.lines):
+                    raise serializers.ValidationError({
+                        "coupon_code": "This coupon does not apply to the items in your cart."
+                    })
                 
-                total_price -= discount
+                cart_pricing = cart_pricing.with_coupon(coupon)
                 
-                # Record coupon usage
-                coupon.used_count += 1
-                coupon.save()
-                CouponUsage.objects.create(user=user, coupon=coupon)
+                # Record coupon usage (the coupon is a cached copy: count with a conditional UPDATE)
+                if not checkout.record_coupon_usage(user, coupon):
+                    raise serializers.ValidationError({"coupon_code": "Coupon usage limit has been reached."})
         
         # Create order
         order = Order.objects.create(
             user=user,
             address=validated_data['address'],
-            total_price=total_price,
+            total_price=cart_pricing.final_price,
             payment_method=validated_data['payment_method'],
             coupon=coupon
         )
         
         # Create order items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
-                product_variant=cart_item.product_variant,
-                quantity=cart_item.quantity,
-                price=self.get_item_unit_price(cart_item.product_variant)
+                product_variant=line.variant,
+                quantity=line.quantity,
+                price=line.effective_unit_price
             )
+            for line in cart_pricing.lines
+        ])
         
         # Clear the cart
         cart.items.all().delete()
+        pricing.forget(self.context.get('request'))
         
         # Create notification for the user
         Notification.objects.create(
@@ -816,14 +845,6 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         )
         
         return order
-    
-    def get_item_price(self, item):
-        return item.quantity * self.get_item_unit_price(item.product_variant)
-    
-    def get_item_unit_price(self, variant):
-        if variant.is_discount_active and variant.discount_price:
-            return variant.discount_price
-        return variant.price
 
 
 class NotificationSerializer(serializers.ModelSerializer):
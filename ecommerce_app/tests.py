@@ -1,3 +1,1756 @@
-from django.test import TestCase
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import cart as cart_service
+from . import (
+    caching, checkout, coupons, idempotency, inventory, outbox, payment_gateway, pricing, reconciliation, search,
+    webhook_inbox
+)
+from . import fake_gateway, gateway_resilience
+from . import mail as mail_service
+from . import urls as app_urls
+from .models import (
+    User, Address, Category, Brand, Product, ProductVariant, ProductImage, ProductCard,
+    Cart, CartItem, Wishlist, Coupon, CouponUsage, Order, OrderItem, Transaction, Review,
+    Notification, PromotionalBanner, StockReservation, OutboxMessage, PaymentWebhookEvent
+)
+from .pagination import cached_count
+from .query_budget import ENDPOINT_BUDGETS, QueryBudgetExceeded, QueryCounter, get_budget
+from .serializers import CartSerializer
+
+
+PASSWORD = 'Str0ng-Passw0rd!'
+
+# The tests run in one process, and conditional GETs are asserted to run no
+# queries, so keep the cache out of the database
+LOCAL_CACHE = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+
+def setUpModule():
+    LOCAL_CACHE.enable()
+
+
+def tearDownModule():
+    LOCAL_CACHE.disable()
+
+
+def collect_url_names(patterns):
+    """All named routes in a urlconf, including the router generated ones"""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= collect_url_names(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class CatalogSeedMixin:
+    """Seeds a small but complete dataset so every endpoint has rows to serialize"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin@example.com', PASSWORD, first_name='Ad', last_name='Min')
+        cls.customer = User.objects.create_user('customer@example.com', PASSWORD, first_name='Cu', last_name='Stomer')
+        cls.customer.password_reset_token = 'reset-token'
+        cls.customer.save()
+        cls.inactive = User.objects.create_user(
+            'inactive@example.com', PASSWORD, first_name='In', last_name='Active',
+            is_active=False, activation_token='activation-token'
+        )
+
+        cls.address = Address.objects.create(
+            user=cls.customer, address_line1='1 Farm Road', city='Pune', state='MH',
+            zip_code='411001', country='India', is_default=True, name='Cu Stomer', phone='9999999999'
+        )
+        cls.category = Category.objects.create(name='Spices')
+        cls.brand = Brand.objects.create(name='Devrup')
+        cls.banner = PromotionalBanner.objects.create(title='Hero', image='banners/hero.jpg', position='hero')
+        PromotionalBanner.objects.create(title='Middle', image='banners/middle.jpg', position='middle')
+
+        cls.product = cls.create_product('Turmeric', is_featured=True, discounted=True)
+        cls.variant = cls.product.variants.order_by('pk').first()
+        cls.other_variant = cls.create_product('Chilli').variants.first()
+
+        cls.cart = Cart.objects.create(user=cls.customer)
+        cls.cart_item = CartItem.objects.create(cart=cls.cart, product_variant=cls.variant, quantity=2)
+        Wishlist.objects.create(user=cls.customer, product=cls.product)
+        Review.objects.create(user=cls.customer, product=cls.product, rating=5, comment='Great')
+        cls.notification = Notification.objects.create(user=cls.customer, title='Hi', message='Welcome')
+
+        now = timezone.now()
+        cls.coupon = Coupon.objects.create(
+            code='SAVE10', discount_type='percent', discount_value=Decimal('10'),
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30), usage_limit=100
+        )
+
+        cls.order = cls.create_order(cls.customer)
+        cls.transaction = Transaction.objects.create(
+            order=cls.order, merchant_order_id='ORDER_TEST_1', amount=cls.order.total_price
+        )
+
+    def setUp(self):
+        super().setUp()
+        # Cached payloads (and the gateway's breaker) outlive the per-test transaction rollback
+        cache.clear()
+        payment_gateway.reset_gateway()
+
+    @classmethod
+    def create_product(cls, name, is_featured=False, discounted=False):
+        product = Product.objects.create(
+            name=name, slug=name.lower().replace(' ', '-'), description=f'<p>{name}</p>',
+            category=cls.category, brand=cls.brand, vendor=cls.admin, is_featured=is_featured
+        )
+        sku = product.slug.upper()
+        ProductVariant.objects.create(product=product, size='100g', price=Decimal('100.00'), stock=50, sku=f'{sku}-100')
+        ProductVariant.objects.create(
+            product=product, size='250g', price=Decimal('200.00'), stock=50, sku=f'{sku}-250',
+            is_discount_active=discounted, discount_price=Decimal('180.00') if discounted else None,
+            discount_percentage=10 if discounted else None
+        )
+        ProductImage.objects.create(product=product, image=f'products/{product.slug}/front.jpg')
+        return product
+
+    @classmethod
+    def create_order(cls, user):
+        order = Order.objects.create(
+            user=user, address=cls.address, total_price=Decimal('200.00'), payment_method='online'
+        )
+        OrderItem.objects.create(order=order, product_variant=cls.variant, quantity=2, price=Decimal('100.00'))
+        return order
+
+    @classmethod
+    def add_rows(cls, count):
+        """Grow every list endpoint's result set; used to detect per-row queries"""
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            product = cls.create_product(f'Extra {i}', is_featured=True, discounted=True)
+            Wishlist.objects.create(user=cls.customer, product=product)
+            CartItem.objects.create(cart=cls.cart, product_variant=product.variants.first(), quantity=1)
+            cls.create_order(cls.customer)
+            Category.objects.create(name=f'Extra category {i}')
+            Brand.objects.create(name=f'Extra brand {i}')
+            PromotionalBanner.objects.create(title=f'Extra {i}', image='banners/extra.jpg', position='bottom')
+
+
+# One request per named route: (url name, method, user, url kwargs, payload, patches).
+# kwargs/payload are callables taking the test case so they can use seeded rows.
+RouteCase = namedtuple('RouteCase', ['name', 'method', 'user', 'kwargs', 'data', 'patches'])
+
+
+def case(name, method='get', user=None, kwargs=None, data=None, patches=None):
+    return RouteCase(name, method, user, kwargs or (lambda t: {}), data or (lambda t: None), patches or {})
+
+
+GATEWAY_PAY_RESULT = {
+    'success': True, 'redirect_url': 'https://pay.example/redirect',
+    'merchant_order_id': 'ORDER_PATCHED', 'pg_txn_id': 'PG123'
+}
+GATEWAY_STATUS_RESULT = {'success': True, 'data': {'state': 'PENDING'}}
+
+
+ROUTE_CASES = [
+    case('api-root'),
+
+    # Auth
+    case('register', 'post', data=lambda t: {
+        'email': 'new@example.com', 'first_name': 'New', 'last_name': 'User',
+        'password': PASSWORD, 'password_confirm': PASSWORD,
+        'address_line1': '2 Farm Road', 'zip_code': '411002'
+    }),
+    case('activate', 'post', kwargs=lambda t: {'token': 'activation-token'}),
+    case('resend-activation', 'post', data=lambda t: {'email': t.inactive.email}),
+    case('login', 'post', data=lambda t: {'email': t.customer.email, 'password': PASSWORD}),
+    case('logout', 'post', user='customer'),
+    case('check-auth', user='customer'),
+    case('token_refresh', 'post', data=lambda t: {'refresh': str(RefreshToken.for_user(t.customer))}),
+    case('user-profile', user='customer'),
+    case('password-change', 'post', user='customer', data=lambda t: {
+        'current_password': PASSWORD, 'new_password': 'An0ther-Passw0rd!'
+    }),
+    case('password-reset-request', 'post', data=lambda t: {'email': t.customer.email}),
+    case('password-reset-confirm', 'post', data=lambda t: {
+        'token': 'reset-token', 'password': 'An0ther-Passw0rd!', 'password_confirm': 'An0ther-Passw0rd!'
+    }),
+
+    # Catalog
+    case('category-list'),
+    case('category-detail', kwargs=lambda t: {'pk': t.category.pk}),
+    case('category-breadcrumbs', kwargs=lambda t: {'pk': t.category.pk}),
+    case('category-tree'),
+    case('brand-list'),
+    case('brand-detail', kwargs=lambda t: {'pk': t.brand.pk}),
+    case('product-list'),
+    case('product-count'),
+    case('product-facets'),
+    case('product-detail', kwargs=lambda t: {'slug': t.product.slug}),
+    case('product-variants', kwargs=lambda t: {'slug': t.product.slug}),
+    case('product-reviews', kwargs=lambda t: {'slug': t.product.slug}),
+    case('product-toggle-status', 'patch', user='admin', kwargs=lambda t: {'slug': t.product.slug}),
+    case('product-variant-list'),
+    case('product-variant-detail', kwargs=lambda t: {'pk': t.variant.pk}),
+    case('product-image-list', user='customer'),
+    case('product-image-detail', user='customer', kwargs=lambda t: {'pk': t.product.images.first().pk}),
+    case('banner-list'),
+    case('banner-detail', kwargs=lambda t: {'id': t.banner.pk}),
+    case('banner-toggle-status', 'patch', user='admin', kwargs=lambda t: {'id': t.banner.pk}),
+    case('homepage-data'),
+
+    # Customer
+    case('address-list', user='customer'),
+    case('address-detail', user='customer', kwargs=lambda t: {'pk': t.address.pk}),
+    case('cart', user='customer'),
+    case('cart-add', 'post', user='customer', data=lambda t: {
+        'product_variant_id': t.other_variant.pk, 'quantity': 1
+    }),
+    case('cart-update', 'put', user='customer', kwargs=lambda t: {'item_id': t.cart_item.pk}, data=lambda t: {'quantity': 3}),
+    case('cart-remove', 'delete', user='customer', kwargs=lambda t: {'item_id': t.cart_item.pk}),
+    case('cart-batch', 'post', user='customer', data=lambda t: {'operations': [
+        {'op': 'set', 'product_variant_id': t.variant.pk, 'quantity': 1},
+        {'op': 'add', 'product_variant_id': t.other_variant.pk, 'quantity': 2},
+    ]}),
+    case('wishlist', user='customer'),
+    case('wishlist-detail', 'delete', user='customer', kwargs=lambda t: {'product_id': t.product.pk}),
+    case('notification-list', user='customer'),
+    case('notification-detail', user='customer', kwargs=lambda t: {'pk': t.notification.pk}),
+    case('notification-mark-read', 'post', user='customer'),
+
+    # Coupons
+    case('coupon-list', user='admin'),
+    case('coupon-detail', user='admin', kwargs=lambda t: {'pk': t.coupon.pk}),
+    case('coupon-validate', 'post', data=lambda t: {'code': t.coupon.code, 'cart_total': 500}),
+    case('validate-coupon', 'post', user='customer', data=lambda t: {'coupon': t.coupon.code, 'cart_total': '500.00'}),
+
+    # Orders & payments
+    case('order-list', user='customer'),
+    case('order-count', user='customer'),
+    case('order-detail', user='customer', kwargs=lambda t: {'pk': t.order.pk}),
+    case('order-update-status', 'post', user='admin', kwargs=lambda t: {'pk': t.order.pk}, data=lambda t: {'status': 'processing'}),
+    case('checkout-cod', 'post', user='customer', data=lambda t: {
+        'address_id': t.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'
+    }),
+    case('checkout-online', 'post', user='customer', data=lambda t: {'address_id': t.address.pk},
+         patches={'ecommerce_app.views.initiate_payment': GATEWAY_PAY_RESULT}),
+    case('payment-status', 'post', user='customer', data=lambda t: {'merchant_order_id': t.transaction.merchant_order_id},
+         patches={'ecommerce_app.views.check_order_status': GATEWAY_STATUS_RESULT}),
+    case('phonepe-webhook', 'post', data=lambda t: {},
+         patches={
+             'ecommerce_app.views.verify_phonepe_webhook': (True, {
+                 'merchant_order_id': 'ORDER_TEST_1', 'state': 'COMPLETED', 'transaction_id': 'PG123'
+             }),
+         }),
+    case('payment-methods'),
+    case('payment-gateway-metrics', user='admin'),
+
+    # Admin
+    case('user-list', user='admin'),
+    case('user-detail', user='admin', kwargs=lambda t: {'pk': t.customer.pk}),
+    case('user-toggle-status', 'patch', user='admin', kwargs=lambda t: {'pk': t.customer.pk}),
+    case('user-change-role', 'patch', user='admin', kwargs=lambda t: {'pk': t.customer.pk}, data=lambda t: {'role': 'vendor'}),
+    case('dashboard-overview', user='admin'),
+    case('sales-report', user='admin'),
+    case('category-sales-report', user='admin'),
+    case('export-sales-report', user='admin'),
+]
+
+ROUTE_CASES_BY_NAME = {route.name: route for route in ROUTE_CASES}
+
+
+class QueryBudgetTestMixin(CatalogSeedMixin):
+
+    def call_route(self, route):
+        """Call a route once and return (response, QueryCounter)"""
+        client = APIClient()
+        if route.user:
+            # Fresh instance so earlier cases mutating request.user don't leak
+            client.force_authenticate(User.objects.get(pk=getattr(self, route.user).pk))
+
+        url = reverse(route.name, kwargs=route.kwargs(self))
+        data = route.data(self)
+
+        patchers = [mock.patch(target, return_value=value) for target, value in route.patches.items()]
+        for patcher in patchers:
+            patcher.start()
+        try:
+            with QueryCounter() as counter:
+                response = getattr(client, route.method)(url, data, format='json')
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+        return response, counter
+
+    def call_and_rollback(self, route):
+        with transaction.atomic():
+            result = self.call_route(route)
+            transaction.set_rollback(True)
+        return result
+
+
+class EndpointQueryBudgetTests(QueryBudgetTestMixin, TestCase):
+
+    def test_every_route_has_a_budget_and_a_case(self):
+        names = collect_url_names(app_urls.urlpatterns)
+        self.assertEqual(names - set(ENDPOINT_BUDGETS), set(), "Routes missing from ENDPOINT_BUDGETS")
+        self.assertEqual(names - set(ROUTE_CASES_BY_NAME), set(), "Routes missing from ROUTE_CASES")
+
+    def test_endpoints_stay_within_query_budget(self):
+        for route in ROUTE_CASES:
+            with self.subTest(route=route.name, method=route.method):
+                response, counter = self.call_and_rollback(route)
+                budget = get_budget(route.name)
+
+                self.assertLess(response.status_code, 500, f"{route.name} returned {response.status_code}")
+                self.assertLessEqual(
+                    counter.count, budget.queries,
+                    f"{route.name} ran {counter.count} queries:\n" + "\n".join(counter.queries)
+                )
+
+    def test_list_endpoints_do_not_scale_with_rows(self):
+        names = [
+            'product-list', 'category-list', 'brand-list', 'banner-list',
+            'homepage-data', 'wishlist', 'order-list', 'cart',
+        ]
+        before = {name: self.call_and_rollback(ROUTE_CASES_BY_NAME[name])[1].count for name in names}
+        self.add_rows(3)
+        for name in names:
+            with self.subTest(route=name):
+                after = self.call_and_rollback(ROUTE_CASES_BY_NAME[name])[1]
+                self.assertEqual(after.count, before[name], "\n".join(after.queries))
+
+
+class QueryBudgetMiddlewareTests(CatalogSeedMixin, TestCase):
+
+    @override_settings(QUERY_BUDGET_MODE='raise', QUERY_BUDGETS={'category-list': (0, 1000)})
+    def test_raise_mode_rejects_over_budget_request(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            APIClient().get(reverse('category-list'))
+
+    @override_settings(QUERY_BUDGET_MODE='log', QUERY_BUDGETS={'category-list': (0, 1000)})
+    def test_log_mode_warns_and_still_responds(self):
+        with self.assertLogs('ecommerce_app.query_budget', level='WARNING') as logs:
+            response = APIClient().get(reverse('category-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('category-list', logs.output[0])
+
+    # SQL time depends on the machine: only the query count is under test
+    @override_settings(
+        QUERY_BUDGET_MODE='raise', QUERY_BUDGETS={'category-list': (ENDPOINT_BUDGETS['category-list'].queries, 10 ** 6)}
+    )
+    def test_within_budget_request_passes(self):
+        response = APIClient().get(reverse('category-list'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'test_cache'
+    }})
+    def test_database_cache_round_trips_are_not_counted(self):
+        call_command('createcachetable', verbosity=0)
+        cache.set('key', 'value')
+        with QueryCounter() as counter:
+            self.assertEqual(cache.get('key'), 'value')
+            self.assertEqual(cache.get_many(['key', 'missing']), {'key': 'value'})
+            Category.objects.count()
+        self.assertEqual(counter.count, 1, counter.queries)
+
+    def test_only_the_first_statements_are_kept(self):
+        with QueryCounter(keep=2) as counter:
+            for _ in range(5):
+                Category.objects.count()
+        self.assertEqual((counter.count, len(counter.queries)), (5, 2))
+
+
+class ProductCardTests(CatalogSeedMixin, TestCase):
+
+    def card(self):
+        return ProductCard.objects.get(product=self.product)
+
+    def list_row(self, name):
+        response = APIClient().get(reverse('product-list'))
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results'] if isinstance(response.data, dict) else response.data
+        return next(row for row in results if row['name'] == name)
+
+    def test_card_follows_variant_changes(self):
+        card = self.card()
+        self.assertEqual((card.min_price, card.max_price, card.price), (Decimal('100.00'), Decimal('180.00'), Decimal('100.00')))
+        self.assertEqual((card.variants_count, card.has_discount, card.discount_percentage), (2, True, 10))
+
+        self.variant.price = Decimal('150.00')
+        self.variant.save()
+        self.assertEqual((self.card().price, self.card().min_price), (Decimal('150.00'), Decimal('150.00')))
+
+        ProductVariant.objects.create(product=self.product, size='50g', price=Decimal('60.00'), stock=5, sku='TURMERIC-50')
+        self.assertEqual((self.card().variants_count, self.card().min_price), (3, Decimal('60.00')))
+
+        discounted = self.product.variants.get(is_discount_active=True)
+        discounted.is_discount_active = False
+        discounted.save()
+        self.assertEqual((self.card().has_discount, self.card().max_price), (False, Decimal('200.00')))
+
+        discounted.delete()
+        self.assertEqual((self.card().variants_count, self.card().max_price), (2, Decimal('150.00')))
+
+    def test_card_follows_image_changes(self):
+        self.assertEqual(self.card().main_image, 'products/turmeric/front.jpg')
+        self.product.images.get().delete()
+        self.assertEqual(self.card().main_image, '')
+        ProductImage.objects.create(product=self.product, image='products/turmeric/side.jpg')
+        self.assertEqual(self.card().main_image, 'products/turmeric/side.jpg')
+
+    def test_list_endpoint_reads_from_the_card(self):
+        ProductCard.objects.filter(product=self.product).update(price=Decimal('1.00'), variants_count=9)
+        row = self.list_row('Turmeric')
+        self.assertEqual((row['price'], row['variants_count']), (Decimal('1.00'), 9))
+
+    def test_missing_card_is_built_on_read(self):
+        ProductCard.objects.filter(product=self.product).delete()
+        self.assertEqual(self.list_row('Turmeric')['variants_count'], 2)
+        self.assertTrue(ProductCard.objects.filter(product=self.product).exists())
+
+
+class ProductSearchTests(CatalogSeedMixin, TestCase):
+
+    def search_names(self, query, **params):
+        response = APIClient().get(reverse('product-list'), {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        results = data['results'] if isinstance(data, dict) else data
+        return [row['name'] for row in results]
+
+    def test_prefix_terms_match_name_category_and_brand(self):
+        self.assertEqual(self.search_names('turm'), ['Turmeric'])
+        self.assertCountEqual(self.search_names('spic devr'), ['Turmeric', 'Chilli'])
+        self.assertEqual(self.search_names('turmeric chilli'), [])
+
+    def test_results_ranked_by_name_match_first(self):
+        self.create_product('Chilli Flakes')
+        Product.objects.filter(name='Turmeric').update(description='<p>Pairs well with chilli</p>')
+        search.index_products([self.product.pk])
+        names = self.search_names('chilli')
+        self.assertEqual(set(names[:2]), {'Chilli', 'Chilli Flakes'})
+        self.assertEqual(names[2], 'Turmeric')
+
+    def test_missing_index_falls_back_to_icontains(self):
+        with mock.patch.object(search, '_indexed', set()), \
+                mock.patch.object(connection.introspection, 'table_names', return_value=[]), \
+                self.assertLogs('ecommerce_app.search', level='ERROR'):
+            self.assertEqual(self.search_names('turm'), ['Turmeric'])
+
+    def test_index_follows_product_and_brand_changes(self):
+        self.brand.name = 'Acme'
+        self.brand.save()
+        self.assertEqual(self.search_names('devrup'), [])
+        self.assertCountEqual(self.search_names('acme'), ['Turmeric', 'Chilli'])
+
+        self.product.delete()
+        self.assertEqual(self.search_names('turm'), [])
+
+    def test_query_syntax_is_not_passed_through(self):
+        self.assertEqual(self.search_names('"turm* OR'), [])
+        self.assertEqual(len(self.search_names('***')), 2)
+
+
+class KeysetPaginationTests(CatalogSeedMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.add_rows(12)
+
+    def walk(self, url_name, user=None, **params):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        seen = []
+        url, params = reverse(url_name), {'pagination': 'cursor', **params}
+        while url:
+            response = client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(row['id'] for row in response.data['results'])
+            url, params = response.data['next'], None
+        return seen
+
+    def test_cursor_pages_cover_every_row_once_for_each_ordering(self):
+        expected = set(str(pk) for pk in Product.objects.values_list('pk', flat=True))
+        for ordering in ['', 'name', '-name', 'created_at', 'variants__price', '-variants__price']:
+            with self.subTest(ordering=ordering):
+                seen = [str(pk) for pk in self.walk('product-list', ordering=ordering)]
+                self.assertEqual(len(seen), len(set(seen)))
+                self.assertEqual(set(seen), expected)
+
+    def test_search_results_are_paginated_in_rank_order(self):
+        expected = set(str(pk) for pk in Product.objects.filter(name__icontains='extra').values_list('pk', flat=True))
+        seen = [str(pk) for pk in self.walk('product-list', search='extra')]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), expected)
+
+        response = APIClient().get(reverse('product-list'), {'search': 'extra', 'page': 2})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_order_list_cursor_pages(self):
+        seen = [str(pk) for pk in self.walk('order-list', user=self.customer)]
+        self.assertEqual(len(seen), Order.objects.filter(user=self.customer).count())
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_page_number_mode_is_unchanged(self):
+        response = APIClient().get(reverse('product-list'))
+        self.assertEqual(response.data['count'], Product.objects.count())
+
+    def test_invalid_cursor_is_rejected(self):
+        response = APIClient().get(reverse('product-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_count_action_is_cached(self):
+        first = APIClient().get(reverse('product-count'), {'search': 'extra'}).data
+        second = APIClient().get(reverse('product-count'), {'search': 'extra'}).data
+        self.assertEqual(first, {'count': 12, 'approximate': False})
+        self.assertEqual(second, {'count': 12, 'approximate': True})
+
+    def test_count_of_an_empty_filter_is_zero(self):
+        self.assertEqual(cached_count(Product.objects.filter(pk__in=[])), (0, False))
+
+    def test_count_route_does_not_shadow_a_product_slug(self):
+        Product.objects.filter(pk=self.product.pk).update(slug='count')
+        response = APIClient().get(reverse('product-detail', kwargs={'slug': 'count'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], self.product.name)
+
+
+class ProductFacetsTests(CatalogSeedMixin, TestCase):
+
+    def get_facets(self, **params):
+        response = APIClient().get(reverse('product-facets'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_per_facet(self):
+        data = self.get_facets()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([(c['name'], c['count']) for c in data['categories']], [('Spices', 2)])
+        self.assertEqual([(b['name'], b['count']) for b in data['brands']], [('Devrup', 2)])
+        self.assertEqual(data['price_ranges'][0], {'min': 0, 'max': 250, 'count': 2})
+        self.assertEqual(data['discount'], {'true': 1, 'false': 1})
+
+    def test_facets_respect_list_filters(self):
+        data = self.get_facets(search='turm')
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['discount'], {'true': 1, 'false': 0})
+
+    def test_cached_until_products_change(self):
+        self.get_facets()
+        with self.assertNumQueries(0):
+            self.get_facets()
+
+        for variant in self.other_variant.product.variants.all():
+            variant.price = Decimal('600.00')
+            variant.save()
+        data = self.get_facets()
+        self.assertEqual([bucket['count'] for bucket in data['price_ranges']], [1, 0, 1, 0])
+        self.create_product('Cumin')
+        self.assertEqual(self.get_facets()['total'], 3)
+
+
+class EffectivePriceTests(CatalogSeedMixin, TestCase):
+
+    def list_names(self, **params):
+        response = APIClient().get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data['results']]
+
+    def test_effective_price_is_maintained_on_save(self):
+        discounted = self.product.variants.get(is_discount_active=True)
+        self.assertEqual(discounted.effective_price, Decimal('180.00'))
+        discounted.is_discount_active = False
+        discounted.save(update_fields=['is_discount_active'])
+        discounted.refresh_from_db()
+        self.assertEqual(discounted.effective_price, Decimal('200.00'))
+        self.assertEqual(ProductCard.objects.get(pk=self.product.pk).max_price, Decimal('200.00'))
+
+    def test_price_filter_matches_a_single_variant_in_range(self):
+        self.assertEqual(self.list_names(min_price='150', max_price='190'), ['Turmeric'])
+        self.assertEqual(self.list_names(min_price='190'), ['Chilli'])
+        # Both products span 120-160 but no variant is priced inside it
+        self.assertEqual(self.list_names(min_price='120', max_price='160'), [])
+
+    def test_price_ordering_uses_card_range(self):
+        self.create_product('Saffron')
+        saffron = ProductVariant.objects.filter(product__name='Saffron')
+        for variant in saffron:
+            variant.price += Decimal('1000')
+            variant.save()
+        self.assertEqual(self.list_names(ordering='-variants__price')[0], 'Saffron')
+        self.assertEqual(self.list_names(ordering='variants__price')[-1], 'Saffron')
+
+
+class HomepageCacheTests(CatalogSeedMixin, TestCase):
+
+    def get_homepage(self, host='testserver'):
+        response = APIClient().get(reverse('homepage-data'), HTTP_HOST=host)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.example.com'])
+    def test_served_from_cache_per_host(self):
+        data = self.get_homepage()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_homepage(), data)
+        other = self.get_homepage('shop.example.com')
+        self.assertTrue(other['hero_banner']['image'].startswith('http://shop.example.com/'))
+
+    def test_invalidated_by_catalog_changes(self):
+        self.get_homepage()
+        self.banner.title = 'New hero'
+        self.banner.save()
+        self.assertEqual(self.get_homepage()['hero_banner']['title'], 'New hero')
+
+        self.create_product('Cumin', is_featured=True)
+        self.assertIn('Cumin', [p['name'] for p in self.get_homepage()['new_arrivals']])
+
+        variant = ProductVariant.objects.get(product__name='Cumin', size='100g')
+        variant.is_discount_active, variant.discount_price = True, Decimal('90.00')
+        variant.save()
+        self.assertIn('Cumin', [p['name'] for p in self.get_homepage()['discounted_products']])
+
+
+class SingleFlightCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_build_once(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return {'value': 42}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(caching.get_or_build('single-flight', build, 60)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [{'value': 42}] * 8)
+
+    def test_bumping_a_namespace_changes_the_key(self):
+        key = caching.versioned_key('thing', [caching.PRODUCTS], 'a')
+        caching.bump_version(caching.PRODUCTS)
+        self.assertNotEqual(caching.versioned_key('thing', [caching.PRODUCTS], 'a'), key)
+
+
+class ConditionalGetTests(CatalogSeedMixin, TestCase):
+
+    def test_matching_etag_returns_304_without_queries(self):
+        for name, kwargs in [
+            ('product-list', {}), ('product-detail', {'slug': 'turmeric'}),
+            ('category-list', {}), ('brand-list', {}), ('banner-list', {}), ('homepage-data', {}),
+        ]:
+            with self.subTest(route=name):
+                url = reverse(name, kwargs=kwargs)
+                response = APIClient().get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response)
+                with self.assertNumQueries(0):
+                    cached = APIClient().get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(cached.status_code, 304)
+
+    def test_etag_changes_with_data_query_and_audience(self):
+        url = reverse('product-list')
+        etag = APIClient().get(url)['ETag']
+        self.assertNotEqual(APIClient().get(url, {'search': 'turm'})['ETag'], etag)
+
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        self.assertNotEqual(admin.get(url)['ETag'], etag)
+
+        self.variant.price = Decimal('120.00')
+        self.variant.save()
+        response = APIClient().get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_partial_sale_updates_the_catalog_stock(self):
+        url = reverse('product-detail', kwargs={'slug': self.product.slug})
+        response = APIClient().get(url)
+        stock = {variant['id']: variant['stock'] for variant in response.data['variants']}[self.variant.pk]
+        inventory.reserve_stock({self.variant.pk: 1})
+
+        fresh = APIClient().get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual({variant['id']: variant['stock'] for variant in fresh.data['variants']}[self.variant.pk], stock - 1)
+
+    def test_unrelated_namespace_does_not_invalidate(self):
+        url = reverse('brand-list')
+        etag = APIClient().get(url)['ETag']
+        self.banner.save()
+        self.assertEqual(APIClient().get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CategoryTreeTests(CatalogSeedMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.food = Category.objects.create(name='Food')
+        cls.category.parent = cls.food
+        cls.category.save()
+        cls.powders = Category.objects.create(name='Powders', parent=cls.category)
+        cls.turmeric_powder = cls.create_product('Turmeric Powder')
+        Product.objects.filter(pk=cls.turmeric_powder.pk).update(category=cls.powders)
+
+    def product_names(self, **params):
+        response = APIClient().get(reverse('product-list'), params)
+        return sorted(row['name'] for row in response.data['results'])
+
+    def test_paths_follow_moves(self):
+        self.assertEqual((self.food.depth, self.category.depth, self.powders.depth), (0, 1, 2))
+        self.category.parent = None
+        self.category.save()
+        self.powders.refresh_from_db()
+        self.assertEqual(self.powders.depth, 1)
+        self.assertTrue(self.powders.path.startswith(self.category.path))
+
+    def test_cannot_move_under_own_descendant(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.patch(
+            reverse('category-detail', kwargs={'pk': self.food.pk}), {'parent': str(self.powders.pk)}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_include_descendants_filter(self):
+        self.assertEqual(self.product_names(category__slug='food'), [])
+        self.assertEqual(
+            self.product_names(category__slug='food', include_descendants='true'),
+            ['Chilli', 'Turmeric', 'Turmeric Powder']
+        )
+        self.assertEqual(self.product_names(category__slug='powders', include_descendants='true'), ['Turmeric Powder'])
+
+    def test_breadcrumbs_and_tree(self):
+        response = APIClient().get(reverse('category-breadcrumbs', kwargs={'pk': self.powders.pk}))
+        self.assertEqual([c['name'] for c in response.data], ['Food', 'Spices', 'Powders'])
+
+        tree = APIClient().get(reverse('category-tree')).data
+        self.assertEqual([node['name'] for node in tree], ['Food'])
+        self.assertEqual(tree[0]['children'][0]['children'][0]['name'], 'Powders')
+
+    def test_deleting_a_parent_reroots_children(self):
+        self.food.delete()
+        self.category.refresh_from_db()
+        self.powders.refresh_from_db()
+        self.assertIsNone(self.category.parent)
+        self.assertEqual((self.category.depth, self.powders.depth), (0, 1))
+
+
+class ReviewAggregateTests(CatalogSeedMixin, TestCase):
+
+    def test_aggregates_follow_review_changes(self):
+        review = Review.objects.create(user=self.admin, product=self.product, rating=2, comment='Meh')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reviews_count, self.product.rating_sum), (2, 7))
+        self.assertEqual(self.product.average_rating, Decimal('3.50'))
+        self.assertEqual(self.product.rating_histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+
+        review.rating = 4
+        review.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_2, self.product.rating_4, self.product.average_rating), (0, 1, Decimal('4.50')))
+
+        review.delete()
+        Review.objects.filter(product=self.product).delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reviews_count, self.product.rating_sum, self.product.average_rating), (0, 0, 0))
+
+    def test_detail_reads_aggregate_columns(self):
+        response = APIClient().get(reverse('product-detail', kwargs={'slug': self.product.slug}))
+        self.assertEqual(response.data['average_rating'], 5.0)
+        self.assertEqual(response.data['reviews_count'], 1)
+        self.assertEqual(response.data['rating_histogram']['5'], 1)
+
+    def test_ordering_by_rating(self):
+        chilli = self.other_variant.product
+        Review.objects.create(user=self.admin, product=chilli, rating=3, comment='Ok')
+        response = APIClient().get(reverse('product-list'), {'ordering': '-rating'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Turmeric', 'Chilli'])
+        response = APIClient().get(reverse('product-list'), {'ordering': 'rating'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Chilli', 'Turmeric'])
+
+
+class CartSnapshotTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def get_cart(self):
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_payload_shape_and_cache_hit(self):
+        data = self.get_cart()
+        item = data['items'][0]
+        self.assertEqual(item['product']['name'], 'Turmeric')
+        self.assertEqual(item['product']['category']['slug'], 'spices')
+        self.assertTrue(item['product']['main_image'].endswith('/products/turmeric/front.jpg'))
+        self.assertEqual(data['total'], Decimal('200.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_cart(), data)
+        self.assertFalse(any('ecommerce_app_cartitem' in q['sql'] for q in queries.captured_queries))
+
+    def test_invalidated_by_item_and_variant_changes(self):
+        self.get_cart()
+        CartItem.objects.create(cart=self.cart, product_variant=self.other_variant, quantity=1)
+        self.assertEqual(len(self.get_cart()['items']), 2)
+
+        self.other_variant.price = Decimal('150.00')
+        self.other_variant.save()
+        self.assertEqual(self.get_cart()['total'], Decimal('350.00'))
+
+        CartItem.objects.filter(cart=self.cart, product_variant=self.other_variant).delete()
+        self.assertEqual(len(self.get_cart()['items']), 1)
+
+    def test_stock_is_current_on_a_cache_hit(self):
+        self.get_cart()
+        # A partial sale doesn't bump the products version
+        inventory.reserve_stock({self.variant.pk: 5})
+        self.assertEqual(self.get_cart()['items'][0]['product_variant']['stock'], 45)
+
+    def test_reading_a_missing_cart_does_not_create_it(self):
+        Cart.objects.filter(user=self.customer).delete()
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get_cart()
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['total'], Decimal('0.00'))
+        self.assertFalse(any(q['sql'].startswith('INSERT') for q in queries.captured_queries))
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+
+        response = self.client.post(
+            reverse('cart-add'), {'product_variant_id': self.variant.pk, 'quantity': 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.get_cart()['items']), 1)
+
+
+class CartBatchTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def batch(self, *operations):
+        return self.client.post(reverse('cart-batch'), {'operations': list(operations)}, format='json')
+
+    def test_operations_apply_in_order(self):
+        third = self.create_product('Cumin').variants.first()
+        response = self.batch(
+            {'op': 'add', 'product_variant_id': self.variant.pk, 'quantity': 3},
+            {'op': 'add', 'product_variant_id': self.other_variant.pk},
+            {'op': 'set', 'product_variant_id': third.pk, 'quantity': 2},
+            {'op': 'remove', 'product_variant_id': self.other_variant.pk},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changes'], {'created': 1, 'updated': 1, 'removed': 0})
+        self.assertEqual(
+            sorted(CartItem.objects.filter(cart=self.cart).values_list('product_variant_id', 'quantity')),
+            sorted([(self.variant.pk, 5), (third.pk, 2)])
+        )
+        self.assertEqual(len(response.data['cart']['items']), 2)
+
+    def test_set_zero_removes_line(self):
+        response = self.batch({'op': 'set', 'product_variant_id': self.variant.pk, 'quantity': 0})
+        self.assertEqual(response.data['changes'], {'created': 0, 'updated': 0, 'removed': 1})
+        self.assertEqual(response.data['cart']['items'], [])
+
+    def test_unknown_variant_rejects_whole_batch(self):
+        response = self.batch(
+            {'op': 'add', 'product_variant_id': self.other_variant.pk},
+            {'op': 'add', 'product_variant_id': 999999},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_variant_ids'], [999999])
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 1)
+
+    def test_one_line_per_variant(self):
+        response = self.client.post(
+            reverse('cart-add'), {'product_variant_id': self.variant.pk, 'quantity': 3}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=self.cart, product_variant=self.variant, quantity=1)
+
+    def test_query_count_does_not_grow_with_operations(self):
+        variants = [self.create_product(f'Bulk {i}').variants.first() for i in range(10)]
+        with CaptureQueriesContext(connection) as small:
+            self.batch({'op': 'add', 'product_variant_id': variants[0].pk})
+        with CaptureQueriesContext(connection) as large:
+            self.batch(*[{'op': 'add', 'product_variant_id': v.pk} for v in variants[1:]])
+        self.assertEqual(len(large), len(small))
+
+
+class CheckoutPipelineTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def checkout_cod(self, **data):
+        payload = {'address_id': self.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'}
+        payload.update(data)
+        return self.client.post(reverse('checkout-cod'), payload, format='json')
+
+    def test_cod_order_with_coupon(self):
+        discounted = self.product.variants.get(is_discount_active=True)
+        CartItem.objects.create(cart=self.cart, product_variant=discounted, quantity=1)
+
+        # 2 x 100 + 1 x 200 (180 after product discount) = 400 - 20 = 380; coupon 10% of 380
+        response = self.checkout_cod(product_discount='20.00', coupon_id=self.coupon.pk, discount_value='38.00')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['price_breakdown']['final_price'], '342.00')
+        self.assertEqual(response.data['price_breakdown']['total_discount'], '58.00')
+
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(
+            sorted(order.items.values_list('price', 'quantity')),
+            [(Decimal('100.00'), 2), (Decimal('180.00'), 1)]
+        )
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.used_count, 1)
+
+    def test_order_items_show_the_first_product_image(self):
+        ProductImage.objects.create(product=self.product, image='products/turmeric/side.jpg')
+        response = self.checkout_cod()
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertTrue(response.data['items'][0]['product_image'].endswith('/products/turmeric/front.jpg'))
+
+        listed = self.client.get(reverse('order-detail', args=[response.data['id']]))
+        self.assertTrue(listed.data['items'][0]['product_image'].endswith('/products/turmeric/front.jpg'))
+
+    def test_claimed_discount_mismatch_is_rejected(self):
+        response = self.checkout_cod(product_discount='5.00')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['expected'], '0.00')
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+
+    def test_exhausted_coupon_rolls_back_order(self):
+        cart_pricing = pricing.price_cart(self.customer).with_coupon(self.coupon)
+        Coupon.objects.filter(pk=self.coupon.pk).update(used_count=100)
+        with self.assertRaises(checkout.CheckoutError):
+            with transaction.atomic():
+                checkout.place_order(self.customer, self.address, cart_pricing, 'cash_on_delivery')
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart).exists())
+
+    @mock.patch('ecommerce_app.views.initiate_payment', return_value=GATEWAY_PAY_RESULT)
+    def test_online_order_keeps_cart_until_payment(self, initiate_payment):
+        response = self.client.post(reverse('checkout-online'), {'address_id': self.address.pk}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual(list(order.items.values_list('price', 'quantity')), [(Decimal('100.00'), 2)])
+        self.assertEqual(initiate_payment.call_args.kwargs['amount_in_paise'], 20000)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_online_order_is_committed_before_the_gateway_call(self):
+        def pay(**kwargs):
+            # Phase one already wrote the order, its hold and the pending Transaction
+            payment = Transaction.objects.get(merchant_order_id=kwargs['merchant_order_id'])
+            self.assertEqual(payment.status, 'PENDING')
+            self.assertTrue(payment.order.stock_reservations.exists())
+            return {**GATEWAY_PAY_RESULT, 'merchant_order_id': kwargs['merchant_order_id']}
+
+        with mock.patch('ecommerce_app.views.initiate_payment', side_effect=pay):
+            response = self.client.post(reverse('checkout-online'), {'address_id': self.address.pk}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        payment = Transaction.objects.get(merchant_order_id=response.data['merchant_order_id'])
+        self.assertEqual(payment.phonepe_transaction_id, 'PG123')
+
+    def test_failed_gateway_call_cancels_the_pending_order(self):
+        failure = {'success': False, 'error': 'Gateway says no'}
+        with mock.patch('ecommerce_app.views.initiate_payment', return_value=failure):
+            response = self.client.post(reverse('checkout-online'), {'address_id': self.address.pk}, format='json')
+        self.assertEqual(response.status_code, 500)
+        order = Order.objects.filter(user=self.customer).exclude(pk=self.order.pk).get()
+        self.assertEqual(order.status, 'cancelled')
+        self.assertEqual(order.transactions.get().status, 'FAILED')
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).stock, 50)
+
+    def test_gateway_timeout_leaves_the_order_pending(self):
+        timeout = {'success': False, 'error': 'PhonePe did not respond in time.', 'timed_out': True}
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'timeout-key'}
+        with mock.patch('ecommerce_app.views.initiate_payment', return_value=timeout) as initiate_payment:
+            response = self.client.post(
+                reverse('checkout-online'), {'address_id': self.address.pk}, format='json', **headers
+            )
+            retry = self.client.post(
+                reverse('checkout-online'), {'address_id': self.address.pk}, format='json', **headers
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.data['pending'])
+        order = Order.objects.filter(user=self.customer).exclude(pk=self.order.pk).get()
+        self.assertEqual((order.status, order.transactions.get().status), ('pending', 'PENDING'))
+        self.assertEqual(response.data['merchant_order_id'], order.transactions.get().merchant_order_id)
+
+        # The retry replays the pending outcome instead of placing a second order
+        self.assertEqual(initiate_payment.call_count, 1)
+        self.assertEqual((retry.status_code, retry.data), (202, response.data))
+
+    def test_query_count_does_not_grow_with_cart_lines(self):
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.checkout_cod().status_code, 201)
+
+        for i in range(5):
+            variant = self.create_product(f'Line {i}').variants.first()
+            CartItem.objects.create(cart=self.cart, product_variant=variant, quantity=1)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.checkout_cod().status_code, 201)
+        self.assertEqual(len(large), len(small), "\n".join(q['sql'] for q in large.captured_queries))
+
+
+class IdempotentCheckoutTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def checkout_cod(self, key, **data):
+        payload = {'address_id': self.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'}
+        payload.update(data)
+        return self.client.post(reverse('checkout-cod'), payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.checkout_cod('key-1')
+        self.assertEqual(first.status_code, 201, first.data)
+        with mock.patch('ecommerce_app.views.place_order') as place_order:
+            retry = self.checkout_cod('key-1')
+        place_order.assert_not_called()
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 2)
+        self.assertEqual(OutboxMessage.objects.filter(topic='order.confirmation_email').count(), 1)
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self.assertEqual(self.checkout_cod('key-1').status_code, 201)
+        self.assertEqual(self.checkout_cod('key-1', product_discount='1.00').status_code, 422)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_duplicate_of_an_in_flight_request_waits_for_it(self):
+        request = mock.Mock(data={}, method='POST', path=reverse('checkout-cod'))
+        fingerprint = idempotency.request_hash(request)
+        record, claimed = idempotency.claim(self.customer, 'checkout-cod', 'key-1', fingerprint)
+        self.assertTrue(claimed)
+
+        with mock.patch('ecommerce_app.idempotency.request_hash', return_value=fingerprint):
+            self.assertEqual(self.checkout_cod('key-1').status_code, 409)
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+
+    @mock.patch('ecommerce_app.views.initiate_payment', return_value=GATEWAY_PAY_RESULT)
+    def test_online_retry_does_not_open_a_second_payment(self, initiate_payment):
+        for _ in range(2):
+            response = self.client.post(
+                reverse('checkout-online'), {'address_id': self.address.pk}, format='json',
+                HTTP_IDEMPOTENCY_KEY='pay-1'
+            )
+            self.assertEqual(response.status_code, 201, response.data)
+        initiate_payment.assert_called_once()
+
+
+class CartPricingTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        discounted = self.product.variants.get(is_discount_active=True)
+        self.discounted_item = CartItem.objects.create(cart=self.cart, product_variant=discounted, quantity=1)
+
+    def test_breakdown_with_coupon(self):
+        cart_pricing = pricing.price_cart(self.customer).with_coupon(self.coupon)
+        self.assertEqual(cart_pricing.line(self.discounted_item.pk).product_discount, Decimal('20.00'))
+        self.assertEqual(cart_pricing.breakdown(), {
+            'subtotal': '400.00',
+            'product_discount': '20.00',
+            'coupon_discount': '38.00',
+            'total_discount': '58.00',
+            'final_price': '342.00',
+        })
+
+    def test_cart_is_priced_once_per_request(self):
+        request = Request(RequestFactory().get('/'))
+        first = pricing.price_cart(self.customer, request)
+        with self.assertNumQueries(0):
+            # The DRF request and the HttpRequest it wraps share the memo
+            self.assertIs(pricing.price_cart(self.customer, request._request), first)
+        pricing.forget(request)
+        self.assertIsNot(pricing.price_cart(self.customer, request), first)
+
+    def test_cart_serializer_uses_engine(self):
+        cart = cart_service.load_cart(Cart.objects.get(pk=self.cart.pk))
+        data = CartSerializer(cart).data
+        self.assertEqual(data['total'], pricing.price_cart(self.customer).total)
+        self.assertEqual(sorted(item['subtotal'] for item in data['items']), [Decimal('180.00'), Decimal('200.00')])
+
+
+class CouponIndexTests(CatalogSeedMixin, TestCase):
+
+    def test_lookups_are_served_from_the_index(self):
+        coupons.get_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(coupons.get_rule('SAVE10').coupon.pk, self.coupon.pk)
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(coupons.get_rule('NOPE'))
+        with self.assertNumQueries(0):
+            # Negative result is cached
+            self.assertIsNone(coupons.get_rule('NOPE'))
+
+    def test_coupon_changes_refresh_the_index(self):
+        self.assertIsNone(coupons.get_rule('NEW20'))
+        Coupon.objects.create(
+            code='NEW20', discount_type='flat', discount_value=Decimal('20'),
+            valid_from=self.coupon.valid_from, valid_to=self.coupon.valid_to
+        )
+        self.assertIsNotNone(coupons.get_rule('NEW20'))
+
+        self.coupon.is_active = False
+        self.coupon.save()
+        self.assertIsNone(coupons.get_rule('SAVE10'))
+
+    def test_restricted_coupon_covers_subcategories(self):
+        child = Category.objects.create(name='Whole Spices', parent=self.category)
+        other = Category.objects.create(name='Oils')
+        self.coupon.applicable_categories.add(self.category)
+        Product.objects.filter(pk=self.product.pk).update(category=child)
+
+        cart_pricing = pricing.price_cart(self.customer)
+        rule = coupons.get_rule('SAVE10')
+        self.assertIn(child.pk, rule.category_ids)
+        self.assertTrue(rule.applies_to_lines(cart_pricing.lines))
+
+        self.coupon.applicable_categories.set([other])
+        self.assertFalse(coupons.get_rule('SAVE10').applies_to_lines(cart_pricing.lines))
+
+    def test_last_use_refreshes_the_index(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(usage_limit=2)
+        coupons.get_index(force=True)
+        stale = coupons.get_coupon('SAVE10')
+        # Another checkout used it since the index was built
+        Coupon.objects.filter(pk=self.coupon.pk).update(used_count=1)
+
+        self.assertTrue(checkout.record_coupon_usage(self.customer, stale))
+        self.assertEqual(stale.used_count, 2)
+        self.assertFalse(coupons.get_rule('SAVE10').coupon.is_valid())
+
+    def test_use_past_the_limit_leaves_no_usage(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(usage_limit=1, used_count=1)
+        self.assertFalse(checkout.record_coupon_usage(self.customer, self.coupon))
+        self.assertFalse(CouponUsage.objects.filter(coupon=self.coupon).exists())
+
+    def test_overlong_codes_are_not_looked_up(self):
+        with self.assertNumQueries(0), mock.patch.object(coupons.cache, 'get') as cache_get:
+            self.assertIsNone(coupons.get_rule('X' * 51))
+        cache_get.assert_not_called()
+
+    def test_validate_endpoint(self):
+        client = APIClient()
+        response = client.post(reverse('coupon-validate'), {'code': 'SAVE10', 'cart_total': '200.00'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['discount_amount'], Decimal('20.00'))
+
+        response = client.post(reverse('coupon-validate'), {'code': 'NOPE', 'cart_total': '200.00'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class InventoryReservationTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def stock(self, variant):
+        return ProductVariant.objects.get(pk=variant.pk).stock
+
+    def test_cod_checkout_takes_stock(self):
+        response = self.client.post(reverse('checkout-cod'), {
+            'address_id': self.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.stock(self.variant), 48)
+
+    def test_insufficient_stock_rejects_checkout(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(stock=1)
+        response = self.client.post(reverse('checkout-cod'), {
+            'address_id': self.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_variant_ids'], [self.variant.pk])
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_reservation_is_all_or_nothing(self):
+        with self.assertRaises(inventory.OutOfStock) as raised:
+            inventory.reserve_stock({self.variant.pk: 1, self.other_variant.pk: 51})
+        self.assertEqual(raised.exception.variant_ids, [self.other_variant.pk])
+        self.assertEqual(self.stock(self.variant), 50)
+
+    def test_online_hold_released_on_failed_payment(self):
+        with mock.patch('ecommerce_app.views.initiate_payment', return_value=GATEWAY_PAY_RESULT):
+            response = self.client.post(reverse('checkout-online'), {'address_id': self.address.pk}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        merchant_order_id = response.data['merchant_order_id']
+        reservation = StockReservation.objects.get(order_id=response.data['order_id'])
+        self.assertEqual((reservation.status, reservation.quantity), ('held', 2))
+        self.assertEqual(self.stock(self.variant), 48)
+
+        with mock.patch('ecommerce_app.views.check_order_status',
+                        return_value={'success': True, 'data': {'state': 'FAILED'}}):
+            response = self.client.post(reverse('payment-status'), {'merchant_order_id': merchant_order_id}, format='json')
+        self.assertEqual(response.data['order_status'], 'cancelled')
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'released')
+        self.assertEqual(self.stock(self.variant), 50)
+
+    def test_expired_hold_is_released_and_retaken_on_late_payment(self):
+        order = self.create_order(self.customer)
+        inventory.hold_stock(order, {self.variant.pk: 2}, ttl=timedelta(seconds=-1))
+        self.assertEqual(inventory.release_expired_reservations(), 1)
+        self.assertEqual(inventory.release_expired_reservations(), 0)
+        self.assertEqual(self.stock(self.variant), 50)
+
+        inventory.commit_reservations(order)
+        self.assertEqual(order.stock_reservations.get().status, 'committed')
+        self.assertEqual(self.stock(self.variant), 48)
+
+    def test_cancelling_a_cod_order_restocks_it_once(self):
+        response = self.client.post(reverse('checkout-cod'), {
+            'address_id': self.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'
+        }, format='json')
+        self.assertEqual(self.stock(self.variant), 48)
+
+        admin_client = APIClient()
+        admin_client.force_authenticate(self.admin)
+        for _ in range(2):
+            cancelled = admin_client.post(
+                reverse('order-update-status', kwargs={'pk': response.data['id']}), {'status': 'cancelled'},
+                format='json'
+            )
+            self.assertEqual(cancelled.data['status'], 'cancelled')
+        self.assertEqual(self.stock(self.variant), 50)
+        # The second cancel changed nothing, so nothing more is sent
+        emails = OutboxMessage.objects.filter(topic='order.status_email', payload__new_status='cancelled')
+        self.assertEqual(emails.count(), 1)
+        self.assertEqual(Notification.objects.filter(title='Order Status Updated').count(), 1)
+
+    def test_cancelling_a_paid_online_order_restocks_it(self):
+        with mock.patch('ecommerce_app.views.initiate_payment', return_value=GATEWAY_PAY_RESULT):
+            response = self.client.post(reverse('checkout-online'), {'address_id': self.address.pk}, format='json')
+        with mock.patch('ecommerce_app.views.check_order_status',
+                        return_value={'success': True, 'data': {'state': 'COMPLETED'}}):
+            self.client.post(reverse('payment-status'), {'merchant_order_id': response.data['merchant_order_id']},
+                             format='json')
+        reservation = StockReservation.objects.get(order_id=response.data['order_id'])
+        self.assertEqual(reservation.status, 'committed')
+        self.assertEqual(self.stock(self.variant), 48)
+
+        admin_client = APIClient()
+        admin_client.force_authenticate(self.admin)
+        admin_client.post(
+            reverse('order-update-status', kwargs={'pk': response.data['order_id']}), {'status': 'cancelled'},
+            format='json'
+        )
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'released')
+        self.assertEqual(self.stock(self.variant), 50)
+
+    def test_admin_bulk_cancel_releases_holds(self):
+        order = self.create_order(self.customer)
+        inventory.hold_stock(order, {self.variant.pk: 2})
+        inventory.hold_stock(self.order, {self.variant.pk: 2})
+        order_admin = admin_site._registry[Order]
+        orders = Order.objects.filter(pk__in=[order.pk, self.order.pk])
+        with mock.patch.object(order_admin, 'message_user') as message_user:
+            order_admin.mark_as_cancelled(RequestFactory().post('/'), orders)
+        self.assertEqual(message_user.call_args.args[1], '2 order(s) marked as cancelled.')
+        self.assertEqual(order.stock_reservations.get().status, 'released')
+        self.assertEqual(self.stock(self.variant), 50)
+
+
+class PaymentReconciliationTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        inventory.hold_stock(self.order, {self.variant.pk: 2})
+        # Old enough to be considered stale
+        Transaction.objects.filter(pk=self.transaction.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+
+    def status_check(self, state):
+        return mock.Mock(return_value={'success': True, 'data': {'state': state}})
+
+    def test_paid_transaction_confirms_the_order(self):
+        check_status = self.status_check('COMPLETED')
+        with self.assertLogs('ecommerce_app.reconciliation', level='INFO'):
+            stats = reconciliation.reconcile_once(workers=1, check_status=check_status)
+        check_status.assert_called_once_with('ORDER_TEST_1')
+        self.assertEqual((stats['checked'], stats['success']), (1, 1))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'processing')
+        self.assertEqual(self.order.stock_reservations.get().status, 'committed')
+        self.assertEqual(OutboxMessage.objects.filter(topic='order.confirmation_email').count(), 1)
+        self.assertEqual(reconciliation.get_stats()['totals']['success'], 1)
+
+        # Already final: nothing left to check
+        self.assertEqual(reconciliation.reconcile_once(workers=1, check_status=check_status)['checked'], 0)
+        recorded = reconciliation.get_stats()
+        self.assertEqual((recorded['totals']['checked'], recorded['last_run']['checked']), (1, 0))
+
+    def test_pending_transaction_backs_off(self):
+        stats = reconciliation.reconcile_once(workers=1, check_status=self.status_check('PENDING'))
+        self.assertEqual(stats['pending'], 1)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.reconcile_attempts, 1)
+        self.assertGreater(self.transaction.next_reconcile_at, timezone.now())
+        self.assertEqual(reconciliation.claim_stale(10), [])
+
+    def test_recent_transactions_are_left_to_the_webhook(self):
+        Transaction.objects.filter(pk=self.transaction.pk).update(created_at=timezone.now())
+        check_status = self.status_check('FAILED')
+        self.assertEqual(reconciliation.reconcile_once(workers=1, check_status=check_status)['checked'], 0)
+        check_status.assert_not_called()
+
+
+class PaymentWebhookInboxTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        inventory.hold_stock(self.order, {self.variant.pk: 2})
+
+    def post_webhook(self, state, merchant_order_id='ORDER_TEST_1'):
+        callback = {'merchant_transaction_id': merchant_order_id, 'state': state, 'transaction_id': 'PG123'}
+        with mock.patch('ecommerce_app.views.verify_phonepe_webhook', return_value=(True, callback)):
+            return APIClient().post(reverse('phonepe-webhook'), {}, format='json')
+
+    def status_check(self, state):
+        return mock.Mock(return_value={'success': True, 'data': {'state': state}})
+
+    def test_webhook_is_stored_and_acknowledged(self):
+        with mock.patch('ecommerce_app.views.check_order_status') as check_status:
+            response = self.post_webhook('COMPLETED')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'queued'})
+        check_status.assert_not_called()
+
+        event = PaymentWebhookEvent.objects.get()
+        self.assertEqual((event.merchant_order_id, event.state, event.status), ('ORDER_TEST_1', 'COMPLETED', 'pending'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+        # PhonePe retrying the same callback is acknowledged but not stored twice
+        self.assertEqual(self.post_webhook('COMPLETED').json(), {'status': 'duplicate'})
+        self.assertEqual(PaymentWebhookEvent.objects.count(), 1)
+
+    def test_worker_applies_the_event(self):
+        self.post_webhook('COMPLETED')
+        check_status = self.status_check('COMPLETED')
+        self.assertEqual(webhook_inbox.drain(workers=1, check_status=check_status), (1, 1))
+        check_status.assert_called_once_with('ORDER_TEST_1')
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'processing')
+        self.assertEqual(self.order.stock_reservations.get().status, 'committed')
+        self.transaction.refresh_from_db()
+        self.assertEqual((self.transaction.status, self.transaction.phonepe_transaction_id), ('SUCCESS', 'PG123'))
+        self.assertEqual(PaymentWebhookEvent.objects.get().status, 'processed')
+        self.assertEqual(webhook_inbox.drain(workers=1, check_status=check_status), (0, 0))
+
+    def test_events_for_an_order_are_applied_in_arrival_order(self):
+        self.post_webhook('PENDING')
+        self.post_webhook('COMPLETED')
+
+        # The first event fails and backs off; the second must wait behind it
+        broken = mock.Mock(side_effect=RuntimeError('gateway down'))
+        self.assertEqual(webhook_inbox.drain(workers=1, check_status=broken), (1, 0))
+        self.assertEqual(webhook_inbox.claim(10), [])
+
+        PaymentWebhookEvent.objects.filter(state='PENDING').update(available_at=timezone.now())
+        first = webhook_inbox.claim(10)
+        self.assertEqual([event.state for event in first], ['PENDING'])
+        webhook_inbox.process(first[0], self.status_check('PENDING'))
+
+        self.assertEqual(webhook_inbox.drain(workers=1, check_status=self.status_check('COMPLETED')), (1, 1))
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'SUCCESS')
+
+    def test_event_gives_up_after_max_attempts(self):
+        self.post_webhook('COMPLETED', merchant_order_id='ORDER_UNKNOWN')
+        self.assertEqual(webhook_inbox.drain(workers=1, max_attempts=1, check_status=self.status_check('COMPLETED')), (1, 0))
+        event = PaymentWebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('failed', 1))
+        self.assertIn('does not exist', event.last_error)
+
+
+FAKE_GATEWAY = {'LATENCY_MS': (0, 0), 'WEBHOOK_DELAY_SECONDS': 0, 'WEBHOOK_URL': None, 'SEED': 1}
+
+
+@override_settings(PAYMENT_GATEWAY='ecommerce_app.fake_gateway.FakeGateway', FAKE_GATEWAY=FAKE_GATEWAY)
+class FakeGatewayTests(TestCase):
+
+    def test_gateway_is_chosen_by_setting(self):
+        self.assertIsInstance(payment_gateway.get_gateway(), fake_gateway.FakeGateway)
+        with override_settings(PAYMENT_GATEWAY='ecommerce_app.phonepe_payments.PhonePeGateway'):
+            self.assertNotIsInstance(payment_gateway.get_gateway(), fake_gateway.FakeGateway)
+
+    def test_payment_settles_to_the_configured_outcome(self):
+        started = payment_gateway.initiate_payment(10050, 'ORDER_FAKE_1', 'https://shop.test/payment-status/1')
+        self.assertTrue(started['success'])
+        self.assertEqual(started['redirect_url'], 'https://shop.test/payment-status/1')
+        self.assertEqual(payment_gateway.check_order_status('ORDER_FAKE_1')['data']['state'], 'COMPLETED')
+        self.assertFalse(payment_gateway.check_order_status('ORDER_UNKNOWN')['success'])
+
+        with override_settings(FAKE_GATEWAY={**FAKE_GATEWAY, 'DECLINE_RATE': 1.0}):
+            payment_gateway.initiate_payment(10050, 'ORDER_FAKE_2', '/')
+            self.assertEqual(payment_gateway.check_order_status('ORDER_FAKE_2')['data']['state'], 'FAILED')
+
+        with override_settings(FAKE_GATEWAY={**FAKE_GATEWAY, 'FAILURE_RATE': 1.0}):
+            self.assertEqual(payment_gateway.initiate_payment(10050, 'ORDER_FAKE_3', '/')['success'], False)
+
+    def test_webhook_accepts_only_signed_callbacks(self):
+        body = {'event': 'checkout.order.completed', 'payload': {
+            'merchantTransactionId': 'ORDER_TEST_1', 'transactionId': 'FAKE1', 'state': 'COMPLETED', 'amount': 10050
+        }}
+        url = reverse('phonepe-webhook')
+        client = APIClient()
+        response = client.post(url, body, format='json', HTTP_AUTHORIZATION=fake_gateway.callback_authorization())
+        self.assertEqual(response.json(), {'status': 'queued'})
+        self.assertEqual(PaymentWebhookEvent.objects.get().phonepe_transaction_id, 'FAKE1')
+        self.assertEqual(client.post(url, body, format='json', HTTP_AUTHORIZATION='forged').status_code, 401)
+
+
+class GatewayResilienceTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.breaker = gateway_resilience.CircuitBreaker(
+            window_seconds=60, min_calls=4, error_rate=0.5, slow_call_seconds=1.0, open_seconds=30,
+            clock=lambda: self.now
+        )
+
+    def test_breaker_opens_on_errors_and_probes_after_cooling_down(self):
+        for ok in (True, False, True, False):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(ok, 0.1)
+        self.assertEqual(self.breaker.snapshot()['state'], 'open')
+        self.assertFalse(self.breaker.allow())
+
+        self.now += 31
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())  # one probe at a time
+        self.breaker.record(False, 0.1)
+        self.assertTrue(self.breaker.is_open())
+
+        self.now += 31
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.snapshot()['state'], 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_calls_queued_past_their_budget_never_start(self):
+        hung, started = threading.Event(), []
+        pool = ThreadPoolExecutor(max_workers=1)
+        with mock.patch.object(gateway_resilience, '_call_pool', pool):
+            with self.assertRaises(FutureTimeout):
+                gateway_resilience.call_with_timeout(hung.wait, 0.05)
+            with self.assertRaises(FutureTimeout):
+                gateway_resilience.call_with_timeout(started.append, 0.05, 'pay')
+        hung.set()
+        pool.shutdown(wait=True)
+        self.assertEqual(started, [])
+
+    def test_breaker_opens_on_slow_calls(self):
+        for _ in range(4):
+            self.breaker.allow()
+            self.breaker.record(True, 2.5)
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.snapshot()['trips'], 1)
+
+    @override_settings(
+        PAYMENT_GATEWAY='ecommerce_app.fake_gateway.FakeGateway',
+        FAKE_GATEWAY={**FAKE_GATEWAY, 'LATENCY_MS': (300, 300)},
+        PAYMENT_GATEWAY_TIMEOUTS={'order_status': 0.05}, PAYMENT_GATEWAY_STATUS_RETRIES=0
+    )
+    def test_slow_calls_time_out(self):
+        result = payment_gateway.check_order_status('ORDER_TEST_1')
+        self.assertEqual((result['success'], result.get('timed_out')), (False, True))
+        latency = payment_gateway.get_metrics()['latency']['order_status']
+        self.assertEqual(latency['outcomes'], {'timeout': 1})
+        self.assertEqual(latency['buckets_ms']['le_50'], 0)
+        self.assertEqual(latency['buckets_ms']['le_inf'], 1)
+
+    @mock.patch('ecommerce_app.payment_gateway.time.sleep')
+    def test_status_checks_are_retried(self, sleep):
+        gateway = mock.Mock()
+        gateway.order_status.side_effect = [
+            {'success': False, 'error': 'Bad gateway'},
+            {'success': True, 'data': {'state': 'COMPLETED'}},
+        ]
+        with mock.patch('ecommerce_app.payment_gateway.get_gateway', return_value=gateway):
+            self.assertTrue(payment_gateway.check_order_status('ORDER_TEST_1')['success'])
+            self.assertEqual(gateway.order_status.call_count, 2)
+            sleep.assert_called_once()
+
+            # Starting a payment is never retried
+            gateway.pay.return_value = {'success': False, 'error': 'Bad gateway'}
+            self.assertFalse(payment_gateway.initiate_payment(100, 'ORDER_X', '/')['success'])
+            gateway.pay.assert_called_once()
+
+    @override_settings(PAYMENT_GATEWAY_BREAKER={'MIN_CALLS': 1})
+    def test_open_breaker_leaves_cash_on_delivery_only(self):
+        breaker = payment_gateway.get_breaker()
+        breaker.allow()
+        breaker.record(False, 0.1)
+
+        self.assertEqual(APIClient().get(reverse('payment-methods')).data, {'cod': True, 'online': False})
+        self.assertEqual(payment_gateway.check_order_status('ORDER_TEST_1').get('unavailable'), True)
+
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        orders = Order.objects.count()
+        with mock.patch('ecommerce_app.views.initiate_payment') as initiate_payment:
+            response = client.post(reverse('checkout-online'), {'address_id': self.address.pk}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['payment_methods'], ['cod'])
+        self.assertGreater(int(response['Retry-After']), 0)
+        initiate_payment.assert_not_called()
+        self.assertEqual(Order.objects.count(), orders)
+
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        metrics = admin.get(reverse('payment-gateway-metrics')).data
+        self.assertEqual(metrics['breaker']['state'], 'open')
+        self.assertEqual(metrics['latency']['order_status']['outcomes'], {'rejected': 1})
+        self.assertEqual(metrics['webhook_inbox']['pending'], 0)
+
+    def test_status_page_asks_to_retry_while_gateway_is_unavailable(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        unavailable = {'success': False, 'error': payment_gateway.UNAVAILABLE_ERROR, 'unavailable': True}
+        with mock.patch('ecommerce_app.views.check_order_status', return_value=unavailable):
+            response = client.post(reverse('payment-status'), {'merchant_order_id': 'ORDER_TEST_1'}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['status'], 'PENDING')
+
+    def test_status_page_keeps_a_payment_settled_during_its_check(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+
+        def settled_meanwhile(merchant_order_id):
+            # The webhook lands while the gateway is being asked
+            Transaction.objects.filter(merchant_order_id=merchant_order_id).update(status='SUCCESS')
+            return {'success': True, 'data': {'state': 'FAILED'}}
+
+        with mock.patch('ecommerce_app.views.check_order_status', side_effect=settled_meanwhile), \
+                mock.patch('ecommerce_app.views.apply_payment_state') as apply_payment_state:
+            response = client.post(reverse('payment-status'), {'merchant_order_id': 'ORDER_TEST_1'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'SUCCESS')
+        apply_payment_state.assert_not_called()
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_buyers_never_oversell(self):
+        vendor = User.objects.create_user('vendor@example.com', PASSWORD)
+        category = Category.objects.create(name='Spices', slug='spices')
+        product = Product.objects.create(name='Saffron', slug='saffron', description='', category=category, vendor=vendor)
+        variant = ProductVariant.objects.create(product=product, size='1g', price=Decimal('500.00'), stock=5, sku='SAF-1')
+
+        buyers = 20
+        results = []
+        start = threading.Barrier(buyers)
+
+        def buy():
+            start.wait()
+            try:
+                # SQLite's shared-cache test database reports lock contention
+                # instead of waiting; retry like a busy timeout would
+                for _ in range(100):
+                    try:
+                        with transaction.atomic():
+                            inventory.reserve_stock({variant.pk: 1})
+                        results.append(True)
+                        return
+                    except inventory.OutOfStock:
+                        results.append(False)
+                        return
+                    except OperationalError:
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(len(results), buyers)
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(variant.stock, 0)
+
+
+class OutboxTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def checkout_cod(self):
+        return self.client.post(reverse('checkout-cod'), {
+            'address_id': self.address.pk, 'product_discount': '0.00', 'discount_value': '0.00'
+        }, format='json')
+
+    def test_checkout_queues_emails_instead_of_sending(self):
+        response = self.checkout_cod()
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(
+            sorted(OutboxMessage.objects.values_list('topic', flat=True)),
+            ['order.admin_email', 'order.confirmation_email']
+        )
+
+        self.assertEqual(outbox.drain(workers=1), (2, 2))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted([
+            self.customer.email, settings.ADMIN_EMAIL
+        ]))
+        self.assertFalse(OutboxMessage.objects.exclude(status='sent').exists())
+
+    def test_rolled_back_checkout_queues_nothing(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(stock=0)
+        self.assertEqual(self.checkout_cod().status_code, 400)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_status_update_email_is_queued(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.post(reverse('order-update-status', kwargs={'pk': self.order.pk}), {'status': 'processing'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+
+        outbox.drain(workers=1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Order Status Update', mail.outbox[0].subject)
+
+    def test_failures_back_off_then_give_up(self):
+        message = outbox.enqueue('order.confirmation_email', {'order_id': str(self.order.pk)})
+        with mock.patch('ecommerce_app.views.send_order_confirmation_email', side_effect=OSError('SMTP down')):
+            self.assertEqual(outbox.drain(workers=1, max_attempts=2), (1, 0))
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, 'SMTP down'))
+            self.assertGreater(message.available_at, timezone.now())
+            self.assertEqual(outbox.drain(workers=1), (0, 0))
+
+            OutboxMessage.objects.filter(pk=message.pk).update(available_at=timezone.now())
+            outbox.drain(workers=1, max_attempts=2)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('failed', 2))
+
+    def test_rows_read_by_two_workers_are_claimed_once(self):
+        outbox.enqueue('order.confirmation_email', {'order_id': str(self.order.pk)})
+        # Both workers read the due message before either took it
+        seen = list(OutboxMessage.objects.all())
+        self.assertEqual(len(outbox.claim(10)), 1)
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False):
+            self.assertEqual(
+                outbox.take_leases(OutboxMessage, seen, ('status', 'locked_until'), status='processing'), []
+            )
+
+    def test_lost_lease_does_not_record_the_outcome(self):
+        outbox.enqueue('order.confirmation_email', {'order_id': str(self.order.pk)})
+        message, = outbox.claim(10)
+        # The lease lapsed and another worker re-claimed the message
+        OutboxMessage.objects.filter(pk=message.pk).update(locked_until=timezone.now() + timedelta(minutes=10))
+        with self.assertLogs('ecommerce_app.outbox', level='WARNING'):
+            self.assertTrue(outbox.deliver(message))
+        self.assertEqual(OutboxMessage.objects.get(pk=message.pk).status, 'processing')
+
+
+class MailServiceTests(CatalogSeedMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        mail_service.close_thread_connection()
+        self.addCleanup(mail_service.close_thread_connection)
+
+    def test_connection_is_reused_across_sends(self):
+        with mock.patch('ecommerce_app.mail.get_connection', side_effect=get_connection) as opened:
+            mail_service.send_mail('One', 'Body', None, ['a@example.com'])
+            mail_service.send_mail('Two', 'Body', None, ['b@example.com'])
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual([message.subject for message in mail.outbox], ['One', 'Two'])
+
+    def test_dropped_connection_is_reopened_once(self):
+        dropped = mock.Mock(connection=None)
+        dropped.send_messages.side_effect = smtplib.SMTPServerDisconnected('gone')
+        fresh = mock.Mock(connection=None)
+        fresh.send_messages.return_value = 1
+        with mock.patch('ecommerce_app.mail.get_connection', side_effect=[dropped, fresh]):
+            sent = mail_service.send_messages([mail_service.build_message('Hi', 'Body', None, ['a@example.com'])])
+        self.assertEqual(sent, 1)
+        dropped.close.assert_called_once()
+
+    def test_activation_reminders_go_out_in_batches(self):
+        for i in range(4):
+            User.objects.create_user(
+                f'pending{i}@example.com', PASSWORD, is_active=False, activation_token=f'pending-{i}'
+            )
+        # Deactivated by an admin after activating: no token, no reminder
+        User.objects.create_user('banned@example.com', PASSWORD, is_active=False)
+        pending = User.objects.filter(is_active=False, activation_token__isnull=False)
+
+        with mock.patch('ecommerce_app.mail.get_connection', side_effect=get_connection) as opened:
+            call_command('resend_activation_reminders', chunk_size=2, stdout=StringIO())
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(u.email for u in pending))
+        self.assertIsNone(User.objects.get(email='banned@example.com').activation_token)
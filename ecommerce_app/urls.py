@@ -44,6 +44,7 @@ urlpatterns = [
     path('cart/add/', CartItemCreateView.as_view(), name='cart-add'),
     path('cart/update/<int:item_id>/', CartItemUpdateView.as_view(), name='cart-update'),
     path('cart/remove/<int:item_id>/', CartItemRemoveView.as_view(), name='cart-remove'),
+    path('cart/batch/', CartBatchView.as_view(), name='cart-batch'),
    
     # ============================================
     # WISHLIST ENDPOINTS
@@ -71,6 +72,10 @@ urlpatterns = [
     # PhonePe webhook (for backend payment confirmation)
     path('payment/webhook/phonepe/', phonepe_webhook, name='phonepe-webhook'),
 
+    # Payment methods on offer (COD only while the gateway is failing) and gateway health
+    path('payment/methods/', PaymentMethodsView.as_view(), name='payment-methods'),
+    path('payment/gateway/metrics/', PaymentGatewayMetricsView.as_view(), name='payment-gateway-metrics'),
+
     # ============================================
     # DASHBOARD ENDPOINTS
     # ============================================
@@ -3,11 +3,12 @@ from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import authenticate
 from django.utils import timezone
-from django.db.models import Sum, Count, Avg, Q, Min, Max, Case, When
+from django.db.models import Sum, Count, Avg, Q, Case, When
 from django.db.models.functions import TruncDay, TruncMonth, Least, Greatest
 from django.utils.dateparse import parse_date
 
 
+import math
 import uuid
 import traceback
 
@@ -24,6 +25,7 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.decorators import action
 from rest_framework_simplejwt.tokens import RefreshToken
 from datetime import timedelta
+from decimal import Decimal, InvalidOperation
 
 from .models import (
     PromotionalBanner, User, Address, Category, Brand, Product, ProductVariant, ProductImage,
@@ -36,15 +38,26 @@ from .serializers import (
     AddressSerializer, CategorySerializer, BrandSerializer,
     ProductListSerializer, ProductDetailSerializer, ProductCreateUpdateSerializer,
     ProductImageSerializer, ProductAttributeSerializer, ProductVariantSerializer,
-    CartSerializer, CartItemSerializer, WishlistSerializer, ReviewSerializer,
+    CartSerializer, CartItemSerializer, CartBatchSerializer, WishlistSerializer, ReviewSerializer,
     CouponSerializer, CouponValidateSerializer, OrderSerializer, OrderCreateSerializer,
-    NotificationSerializer, DashboardOverviewSerializer, SalesReportSerializer, ProductImageSerializer
+    NotificationSerializer, DashboardOverviewSerializer, SalesReportSerializer, ProductImageSerializer,
+    product_images_prefetch
 )
+from . import caching, coupons, outbox, payment_gateway, pricing, reconciliation, webhook_inbox
+from .caching import ConditionalGetMixin
+from .cart import (
+    UnknownVariants, apply_cart_operations, empty_cart_payload, get_cart, get_cart_payload, get_or_create_cart,
+)
+from .checkout import (
+    CheckoutError, apply_coupon, cancel_order, check_product_discount, place_order,
+)
+from .idempotency import IdempotentMixin
+from .payments import apply_payment_state, enqueue_order_confirmation_emails
 
 
 
 
-from django.core.mail import send_mail
+from .mail import build_message, send_mail, send_messages
 from django.conf import settings
 
 from rest_framework import viewsets, status
@@ -246,8 +259,8 @@ def send_password_reset_email(user):
     )
 
 
-def send_activation_reminder_email(user):
-    """Send activation reminder email"""
+def activation_reminder_message(user):
+    """Activation reminder email for an inactive user, ready to send"""
     activation_link = f"https://{settings.FRONTEND_URL}activate/{user.activation_token}"
     
     html_message = f"""
@@ -325,16 +338,20 @@ def send_activation_reminder_email(user):
     </html>
     """
     
-    send_mail(
+    return build_message(
         'Account Activation Reminder',
         f'Please activate your account by clicking: {activation_link}',
         settings.EMAIL_HOST_USER,
         [user.email],
-        fail_silently=False,
         html_message=html_message
     )
 
 
+def send_activation_reminder_email(user):
+    """Send activation reminder email"""
+    send_messages([activation_reminder_message(user)])
+
+
 # ============================================================================
 # AUTHENTICATION VIEWS
 # ============================================================================
@@ -647,11 +664,12 @@ class CheckAuthView(APIView):
         }, status=status.HTTP_200_OK)
     
 
-class PromotionalBannerViewSet(viewsets.ModelViewSet):
+class PromotionalBannerViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing promotional banners.
     Provides CRUD operations for banners.
     """
+    conditional_namespaces = [caching.BANNERS]
     queryset = PromotionalBanner.objects.all().order_by('-created_at')
     serializer_class = PromotionalBannerSerializer
     parser_classes = (MultiPartParser, FormParser)
@@ -779,57 +797,12 @@ class EnhancedCartView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        # Use the standard serializer first
-        serializer = CartSerializer(cart)
-        cart_data = serializer.data
-        
-        # Enhance cart items with product details
-        if 'items' in cart_data and cart_data['items']:
-            enhanced_items = []
-            
-            for item_data in cart_data['items']:
-                # Get the product variant
-                if 'product_variant' in item_data and item_data['product_variant']:
-                    variant_id = item_data['product_variant']['id']
-                    try:
-                        # Get the actual variant
-                        variant = ProductVariant.objects.get(id=variant_id)
-                        
-                        # Get associated product
-                        product = variant.product
-                        
-                        # Get product image
-                        product_image = None
-                        image = ProductImage.objects.filter(product=product).first()
-                        if image:
-                            product_image = request.build_absolute_uri(image.image.url)
-                        
-                        # Add product data to the item
-                        item_data['product'] = {
-                            'id': str(product.id),
-                            'name': product.name,
-                            'slug': product.slug,
-                            'description': product.description,
-                            'category': {
-                                'id': str(product.category.id),
-                                'name': product.category.name,
-                                'slug': product.category.slug
-                            } if product.category else None,
-                            'main_image': product_image
-                        }
-                    except (ProductVariant.DoesNotExist, Product.DoesNotExist):
-                        # If the product or variant doesn't exist, just keep the original data
-                        pass
-                
-                enhanced_items.append(item_data)
-            
-            cart_data['items'] = enhanced_items
-        
-        return Response(cart_data)
-
-
+        cart = get_cart(request.user)
+        if cart is None:
+            return Response(empty_cart_payload())
+        # Items, variants, products, categories and images come from a single
+        # prefetch (see cart.py), cached until the cart or the catalog changes
+        return Response(get_cart_payload(cart, request))
 
 
 # Address Views
@@ -848,23 +821,63 @@ class AddressViewSet(viewsets.ModelViewSet):
 
 
 # Category Views
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    conditional_namespaces = [caching.CATEGORIES]
     permission_classes = [AllowAny]
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
+    tree_cache_timeout = 60 * 60
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
         return super().get_permissions()
 
+    @action(detail=True, methods=['get'])
+    def breadcrumbs(self, request, pk=None):
+        """Ancestors of a category (root first) followed by the category itself"""
+        category = self.get_object()
+        ancestors = {c.pk: c for c in Category.objects.filter(pk__in=category.get_ancestor_ids())}
+        trail = [ancestors[pk] for pk in category.get_ancestor_ids() if pk in ancestors] + [category]
+        return Response([{'id': c.id, 'name': c.name, 'slug': c.slug} for c in trail])
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """The full category tree, nested by parent, cached until categories change"""
+        staff = request.user.is_authenticated and (request.user.is_staff or request.user.is_admin)
+
+        def build():
+            queryset = Category.objects.order_by('depth', 'display_order', 'name')
+            if not staff:
+                queryset = queryset.filter(is_active=True)
+            nodes, roots = {}, []
+            for category in queryset:
+                node = {
+                    'id': category.id, 'name': category.name, 'slug': category.slug,
+                    'depth': category.depth, 'display_order': category.display_order, 'children': []
+                }
+                nodes[category.id] = node
+                if category.parent_id is None:
+                    roots.append(node)
+                elif category.parent_id in nodes:
+                    nodes[category.parent_id]['children'].append(node)
+                # else: child of an inactive category - hidden with its parent
+            return roots
+
+        def respond():
+            cache_key = caching.versioned_key('category-tree', [caching.CATEGORIES], staff)
+            return Response(caching.get_or_build(cache_key, build, self.tree_cache_timeout))
+
+        return self.conditional_get(request, respond)
+
 
 # Brand Views
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
+    conditional_namespaces = [caching.BRANDS]
     permission_classes = [AllowAny]
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
@@ -899,15 +912,19 @@ class ProductImageViewSet(viewsets.ModelViewSet):
         
         serializer.save(product=product)
 
-from django.db.models import Min, Max, Case, When, Q, F, Value, DecimalField
-from django.db.models.functions import Coalesce
+from django.db.models import Case, When, Q, Value, IntegerField, Exists, OuterRef, Subquery
+from django.core.cache import cache
 from django_filters.rest_framework import DjangoFilterBackend
+from .search import ProductSearchFilter
+from .pagination import ApproximateCountMixin, PageNumberOrKeysetPagination
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, ApproximateCountMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     lookup_field = 'slug'
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]  # Remove OrderingFilter, we'll handle manually
-    search_fields = ['name', 'description', 'category__name', 'brand__name']
+    pagination_class = PageNumberOrKeysetPagination
+    conditional_namespaces = [caching.PRODUCTS, caching.CATEGORIES, caching.BRANDS]
+    filter_backends = [ProductSearchFilter, DjangoFilterBackend]  # Remove OrderingFilter, we'll handle manually
+    search_fields = ['name', 'description', 'category__name', 'brand__name']  # icontains fallback only
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -928,16 +945,14 @@ class ProductViewSet(viewsets.ModelViewSet):
         user = self.request.user
 
         queryset = Product.objects.select_related(
-            'category', 'brand', 'vendor'
+            'category', 'brand', 'vendor', 'card'
         ).prefetch_related('variants')
 
         if not (user.is_authenticated and user.is_admin):
             queryset = queryset.filter(is_active=True)
 
         queryset = self.apply_filters(queryset)
-        queryset = self.apply_ordering(queryset)
-
-        return queryset.distinct()
+        return self.apply_ordering(queryset)
 
     
     def apply_filters(self, queryset):
@@ -946,7 +961,12 @@ class ProductViewSet(viewsets.ModelViewSet):
         # Filter by category
         category_slug = self.request.query_params.get('category__slug')
         if category_slug:
-            queryset = queryset.filter(category__slug=category_slug)
+            if self.request.query_params.get('include_descendants') in ('true', '1'):
+                # Whole subtree in one query via the materialized path prefix
+                category_path = Category.objects.filter(slug=category_slug).values('path')[:1]
+                queryset = queryset.filter(category__path__startswith=Subquery(category_path))
+            else:
+                queryset = queryset.filter(category__slug=category_slug)
         
         # Filter by brand
         brand = self.request.query_params.get('brand')
@@ -958,22 +978,19 @@ class ProductViewSet(viewsets.ModelViewSet):
         max_price = self.request.query_params.get('max_price')
         
         if min_price or max_price:
-            # Create a subquery for products with variants in the price range
-            variant_filter = Q()
-            
+            # The card's min/max effective price range must overlap the requested
+            # range (indexed), and some variant's effective price must fall inside it
+            variant_filter = Q(product_id=OuterRef('pk'))
+
             if min_price:
-                variant_filter &= (
-                    Q(variants__is_discount_active=True, variants__discount_price__gte=min_price) |
-                    Q(variants__is_discount_active=False, variants__price__gte=min_price)
-                )
-            
+                queryset = queryset.filter(card__max_price__gte=min_price)
+                variant_filter &= Q(effective_price__gte=min_price)
+
             if max_price:
-                variant_filter &= (
-                    Q(variants__is_discount_active=True, variants__discount_price__lte=max_price) |
-                    Q(variants__is_discount_active=False, variants__price__lte=max_price)
-                )
-            
-            queryset = queryset.filter(variant_filter)
+                queryset = queryset.filter(card__min_price__lte=max_price)
+                variant_filter &= Q(effective_price__lte=max_price)
+
+            queryset = queryset.filter(Exists(ProductVariant.objects.filter(variant_filter)))
         
         # Filter by vendor
         vendor = self.request.query_params.get('vendor')
@@ -991,34 +1008,12 @@ class ProductViewSet(viewsets.ModelViewSet):
             return queryset.order_by('-created_at', 'id')
         
         if ordering == 'variants__price':
-            # Order by minimum effective price (ascending)
-            return queryset.annotate(
-                min_effective_price=Min(
-                    Case(
-                        When(
-                            variants__is_discount_active=True,
-                            then=Coalesce('variants__discount_price', 'variants__price')
-                        ),
-                        default='variants__price',
-                        output_field=DecimalField(max_digits=10, decimal_places=2)
-                    )
-                )
-            ).order_by('min_effective_price', 'id')
+            # Order by minimum effective price (ascending), maintained on the product card
+            return queryset.order_by('card__min_price', 'id')
             
         elif ordering == '-variants__price':
             # Order by maximum effective price (descending)
-            return queryset.annotate(
-                max_effective_price=Max(
-                    Case(
-                        When(
-                            variants__is_discount_active=True,
-                            then=Coalesce('variants__discount_price', 'variants__price')
-                        ),
-                        default='variants__price',
-                        output_field=DecimalField(max_digits=10, decimal_places=2)
-                    )
-                )
-            ).order_by('-max_effective_price', 'id')
+            return queryset.order_by('-card__max_price', 'id')
             
         elif ordering == 'created_at':
             # Oldest first
@@ -1036,6 +1031,14 @@ class ProductViewSet(viewsets.ModelViewSet):
             # Alphabetical Z-A
             return queryset.order_by('-name', 'id')
             
+        elif ordering == 'rating':
+            # Lowest rated first, from the maintained review aggregates
+            return queryset.order_by('average_rating', 'reviews_count', 'id')
+
+        elif ordering == '-rating':
+            # Best rated first; more reviews wins a tie
+            return queryset.order_by('-average_rating', '-reviews_count', 'id')
+
         elif ordering == 'reviews_count' or ordering == '-reviews_count':
             # Order by review count (requires reviews_count field or annotation)
             return queryset.order_by(ordering, 'id')
@@ -1048,22 +1051,6 @@ class ProductViewSet(viewsets.ModelViewSet):
                 # If ordering fails, fall back to default
                 return queryset.order_by('-created_at', 'id')
     
-    def list(self, request, *args, **kwargs):
-        """Override list to handle pagination and ensure unique results"""
-        queryset = self.get_queryset()
-        
-        # Apply search filter if using SearchFilter
-        queryset = self.filter_queryset(queryset)
-        
-        # Paginate
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
-    
     @action(detail=True, methods=['get'])
     def variants(self, request, slug=None):
         product = self.get_object()
@@ -1076,7 +1063,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         product = self.get_object()
         
         if request.method == 'GET':
-            reviews = product.reviews.all()
+            reviews = product.reviews.select_related('user')
             serializer = ReviewSerializer(reviews, many=True, context={'request': request})
             return Response(serializer.data)
         
@@ -1111,6 +1098,79 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductListSerializer(product, context={'request': request})
         return Response(serializer.data)
 
+    # Price bands (on the card's lowest effective price) shown by the facets endpoint
+    FACET_PRICE_BUCKETS = [(0, 250), (250, 500), (500, 1000), (1000, None)]
+    FACET_FILTER_PARAMS = ['category__slug', 'include_descendants', 'brand', 'min_price', 'max_price', 'vendor', 'search']
+    FACET_CACHE_TIMEOUT = 60 * 10
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Product counts per category, brand, price band and discount flag for
+        the current filters, computed in a single grouped query and cached
+        per filter signature until products, categories or brands change.
+        """
+        user = request.user
+        signature = (
+            bool(user.is_authenticated and user.is_admin),
+            tuple((param, request.query_params.get(param, '').strip()) for param in self.FACET_FILTER_PARAMS),
+        )
+        cache_key = caching.versioned_key(
+            'product-facets', [caching.PRODUCTS, caching.CATEGORIES, caching.BRANDS], signature
+        )
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.build_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(cache_key, data, self.FACET_CACHE_TIMEOUT)
+        return Response(data)
+
+    def build_facets(self, queryset):
+        price_bucket = Case(
+            *[
+                When(Q(card__min_price__gte=low) & (Q(card__min_price__lt=high) if high else Q()), then=Value(index))
+                for index, (low, high) in enumerate(self.FACET_PRICE_BUCKETS)
+            ],
+            default=Value(None),
+            output_field=IntegerField()
+        )
+        rows = queryset.order_by().annotate(price_bucket=price_bucket).values(
+            'category_id', 'category__name', 'category__slug',
+            'brand_id', 'brand__name', 'price_bucket', 'card__has_discount'
+        ).annotate(count=Count('pk', distinct=True))
+
+        categories, brands = {}, {}
+        buckets = [0] * len(self.FACET_PRICE_BUCKETS)
+        discount = {'true': 0, 'false': 0}
+        total = 0
+        for row in rows:
+            count = row['count']
+            total += count
+            if row['category_id']:
+                entry = categories.setdefault(row['category_id'], {
+                    'id': row['category_id'], 'name': row['category__name'],
+                    'slug': row['category__slug'], 'count': 0
+                })
+                entry['count'] += count
+            if row['brand_id']:
+                entry = brands.setdefault(row['brand_id'], {
+                    'id': row['brand_id'], 'name': row['brand__name'], 'count': 0
+                })
+                entry['count'] += count
+            if row['price_bucket'] is not None:
+                buckets[row['price_bucket']] += count
+            discount['true' if row['card__has_discount'] else 'false'] += count
+
+        return {
+            'total': total,
+            'categories': sorted(categories.values(), key=lambda c: (-c['count'], c['name'])),
+            'brands': sorted(brands.values(), key=lambda b: (-b['count'], b['name'])),
+            'price_ranges': [
+                {'min': low, 'max': high, 'count': buckets[index]}
+                for index, (low, high) in enumerate(self.FACET_PRICE_BUCKETS)
+            ],
+            'discount': discount,
+        }
+
 # Add this to views.py
 class ProductImageUploadView(APIView):
     permission_classes = [IsAuthenticated]
@@ -1370,7 +1430,9 @@ class CartView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart = get_cart(request.user)
+        if cart is None:
+            return Response(empty_cart_payload())
         serializer = CartSerializer(cart)
         return Response(serializer.data)
 
@@ -1379,8 +1441,6 @@ class CartItemCreateView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
         variant_id = request.data.get('product_variant_id')
         quantity = int(request.data.get('quantity', 1))
         
@@ -1388,14 +1448,17 @@ class CartItemCreateView(APIView):
             return Response({'error': 'Quantity must be greater than zero'}, status=status.HTTP_400_BAD_REQUEST)
         
         variant = get_object_or_404(ProductVariant, id=variant_id)
+        cart = get_or_create_cart(request.user)
         
-        # Check if item is already in cart
-        try:
-            cart_item = CartItem.objects.get(cart=cart, product_variant=variant)
-            cart_item.quantity += quantity
-            cart_item.save()
-        except CartItem.DoesNotExist:
-            cart_item = CartItem.objects.create(cart=cart, product_variant=variant, quantity=quantity)
+        with transaction.atomic():
+            # Concurrent adds of a new variant would both miss the line and race to insert it
+            Cart.objects.select_for_update().get(pk=cart.pk)
+            cart_item = CartItem.objects.filter(cart=cart, product_variant=variant).first()
+            if cart_item:
+                cart_item.quantity += quantity
+                cart_item.save()
+            else:
+                cart_item = CartItem.objects.create(cart=cart, product_variant=variant, quantity=quantity)
         
         serializer = CartItemSerializer(cart_item)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -1428,12 +1491,37 @@ class CartItemRemoveView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class CartBatchView(APIView):
+    """
+    Apply several add/set/remove operations to the cart in one request and
+    return the recomputed cart.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        cart = get_or_create_cart(request.user)
+        try:
+            summary = apply_cart_operations(cart, serializer.validated_data['operations'])
+        except UnknownVariants as e:
+            return Response(
+                {'error': 'Some product variants do not exist', 'product_variant_ids': e.variant_ids},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({'changes': summary, 'cart': get_cart_payload(cart, request)})
+
+
 # Wishlist Views
 class WishlistView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        wishlist_items = Wishlist.objects.filter(user=request.user)
+        wishlist_items = Wishlist.objects.filter(user=request.user).select_related(
+            'product__category', 'product__brand', 'product__card'
+        ).prefetch_related('product__variants')
         serializer = WishlistSerializer(wishlist_items, many=True, context={'request': request})
         return Response(serializer.data)
     
@@ -1507,61 +1595,67 @@ class CouponViewSet(viewsets.ModelViewSet):
     def validate(self, request):
         """Validate a coupon code for checkout"""
         code = request.data.get('code')
-        cart_total = request.data.get('cart_total', 0)
-        
         try:
-            coupon = Coupon.objects.get(code=code, is_active=True)
-            
-            # Check if coupon is currently valid
-            from django.utils import timezone
-            now = timezone.now()
-            
-            if coupon.valid_from > now:
-                return Response({
-                    'valid': False,
-                    'message': 'This coupon is not yet valid'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            if coupon.valid_to < now:
-                return Response({
-                    'valid': False,
-                    'message': 'This coupon has expired'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Check usage limit
-            if coupon.used_count >= coupon.usage_limit:
-                return Response({
-                    'valid': False,
-                    'message': 'This coupon has reached its usage limit'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Check minimum purchase amount
-            if cart_total < coupon.min_purchase_amount:
-                return Response({
-                    'valid': False,
-                    'message': f'Minimum purchase amount of ${coupon.min_purchase_amount} required'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Calculate discount
-            if coupon.discount_type == 'percent':
-                discount_amount = (cart_total * coupon.discount_value) / 100
-                if coupon.max_discount:
-                    discount_amount = min(discount_amount, coupon.max_discount)
-            else:
-                discount_amount = coupon.discount_value
-            
+            cart_total = Decimal(str(request.data.get('cart_total', 0)))
+        except (InvalidOperation, ValueError):
             return Response({
-                'valid': True,
-                'coupon': CouponSerializer(coupon).data,
-                'discount_amount': discount_amount,
-                'final_amount': cart_total - discount_amount
-            })
-            
-        except Coupon.DoesNotExist:
+                'valid': False,
+                'message': 'Invalid cart total'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Served from the in-process coupon index: no query for known or unknown codes
+        rule = coupons.get_rule(code)
+        if rule is None:
             return Response({
                 'valid': False,
                 'message': 'Invalid coupon code'
             }, status=status.HTTP_404_NOT_FOUND)
+        coupon = rule.coupon
+
+        # Check if coupon is currently valid
+        now = timezone.now()
+
+        if coupon.valid_from > now:
+            return Response({
+                'valid': False,
+                'message': 'This coupon is not yet valid'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if coupon.valid_to < now:
+            return Response({
+                'valid': False,
+                'message': 'This coupon has expired'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check usage limit
+        if coupon.used_count >= coupon.usage_limit:
+            return Response({
+                'valid': False,
+                'message': 'This coupon has reached its usage limit'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check minimum purchase amount
+        if cart_total < coupon.min_purchase_amount:
+            return Response({
+                'valid': False,
+                'message': f'Minimum purchase amount of ${coupon.min_purchase_amount} required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Coupons limited to some products/categories need one of them in the cart
+        if rule.is_restricted and request.user.is_authenticated:
+            if not rule.applies_to_lines(pricing.price_cart(request.user, request).lines):
+                return Response({
+                    'valid': False,
+                    'message': 'This coupon does not apply to the items in your cart'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+        discount_amount = coupon.calculate_discount(cart_total)
+        return Response({
+            'valid': True,
+            'coupon': CouponSerializer(coupon).data,
+            'discount_amount': discount_amount,
+            'final_amount': cart_total - discount_amount
+        })
 
 
 
@@ -1938,7 +2032,9 @@ from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from io import BytesIO
+from io import BytesIO, StringIO
+import csv
+import xlsxwriter
 
 class ExportSalesReportView(APIView):
     permission_classes = [IsAdminUser]
@@ -2029,7 +2125,60 @@ class ExportSalesReportView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    # CSV and Excel methods remain the same
+    def _report_rows(self, data, period):
+        period_key, period_label = ('date', 'Date') if period == 'daily' else ('month', 'Month')
+        header = [period_label, 'Sales', 'Orders', 'Average Order Value']
+        rows = [
+            [item[period_key], round(item['sales'], 2), item['orders'], round(item['avg_order_value'], 2)]
+            for item in data
+        ]
+        return header, rows
+
+    def _summary_rows(self, summary):
+        return [
+            ['Total Sales', round(summary.get('total_sales', 0), 2)],
+            ['Total Orders', summary.get('total_orders', 0)],
+            ['Average Order Value', round(summary.get('avg_order_value', 0), 2)],
+        ]
+
+    def export_csv(self, data, period, start_date, end_date, summary):
+        header, rows = self._report_rows(data, period)
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([f"Sales Report ({period.capitalize()})", f"{start_date} to {end_date}"])
+        writer.writerow([])
+        writer.writerow(header)
+        writer.writerows(rows)
+        writer.writerow([])
+        writer.writerows(self._summary_rows(summary))
+
+        response = HttpResponse(buffer.getvalue(), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="sales_report_{period}_{start_date}_{end_date}.csv"'
+        return response
+
+    def export_excel(self, data, period, start_date, end_date, summary):
+        header, rows = self._report_rows(data, period)
+        buffer = BytesIO()
+        workbook = xlsxwriter.Workbook(buffer, {'in_memory': True})
+        worksheet = workbook.add_worksheet('Sales Report')
+        bold = workbook.add_format({'bold': True})
+
+        worksheet.write_row(0, 0, [f"Sales Report ({period.capitalize()})", f"{start_date} to {end_date}"], bold)
+        worksheet.write_row(2, 0, header, bold)
+        for index, row in enumerate(rows, start=3):
+            worksheet.write_row(index, 0, row)
+        for index, row in enumerate(self._summary_rows(summary), start=len(rows) + 4):
+            worksheet.write(index, 0, row[0], bold)
+            worksheet.write(index, 1, row[1])
+        worksheet.set_column(0, len(header) - 1, 20)
+        workbook.close()
+
+        response = HttpResponse(
+            buffer.getvalue(),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        response['Content-Disposition'] = f'attachment; filename="sales_report_{period}_{start_date}_{end_date}.xlsx"'
+        return response
     
     def export_pdf_reportlab(self, data, period, start_date, end_date, summary):
         # Create a file-like buffer to receive PDF data
@@ -2160,18 +2309,20 @@ def validate_coupon_code(request):  # Completely new function name
     serializer = CouponValidateSerializer(data=request.data)
     if serializer.is_valid():
         coupon = serializer.validated_data['coupon']
+        rule = coupons.get_rule_for(coupon)
+        if rule.is_restricted and not rule.applies_to_lines(pricing.price_cart(request.user, request).lines):
+            return Response(
+                {'error': 'This coupon does not apply to the items in your cart'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         # Check if user has already used this coupon
         if CouponUsage.objects.filter(user=request.user, coupon=coupon).exists():
             return Response({'error': 'You have already used this coupon'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Calculate discount amount
         cart_total = serializer.validated_data['cart_total']
-        if coupon.discount_type == 'percent':
-            discount = cart_total * (coupon.discount_value / 100)
-            if coupon.max_discount and discount > coupon.max_discount:
-                discount = coupon.max_discount
-        else:  # flat discount
-            discount = coupon.discount_value
+        discount = coupon.calculate_discount(cart_total)
         
         return Response({
             'valid': True,
@@ -2187,10 +2338,23 @@ def validate_coupon_code(request):  # Completely new function name
 
 # views.py - Add a new view for homepage data
 
-class HomepageDataView(APIView):
+class HomepageDataView(ConditionalGetMixin, APIView):
     permission_classes = [AllowAny]
-    
+    cache_timeout = 60 * 15
+    conditional_namespaces = [caching.BANNERS, caching.CATEGORIES, caching.BRANDS, caching.PRODUCTS]
+
     def get(self, request):
+        # Image URLs are absolute, so the payload is cached per scheme + host.
+        # Banner/category/brand/product signals bump the versions in the key.
+        return self.conditional_get(request, lambda: Response(self.get_payload(request)))
+
+    def get_payload(self, request):
+        cache_key = caching.versioned_key(
+            'homepage', self.conditional_namespaces, request.scheme, request.get_host()
+        )
+        return caching.get_or_build(cache_key, lambda: self.build_payload(request), self.cache_timeout)
+
+    def build_payload(self, request):
         # Get active promotional banners
         hero_banner = PromotionalBanner.objects.filter(
             is_active=True, 
@@ -2211,26 +2375,26 @@ class HomepageDataView(APIView):
         featured_products = Product.objects.filter(
             is_active=True,
             is_featured=True
-        ).prefetch_related(
-            'variants', 'images', 'category'
-        )[:4]
+        ).select_related(
+            'category', 'brand', 'card'
+        ).prefetch_related('variants')[:4]
         
         # Get new arrivals (based on created_at)
         new_arrivals = Product.objects.filter(
             is_active=True
         ).order_by(
             '-created_at'
-        ).prefetch_related(
-            'variants', 'images', 'category'
-        )[:8]
+        ).select_related(
+            'category', 'brand', 'card'
+        ).prefetch_related('variants')[:8]
         
-        # Get products with discounts
+        # Get products with discounts (has_discount is kept on the product card)
         discounted_products = Product.objects.filter(
             is_active=True,
-            variants__is_discount_active=True
-        ).distinct().prefetch_related(
-            'variants', 'images', 'category'
-        )[:4]
+            card__has_discount=True
+        ).select_related(
+            'category', 'brand', 'card'
+        ).prefetch_related('variants')[:4]
         
         # Serialize the data
         context = {'request': request}
@@ -2242,14 +2406,14 @@ class HomepageDataView(APIView):
         discounted_products_data = ProductListSerializer(discounted_products, many=True, context=context).data
         
         # Combine and return
-        return Response({
+        return {
             'hero_banner': hero_banner_data,
             'middle_banner': middle_banner_data,
             'categories': categories_data,
             'featured_products': featured_products_data,
             'new_arrivals': new_arrivals_data,
             'discounted_products': discounted_products_data
-        })
+        }
 
 
 # views.py
@@ -2260,21 +2424,22 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.http import JsonResponse
-from django.core.mail import send_mail
+from .mail import send_mail
 from django.conf import settings
 from decimal import Decimal
 import logging
 import uuid
 
-from .models import Order, OrderItem, Transaction, Cart, Coupon, CouponUsage, Notification
+from .models import Order, OrderItem, Transaction, Coupon, CouponUsage, Notification
 from .serializers import (
     OrderSerializer, CODOrderCreateSerializer, 
     OnlinePaymentInitiateSerializer, TransactionSerializer
 )
-from .phonepe_payments import initiate_payment, check_order_status, verify_phonepe_webhook
+from .payment_gateway import initiate_payment, check_order_status, verify_phonepe_webhook
 
 logger = logging.getLogger(__name__)
 
@@ -2577,9 +2742,8 @@ def generate_admin_email_html(context):
     """
 
 
-def send_order_confirmation_emails(order, order_items):
-    """Send order confirmation emails to customer and admin"""
-    # Customer Email
+def send_order_confirmation_email(order, order_items):
+    """Send the order confirmation email to the customer"""
     customer_context = {
         'user_name': order.user.get_full_name() or order.user.email,
         'order_id': str(order.id),
@@ -2602,7 +2766,11 @@ def send_order_confirmation_emails(order, order_items):
         fail_silently=False
     )
     
-    # Admin Email
+    logger.info(f"Order confirmation email sent for order {order.id}")
+
+
+def send_new_order_admin_email(order, order_items):
+    """Send the new order email to the admin"""
     admin_context = {
         'order_id': str(order.id),
         'order_items': order_items,
@@ -2629,183 +2797,105 @@ def send_order_confirmation_emails(order, order_items):
         fail_silently=False
     )
     
-    logger.info(f"Order confirmation emails sent for order {order.id}")
+    logger.info(f"New order email sent to admin for order {order.id}")
+
+
+# Outbox handlers (see outbox.py): each loads the order fresh and sends one email
+
+def order_email_items(order):
+    return [
+        {
+            'product_name': item.product_variant.product.name,
+            'quantity': item.quantity,
+            'size': item.product_variant.size,
+            'price': item.price * item.quantity
+        }
+        for item in order.items.select_related('product_variant__product')
+    ]
+
+
+def _order_for_email(payload):
+    return Order.objects.select_related('user', 'address', 'coupon').get(pk=payload['order_id'])
+
+
+def deliver_order_confirmation_email(payload):
+    order = _order_for_email(payload)
+    send_order_confirmation_email(order, order_email_items(order))
+
+
+def deliver_new_order_admin_email(payload):
+    order = _order_for_email(payload)
+    send_new_order_admin_email(order, order_email_items(order))
+
+
+def deliver_order_status_email(payload):
+    send_order_status_email(_order_for_email(payload), payload['old_status'], payload['new_status'])
 
 
 # ============================================
 # CASH ON DELIVERY ORDER VIEW
 # ============================================
 
-class CashOnDeliveryOrderView(APIView):
+class CashOnDeliveryOrderView(IdempotentMixin, APIView):
     """Handle Cash on Delivery orders"""
     permission_classes = [IsAuthenticated]
+    idempotency_endpoint = 'checkout-cod'
     
     def post(self, request):
+        # Retries with the same Idempotency-Key get the first response back
+        return self.idempotent(request, lambda: self.create_order(request))
+    
+    def create_order(self, request):
         serializer = CODOrderCreateSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            with transaction.atomic():
-                # --- Step 1: Validate Cart ---
-                try:
-                    cart = Cart.objects.get(user=request.user)
-                except Cart.DoesNotExist:
-                    return Response({"error": "Cart not found"}, status=status.HTTP_400_BAD_REQUEST)
-
-                cart_items = cart.items.all()
-                if not cart_items.exists():
-                    return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
+            # --- Step 1: Load and price the cart (one query) ---
+            cart_pricing = pricing.price_cart(request.user, request)
+            if not cart_pricing:
+                return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
+
+            # --- Step 2: Validate claimed discounts against the priced cart ---
+            # Coupon is applied on the total AFTER product discounts
+            check_product_discount(
+                cart_pricing, serializer.validated_data.get('product_discount', Decimal('0.00'))
+            )
+            cart_pricing = apply_coupon(
+                cart_pricing,
+                serializer.validated_data.get('coupon_id'),
+                request.user,
+                serializer.validated_data.get('discount_value', Decimal('0.00'))
+            )
 
-                # --- Step 2: Calculate Prices with Product Discounts ---
-                subtotal = Decimal('0.00')  # Original price without any discounts
-                product_discount_total = Decimal('0.00')  # Product-level discounts
-                
-                for item in cart_items:
-                    variant = item.product_variant
-                    original_price = variant.price * item.quantity
-                    subtotal += original_price
-                    
-                    # Calculate product discount if active
-                    if variant.is_discount_active and variant.discount_price:
-                        discounted_price = variant.discount_price * item.quantity
-                        product_discount_total += (original_price - discounted_price)
-                
-                # Total after product discounts (before coupon)
-                total_after_product_discount = subtotal - product_discount_total
-                
-                # --- Step 3: Validate Product Discount from Frontend ---
-                claimed_product_discount = serializer.validated_data.get('product_discount', Decimal('0.00'))
-                
-                # Verify frontend calculation matches backend
-                if abs(claimed_product_discount - product_discount_total) > Decimal('0.01'):
-                    return Response(
-                        {
-                            "error": "Product discount mismatch",
-                            "expected": str(product_discount_total),
-                            "received": str(claimed_product_discount)
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # --- Step 4: Validate Coupon Discount ---
-                coupon = serializer.validated_data.get('coupon_id')
-                claimed_coupon_discount = serializer.validated_data.get('discount_value', Decimal('0.00'))
-                coupon_discount = Decimal('0.00')
-                
-                if coupon:
-                    # Coupon is applied on the total AFTER product discounts
-                    if not coupon.is_valid(user=request.user, cart_total=total_after_product_discount):
-                        return Response(
-                            {"error": "Coupon is no longer valid"},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    coupon_discount = coupon.calculate_discount(total_after_product_discount)
-                    
-                    # Verify coupon discount matches
-                    if abs(coupon_discount - claimed_coupon_discount) > Decimal('0.01'):
-                        return Response(
-                            {
-                                "error": "Coupon discount mismatch",
-                                "expected": str(coupon_discount),
-                                "received": str(claimed_coupon_discount)
-                            },
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    # Check usage limit
-                    usage_count = CouponUsage.objects.filter(
-                        user=request.user,
-                        coupon=coupon
-                    ).count()
-                    if usage_count >= coupon.user_limit:
-                        return Response(
-                            {'error': 'Coupon usage limit reached'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                
-                # --- Step 5: Calculate Final Price ---
-                # Subtotal - Product Discount - Coupon Discount = Final Price
-                final_price = subtotal - product_discount_total - coupon_discount
-                total_discount = product_discount_total + coupon_discount
-                # Ensure final price is not negative
-                if final_price < 0:
-                    final_price = Decimal('0.00')
-                
-                # --- Step 6: Create Order ---
-                order = Order.objects.create(
-                    user=request.user,
-                    address=serializer.validated_data['address_id'],
-                    total_price=final_price,
-                    payment_method='cash_on_delivery',
-                    status='pending',
-                    coupon=coupon,
-                    discount_amount=total_discount  # Total discount (product + coupon)
+            # --- Step 3: Write order, items, coupon usage; clear cart ---
+            with transaction.atomic():
+                order = place_order(
+                    request.user,
+                    serializer.validated_data['address_id'],
+                    cart_pricing,
+                    payment_method='cash_on_delivery'
                 )
-                
-                # --- Step 7: Create Order Items ---
-                order_items = []
-                for cart_item in cart_items:
-                    variant = cart_item.product_variant
-                    
-                    # Store the actual price used (discounted if applicable)
-                    item_price = variant.price * cart_item.quantity
-                    
-                    OrderItem.objects.create(
-                        order=order,
-                        product_variant=cart_item.product_variant,
-                        quantity=cart_item.quantity,
-                        price=item_price  # Store the actual price paid per unit
-                    )
-                    order_items.append({
-                        'product_name': cart_item.product_variant.product.name,
-                        'quantity': cart_item.quantity,
-                        'size': cart_item.product_variant.size,
-                        'price': item_price * cart_item.quantity
-                    })
-                
-                # --- Step 8: Handle Coupon Usage ---
-                if coupon:
-                    CouponUsage.objects.create(
-                        user=request.user,
-                        coupon=coupon,
-                        order=order
-                    )
-                    coupon.usage_count += 1
-                    coupon.save()
-                
-                # --- Step 9: Clear Cart ---
-                cart_items.delete()
-                
-                # --- Step 10: Send Emails ---
-                try:
-                    send_order_confirmation_emails(order, order_items)
-                except Exception as e:
-                    logger.error(f"Failed to send COD emails for order {order.id}: {str(e)}")
-                
-                # --- Step 11: Create Notification ---
                 Notification.objects.create(
                     user=request.user,
                     title="Order Placed Successfully",
                     message=f"Your COD order #{order.id} has been placed successfully."
                 )
-                
-                # --- Step 12: Return Response with Breakdown ---
-                response_data = OrderSerializer(order, context={'request': request}).data
-                response_data['price_breakdown'] = {
-                    'subtotal': str(subtotal),
-                    'product_discount': str(product_discount_total),
-                    'coupon_discount': str(coupon_discount),
-                    'total_discount': str(total_discount),
-                    'final_price': str(final_price)
-                }
-                
-                return Response(
-                    response_data,
-                    status=status.HTTP_201_CREATED
-                )
-                
+                # Emails are sent by the outbox worker once this commits
+                enqueue_order_confirmation_emails(order)
+
+            # --- Step 4: Return Response with Breakdown ---
+            prefetch_related_objects([order], product_images_prefetch())
+            response_data = OrderSerializer(order, context={'request': request}).data
+            response_data['price_breakdown'] = cart_pricing.breakdown()
+            
+            return Response(
+                response_data,
+                status=status.HTTP_201_CREATED
+            )
+
+        except CheckoutError as e:
+            return Response(e.payload, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"COD order creation failed: {str(e)}", exc_info=True)
             return Response(
@@ -2817,126 +2907,108 @@ class CashOnDeliveryOrderView(APIView):
 # ONLINE PAYMENT VIEW
 # ============================================
 
-class OnlinePaymentView(APIView):
+class OnlinePaymentView(IdempotentMixin, APIView):
     """Handle online payment flow via PhonePe"""
     permission_classes = [IsAuthenticated]
+    idempotency_endpoint = 'checkout-online'
     
     def post(self, request):
+        # Retries with the same Idempotency-Key reuse the first payment session
+        return self.idempotent(request, lambda: self.start_payment(request))
+    
+    def start_payment(self, request):
         serializer = OnlinePaymentInitiateSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # The gateway is failing: don't place an order we can't take payment for
+        if not payment_gateway.online_payments_available():
+            return self.online_payments_unavailable()
         
         try:
-            with transaction.atomic():
-                # --- Step 1: Validate Cart ---
-                cart_items = Cart.objects.filter(user=request.user)
-                if not cart_items.exists():
-                    return Response(
-                        {"error": "Cart is empty"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # --- Step 2: Calculate Prices ---
-                # total_price = sum(item.total_price for item in cart_items)
-                try:
-                    cart = Cart.objects.get(user=request.user)
-                except Cart.DoesNotExist:
-                    return Response({"error": "Cart not found"}, status=status.HTTP_400_BAD_REQUEST)
-
-                cart_items = cart.items.all()
-                if not cart_items.exists():
-                    return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Step 2: Calculate total price
-                total_price = sum(
-                    (item.product_variant.discount_price or item.product_variant.price) * item.quantity
-                    for item in cart_items
-                )
+            # --- Step 1: Load and price the cart (one query) ---
+            cart_pricing = pricing.price_cart(request.user, request)
+            if not cart_pricing:
+                return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
+
+            # --- Step 2: Validate Coupon ---
+            cart_pricing = apply_coupon(
+                cart_pricing,
+                serializer.validated_data.get('coupon_id'),
+                request.user,
+                serializer.validated_data.get('discount_value', Decimal('0.00'))
+            )
 
-                coupon = serializer.validated_data.get('coupon_id')
-                claimed_discount = serializer.validated_data.get('discount_value', Decimal('0.00'))
-                
-                # --- Step 3: Validate Coupon ---
-                if coupon:
-                    if not coupon.is_valid(user=request.user, cart_total=total_price):
-                        return Response(
-                            {"error": "Coupon is no longer valid"},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    actual_discount = coupon.calculate_discount(total_price)
-                    if actual_discount != claimed_discount:
-                        return Response(
-                            {"error": "Invalid discount amount"},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    usage_count = CouponUsage.objects.filter(
-                        user=request.user,
-                        coupon=coupon
-                    ).count()
-                    if usage_count >= coupon.user_limit:
-                        return Response(
-                            {'error': 'Coupon usage limit reached'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                
-                final_price = total_price - claimed_discount
-                
-                # --- Step 4: Create Order (status='pending') ---
-                order = Order.objects.create(
-                    user=request.user,
-                    address=serializer.validated_data['address_id'],
-                    total_price=final_price,
+            # --- Phase 1: Commit the pending order, its items, a stock hold and the Transaction ---
+            # Coupon usage and clearing the cart wait for the payment confirmation
+            with transaction.atomic():
+                order = place_order(
+                    request.user,
+                    serializer.validated_data['address_id'],
+                    cart_pricing,
                     payment_method='online',
-                    status='pending',
-                    coupon=coupon,
-                    discount_amount=claimed_discount
+                    record_coupon=False,
+                    clear_cart=False,
+                    hold_stock=True
                 )
-                
-                # --- Step 5: Create Order Items ---
-                for cart_item in cart_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        product_variant=cart_item.product_variant,
-                        quantity=cart_item.quantity,
-                        price=cart_item.product_variant.price
-                    )
-                
-                # --- Step 6: Generate Merchant Order ID ---
                 merchant_order_id = f"ORDER_{order.id}_{uuid.uuid4().hex[:8].upper()}"
-                
-                # --- Step 7: Initiate PhonePe Payment ---
-                payment_result = initiate_payment(
-                    amount_in_paise=int(final_price * 100),
-                    merchant_order_id=merchant_order_id,
-                    redirect_url=f"{settings.FRONTEND_URL}/payment-status/{merchant_order_id}"
-                )
-                
-                if not payment_result['success']:
-                    # Rollback: Delete the order if payment initiation fails
-                    order.delete()
-                    raise Exception(payment_result['error'])
-                
-                # --- Step 8: Create Transaction Record ---
-                Transaction.objects.create(
+                payment = Transaction.objects.create(
                     order=order,
-                    merchant_order_id=payment_result['merchant_order_id'],
-                    phonepe_transaction_id=payment_result.get('pg_txn_id'),
-                    amount=final_price,
-                    status='PENDING',
-                    pg_response_payload=payment_result
+                    merchant_order_id=merchant_order_id,
+                    amount=order.total_price,
+                    status='PENDING'
                 )
+
+            # --- Phase 2: Initiate PhonePe Payment, outside any transaction ---
+            # The gateway round trip (bounded by payment_gateway's latency budget) holds no database locks
+            payment_result = initiate_payment(
+                amount_in_paise=int(order.total_price * 100),
+                merchant_order_id=merchant_order_id,
+                redirect_url=f"{settings.FRONTEND_URL}/payment-status/{merchant_order_id}"
+            )
+
+            if not payment_result['success']:
+                if payment_result.get('timed_out'):
+                    # Outcome unknown: the order stays pending for the webhook / status check,
+                    # and its stock hold lapses on its own if it was never paid. Not a 5xx, so
+                    # a retry with the same Idempotency-Key replays this instead of placing
+                    # a second order.
+                    logger.warning(f"Payment initiation timed out for order {order.id} ({merchant_order_id})")
+                    return Response({
+                        'success': False,
+                        'pending': True,
+                        'error': 'Payment gateway did not respond. Check the payment status before paying again.',
+                        'order_id': str(order.id),
+                        'merchant_order_id': merchant_order_id
+                    }, status=status.HTTP_202_ACCEPTED)
+
+                with transaction.atomic():
+                    cancel_order(order)
+                    Transaction.objects.filter(pk=payment.pk).update(
+                        status='FAILED', pg_response_message=payment_result['error'], updated_at=timezone.now()
+                    )
+                if payment_result.get('unavailable'):
+                    return self.online_payments_unavailable()
+                raise Exception(payment_result['error'])
+
+            # --- Phase 3: Record the gateway's response (one short write) ---
+            Transaction.objects.filter(pk=payment.pk).update(
+                phonepe_transaction_id=payment_result.get('pg_txn_id'),
+                pg_response_payload=payment_result,
+                updated_at=timezone.now()
+            )
                 
-                logger.info(f"Payment initiated for order {order.id}, merchant_order_id: {merchant_order_id}")
-                
-                return Response({
-                    'success': True,
-                    'payment_url': payment_result['redirect_url'],
-                    'order_id': str(order.id),
-                    'merchant_order_id': merchant_order_id
-                }, status=status.HTTP_201_CREATED)
-                
+            logger.info(f"Payment initiated for order {order.id}, merchant_order_id: {merchant_order_id}")
+            
+            return Response({
+                'success': True,
+                'payment_url': payment_result['redirect_url'],
+                'order_id': str(order.id),
+                'merchant_order_id': merchant_order_id
+            }, status=status.HTTP_201_CREATED)
+
+        except CheckoutError as e:
+            return Response(e.payload, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Payment initiation failed: {str(e)}", exc_info=True)
             return Response({
@@ -2944,6 +3016,14 @@ class OnlinePaymentView(APIView):
                 'error': 'Payment initiation failed. Please try again.'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def online_payments_unavailable(self):
+        return Response({
+            'success': False,
+            'error': 'Online payments are temporarily unavailable. Please use Cash on Delivery.',
+            'payment_methods': ['cod']
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(max(math.ceil(payment_gateway.retry_after()), 1))})
+
 
 # ============================================
 # PHONEPE WEBHOOK HANDLER
@@ -2952,7 +3032,12 @@ class OnlinePaymentView(APIView):
 @csrf_exempt
 @require_http_methods(["POST"])
 def phonepe_webhook(request):
-    """Handle PhonePe payment webhooks - PRIMARY confirmation mechanism"""
+    """
+    Handle PhonePe payment webhooks - PRIMARY confirmation mechanism.
+
+    Only verifies and stores the callback, then acknowledges it; the
+    process_payment_webhooks worker applies it (see webhook_inbox.py).
+    """
     
     try:
         # --- Step 1: Verify Webhook Signature ---
@@ -2963,124 +3048,26 @@ def phonepe_webhook(request):
         
         logger.info(f"Valid webhook received: {callback_data}")
         
-        # --- Step 2: Process Webhook ---
-        with transaction.atomic():
-            # Extract data with fallback for different PhonePe response formats
-            merchant_order_id = callback_data.get('merchantTransactionId') or callback_data.get('merchant_order_id')
-            phonepe_status = callback_data.get('state') or callback_data.get('status')
-            phonepe_txn_id = callback_data.get('transactionId') or callback_data.get('pg_txn_id')
-            
-            if not merchant_order_id or not phonepe_status:
-                logger.error(f"Missing required fields in webhook: {callback_data}")
-                return JsonResponse({"error": "Invalid webhook data"}, status=400)
-            
-            try:
-                # Get transaction with lock to prevent race conditions
-                txn = Transaction.objects.select_for_update().get(
-                    merchant_order_id=merchant_order_id
-                )
-                order = txn.order
-                
-                # Skip if already processed successfully
-                if txn.status == 'SUCCESS':
-                    logger.info(f"Transaction {merchant_order_id} already processed")
-                    return JsonResponse({"status": "already_processed"})
-                
-                # Double-check with PhonePe API for security
-                status_result = check_order_status(merchant_order_id)
-                if status_result['success']:
-                    api_status = status_result['data'].get('state') or status_result['data'].get('status')
-                    if api_status and api_status != phonepe_status:
-                        logger.warning(f"Status mismatch for {merchant_order_id}: webhook={phonepe_status}, api={api_status}")
-                        phonepe_status = api_status  # Trust API over webhook
-                
-                # Map PhonePe status to Transaction status
-                status_mapping = {
-                    'COMPLETED': 'SUCCESS',
-                    'SUCCESS': 'SUCCESS',
-                    'FAILED': 'FAILED',
-                    'PENDING': 'PENDING'
-                }
-                
-                new_txn_status = status_mapping.get(phonepe_status, 'PENDING')
-                old_status = txn.status
-                
-                # Update transaction
-                txn.status = new_txn_status
-                if phonepe_txn_id:
-                    txn.phonepe_transaction_id = phonepe_txn_id
-                txn.pg_response_payload = callback_data
-                txn.payment_response = callback_data
-                txn.save()
-                
-                logger.info(f"Transaction {merchant_order_id}: {old_status} -> {new_txn_status}")
-                
-                # Process based on status
-                if phonepe_status in ['COMPLETED', 'SUCCESS']:
-                    # Payment successful
-                    order.status = 'processing'
-                    order.save()
-                    
-                    # Clear user's cart
-                    Cart.objects.filter(user=order.user).delete()
-                    
-                    # Create coupon usage record
-                    if order.coupon:
-                        coupon_usage, created = CouponUsage.objects.get_or_create(
-                            user=order.user, 
-                            coupon=order.coupon,
-                            defaults={'order': order}
-                        )
-                        if created:
-                            order.coupon.usage_count += 1
-                            order.coupon.save()
-                            logger.info(f"Coupon {order.coupon.code} marked as used")
-                    
-                    # Create notification
-                    Notification.objects.create(
-                        user=order.user,
-                        title="Payment Successful",
-                        message=f"Your payment for order #{order.id} was successful."
-                    )
-                    
-                    # Send confirmation emails
-                    try:
-                        order_items = []
-                        for item in order.items.all():
-                            order_items.append({
-                                'product_name': item.product_variant.product.name,
-                                'quantity': item.quantity,
-                                'size': item.product_variant.size,
-                                'price': item.price * item.quantity
-                            })
-                        send_order_confirmation_emails(order, order_items)
-                    except Exception as e:
-                        logger.error(f"Failed to send payment emails for order {order.id}: {str(e)}")
-                    
-                    logger.info(f"Payment completed for order {order.id}")
-                    
-                elif phonepe_status == 'FAILED':
-                    order.status = 'cancelled'
-                    order.save()
-                    
-                    # Create notification
-                    Notification.objects.create(
-                        user=order.user,
-                        title="Payment Failed",
-                        message=f"Your payment for order #{order.id} failed. Please try again."
-                    )
-                    
-                    logger.info(f"Payment failed for order {order.id}")
-                    
-                elif phonepe_status == 'PENDING':
-                    # Keep order status as pending
-                    logger.info(f"Payment still pending for order {order.id}")
-                
-            except Transaction.DoesNotExist:
-                logger.error(f"Transaction not found: {merchant_order_id}")
-                return JsonResponse({"error": "Transaction not found"}, status=404)
-                
-        return JsonResponse({"status": "processed"})
+        # Extract data with fallback for different PhonePe response formats
+        merchant_order_id = callback_data.get('merchantTransactionId') or callback_data.get('merchant_order_id') \
+            or callback_data.get('merchant_transaction_id')
+        phonepe_status = callback_data.get('state') or callback_data.get('status')
+        phonepe_txn_id = callback_data.get('transactionId') or callback_data.get('pg_txn_id') \
+            or callback_data.get('transaction_id')
+        
+        if not merchant_order_id or not phonepe_status:
+            logger.error(f"Missing required fields in webhook: {callback_data}")
+            return JsonResponse({"error": "Invalid webhook data"}, status=400)
+        
+        # --- Step 2: Store it in the inbox (repeats of the same state are dropped) ---
+        event, created = webhook_inbox.record_event(
+            merchant_order_id, phonepe_status, phonepe_txn_id, payload=callback_data
+        )
+        if not created:
+            logger.info(f"Duplicate webhook for {merchant_order_id} ({phonepe_status})")
+            return JsonResponse({"status": "duplicate"})
+        
+        return JsonResponse({"status": "queued"})
         
     except Exception as e:
         logger.error(f"Webhook processing failed: {str(e)}", exc_info=True)
@@ -3104,112 +3091,47 @@ class PaymentStatusView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            with transaction.atomic():
-                # Get transaction with lock
-                txn = Transaction.objects.select_for_update().get(
-                    merchant_order_id=merchant_order_id
-                )
-                order = txn.order
-                
-                # Verify this order belongs to the requesting user
-                if order.user != request.user:
+            txn = Transaction.objects.select_related('order').get(merchant_order_id=merchant_order_id)
+            order = txn.order
+            
+            # Verify this order belongs to the requesting user
+            if order.user_id != request.user.pk:
+                return Response({
+                    'success': False,
+                    'error': 'Unauthorized'
+                }, status=status.HTTP_403_FORBIDDEN)
+            
+            # Skip if already finalized
+            if txn.status in ['SUCCESS', 'FAILED']:
+                return self.status_response(txn)
+            
+            # Check with PhonePe API - outside any transaction, so a slow gateway holds no row lock
+            status_result = check_order_status(merchant_order_id)
+            if not status_result['success']:
+                logger.error(f"Failed to check status: {status_result.get('error')}")
+                if status_result.get('unavailable') or status_result.get('timed_out'):
+                    # Nothing is wrong with the payment: the frontend should poll again later
                     return Response({
                         'success': False,
-                        'error': 'Unauthorized'
-                    }, status=status.HTTP_403_FORBIDDEN)
-                
-                # Skip if already finalized
-                if txn.status in ['SUCCESS', 'FAILED']:
-                    return Response({
-                        'success': True,
                         'status': txn.status,
-                        'order_status': order.status,
-                        'order_id': str(order.id),
-                        'message': self._get_status_message(txn.status)
-                    })
-                
-                # Check with PhonePe API
-                status_result = check_order_status(merchant_order_id)
-                if not status_result['success']:
-                    logger.error(f"Failed to check status: {status_result.get('error')}")
-                    return Response({
-                        'success': False,
-                        'error': 'Failed to check payment status'
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                
-                # Update records
-                phonepe_status = status_result['data'].get('state') or status_result['data'].get('status')
-                
-                status_mapping = {
-                    'COMPLETED': 'SUCCESS',
-                    'SUCCESS': 'SUCCESS',
-                    'FAILED': 'FAILED',
-                    'PENDING': 'PENDING'
-                }
-                
-                new_status = status_mapping.get(phonepe_status, 'PENDING')
-                txn.status = new_status
-                txn.pg_response_payload = status_result['data']
-                txn.save()
-                
-                # Process order based on status
-                if phonepe_status in ['COMPLETED', 'SUCCESS'] and order.status == 'pending':
-                    order.status = 'processing'
-                    order.save()
-                    
-                    # Clear cart
-                    Cart.objects.filter(user=order.user).delete()
-                    
-                    # Handle coupon
-                    if order.coupon:
-                        coupon_usage, created = CouponUsage.objects.get_or_create(
-                            user=order.user,
-                            coupon=order.coupon,
-                            defaults={'order': order}
-                        )
-                        if created:
-                            order.coupon.usage_count += 1
-                            order.coupon.save()
-                    
-                    # Create notification
-                    Notification.objects.create(
-                        user=order.user,
-                        title="Payment Successful",
-                        message=f"Your payment for order #{order.id} was successful."
-                    )
-                    
-                    # Send emails
-                    try:
-                        order_items = []
-                        for item in order.items.all():
-                            order_items.append({
-                                'product_name': item.product_variant.product.name,
-                                'quantity': item.quantity,
-                                'size': item.product_variant.size,
-                                'price': item.price * item.quantity
-                            })
-                        send_order_confirmation_emails(order, order_items)
-                    except Exception as e:
-                        logger.error(f"Failed to send emails for order {order.id}: {str(e)}")
-                    
-                elif phonepe_status == 'FAILED':
-                    order.status = 'cancelled'
-                    order.save()
-                    
-                    # Create notification
-                    Notification.objects.create(
-                        user=order.user,
-                        title="Payment Failed",
-                        message=f"Your payment for order #{order.id} failed. Please try again."
-                    )
-                
+                        'error': 'Payment status is temporarily unavailable. Please check again shortly.'
+                    }, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(max(math.ceil(payment_gateway.retry_after()), 1))})
                 return Response({
-                    'success': True,
-                    'status': txn.status,
-                    'order_status': order.status,
-                    'order_id': str(order.id),
-                    'message': self._get_status_message(txn.status)
-                })
+                    'success': False,
+                    'error': 'Failed to check payment status'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            
+            with transaction.atomic():
+                txn = Transaction.objects.select_for_update().select_related('order').get(pk=txn.pk)
+                # The webhook or reconciliation may have settled it while we asked
+                if txn.status != 'PENDING':
+                    return self.status_response(txn)
+                # Update records and confirm / cancel the order (a no-op if the webhook got there first)
+                phonepe_status = status_result['data'].get('state') or status_result['data'].get('status')
+                apply_payment_state(txn, phonepe_status, payload=status_result['data'])
+            
+            return self.status_response(txn)
                 
         except Transaction.DoesNotExist:
             return Response({
@@ -3223,6 +3145,15 @@ class PaymentStatusView(APIView):
                 'error': 'Status check failed'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def status_response(self, txn):
+        return Response({
+            'success': True,
+            'status': txn.status,
+            'order_status': txn.order.status,
+            'order_id': str(txn.order.id),
+            'message': self._get_status_message(txn.status)
+        })
+
     def _get_status_message(self, status):
         """Get user-friendly status message"""
         messages = {
@@ -3233,14 +3164,39 @@ class PaymentStatusView(APIView):
         return messages.get(status, 'Unknown status')
 
 
+class PaymentMethodsView(APIView):
+    """Payment methods checkout can offer right now (Cash on Delivery only while the gateway is down)"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response({
+            'cod': True,
+            'online': payment_gateway.online_payments_available(),
+        })
+
+
+class PaymentGatewayMetricsView(APIView):
+    """Payment gateway health for monitoring: breaker state, call latencies and background work"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Breaker and latency figures are this server process's own
+        return Response({
+            **payment_gateway.get_metrics(),
+            'reconciliation': reconciliation.get_stats(),
+            'webhook_inbox': webhook_inbox.counts(),
+        })
+
+
 # ============================================
 # ORDER VIEWSET (Read-Only + Status Updates)
 # ============================================
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ApproximateCountMixin, viewsets.ModelViewSet):
     """ViewSet for listing and retrieving orders"""
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PageNumberOrKeysetPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -3248,13 +3204,13 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Order.objects.select_related(
                 'user', 'address', 'coupon'
             ).prefetch_related(
-                'items__product_variant__product__images',
+                product_images_prefetch(),
                 'transactions'
             ).all()
         return Order.objects.select_related(
             'user', 'address', 'coupon'
         ).prefetch_related(
-            'items__product_variant__product__images',
+            product_images_prefetch(),
             'transactions'
         ).filter(user=user)
 
@@ -3461,8 +3417,17 @@ class OrderViewSet(viewsets.ModelViewSet):
             
         else:
             # For non-shipped statuses, simple status update
-            order.status = new_status
-            order.save()
+            if new_status == 'cancelled':
+                # Also gives back the order's held or taken stock
+                if not cancel_order(order):
+                    # Already cancelled: nothing to tell the customer again
+                    return Response(
+                        OrderSerializer(order, context={'request': request}).data,
+                        status=status.HTTP_200_OK
+                    )
+            else:
+                order.status = new_status
+                order.save()
             
             
             # Create standard notification
@@ -3473,11 +3438,10 @@ class OrderViewSet(viewsets.ModelViewSet):
                 message=f"Your order #{order.id} status has been updated to {status_display}."
             )
         
-        # Send status update email
-        try:
-            self._send_status_update_email(order, old_status, new_status)
-        except Exception as e:
-            logger.error(f"Failed to send status update email for order {order.id}: {str(e)}")
+        # Status update email goes out through the outbox after commit
+        outbox.enqueue('order.status_email', {
+            'order_id': str(order.id), 'old_status': old_status, 'new_status': new_status
+        })
         
         # Return updated order
         return Response(
@@ -3486,171 +3450,171 @@ class OrderViewSet(viewsets.ModelViewSet):
         )
 
 
-    def _send_status_update_email(self, order, old_status, new_status):
-        """Send order status update email"""
-        status_colors = {
-            'pending': '#ffc107',
-            'processing': '#2196F3',
-            'shipped': '#9C27B0',
-            'delivered': '#4CAF50',
-            'cancelled': '#f44336',
-        }
-        
-        status_messages = {
-            'pending': 'Your order is pending confirmation.',
-            'processing': 'We are preparing your order for shipment.',
-            'shipped': 'Your order has been shipped and is on the way!',
-            'delivered': 'Your order has been delivered successfully.',
-            'cancelled': 'Your order has been cancelled.',
-        }
-        
-        status_color = status_colors.get(new_status, '#502380')
-        status_message = status_messages.get(new_status, 'Your order status has been updated.')
-        
-        html_message = f"""
-        <html>
-        <head>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    line-height: 1.6;
-                    background-color: #f4f4f4;
-                    margin: 0;
-                    padding: 0;
-                }}
-                .email-container {{
-                    max-width: 600px;
-                    margin: 20px auto;
-                    background-color: white;
-                    padding: 0;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-                    overflow: hidden;
-                }}
-                .header {{
-                    background-color: #502380;
-                    color: white;
-                    padding: 30px;
-                    text-align: center;
-                }}
-                .header h2 {{
-                    margin: 0;
-                    font-size: 24px;
-                }}
-                .content {{
-                    padding: 30px;
-                }}
-                .status-container {{
-                    background-color: #f8f9fa;
-                    padding: 25px;
-                    margin: 20px 0;
-                    border-radius: 8px;
-                    text-align: center;
-                    border: 2px solid {status_color};
-                }}
-                .status-badge {{
-                    display: inline-block;
-                    padding: 12px 24px;
-                    background-color: {status_color};
-                    color: white;
-                    border-radius: 25px;
-                    font-size: 18px;
-                    font-weight: 600;
-                    margin: 10px 0;
-                    text-transform: uppercase;
-                }}
-                .order-info {{
-                    background-color: #f8f9fa;
-                    padding: 20px;
-                    margin: 15px 0;
-                    border-radius: 6px;
-                    border-left: 4px solid #502380;
-                }}
-                .order-info h3 {{
-                    color: #502380;
-                    margin-top: 0;
-                    margin-bottom: 10px;
-                    font-size: 16px;
-                }}
-                .order-info p {{
-                    margin: 5px 0;
-                    color: #333;
-                }}
-                .timeline {{
-                    margin: 20px 0;
-                    padding: 20px;
-                    background-color: #f8f9fa;
-                    border-radius: 6px;
-                }}
-                .timeline-item {{
-                    padding: 10px 0;
-                    color: #666;
-                }}
-                .footer {{
-                    background-color: #f8f9fa;
-                    padding: 20px;
-                    text-align: center;
-                    color: #666;
-                    font-size: 14px;
-                    border-top: 1px solid #e0e0e0;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="email-container">
-                <div class="header">
-                    <h2>Order Status Updated</h2>
-                    <p style="margin: 10px 0 0 0;">Order #{order.id}</p>
+def send_order_status_email(order, old_status, new_status):
+    """Send order status update email"""
+    status_colors = {
+        'pending': '#ffc107',
+        'processing': '#2196F3',
+        'shipped': '#9C27B0',
+        'delivered': '#4CAF50',
+        'cancelled': '#f44336',
+    }
+    
+    status_messages = {
+        'pending': 'Your order is pending confirmation.',
+        'processing': 'We are preparing your order for shipment.',
+        'shipped': 'Your order has been shipped and is on the way!',
+        'delivered': 'Your order has been delivered successfully.',
+        'cancelled': 'Your order has been cancelled.',
+    }
+    
+    status_color = status_colors.get(new_status, '#502380')
+    status_message = status_messages.get(new_status, 'Your order status has been updated.')
+    
+    html_message = f"""
+    <html>
+    <head>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                line-height: 1.6;
+                background-color: #f4f4f4;
+                margin: 0;
+                padding: 0;
+            }}
+            .email-container {{
+                max-width: 600px;
+                margin: 20px auto;
+                background-color: white;
+                padding: 0;
+                border-radius: 8px;
+                box-shadow: 0 4px 6px rgba(0,0,0,0.1);
+                overflow: hidden;
+            }}
+            .header {{
+                background-color: #502380;
+                color: white;
+                padding: 30px;
+                text-align: center;
+            }}
+            .header h2 {{
+                margin: 0;
+                font-size: 24px;
+            }}
+            .content {{
+                padding: 30px;
+            }}
+            .status-container {{
+                background-color: #f8f9fa;
+                padding: 25px;
+                margin: 20px 0;
+                border-radius: 8px;
+                text-align: center;
+                border: 2px solid {status_color};
+            }}
+            .status-badge {{
+                display: inline-block;
+                padding: 12px 24px;
+                background-color: {status_color};
+                color: white;
+                border-radius: 25px;
+                font-size: 18px;
+                font-weight: 600;
+                margin: 10px 0;
+                text-transform: uppercase;
+            }}
+            .order-info {{
+                background-color: #f8f9fa;
+                padding: 20px;
+                margin: 15px 0;
+                border-radius: 6px;
+                border-left: 4px solid #502380;
+            }}
+            .order-info h3 {{
+                color: #502380;
+                margin-top: 0;
+                margin-bottom: 10px;
+                font-size: 16px;
+            }}
+            .order-info p {{
+                margin: 5px 0;
+                color: #333;
+            }}
+            .timeline {{
+                margin: 20px 0;
+                padding: 20px;
+                background-color: #f8f9fa;
+                border-radius: 6px;
+            }}
+            .timeline-item {{
+                padding: 10px 0;
+                color: #666;
+            }}
+            .footer {{
+                background-color: #f8f9fa;
+                padding: 20px;
+                text-align: center;
+                color: #666;
+                font-size: 14px;
+                border-top: 1px solid #e0e0e0;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="email-container">
+            <div class="header">
+                <h2>Order Status Updated</h2>
+                <p style="margin: 10px 0 0 0;">Order #{order.id}</p>
+            </div>
+            
+            <div class="content">
+                <div class="status-container">
+                    <p style="margin: 0 0 10px 0; color: #666;">Your order status has been updated to:</p>
+                    <div class="status-badge">{new_status}</div>
+                    <p style="margin: 15px 0 0 0; color: #333; font-size: 16px;">{status_message}</p>
                 </div>
                 
-                <div class="content">
-                    <div class="status-container">
-                        <p style="margin: 0 0 10px 0; color: #666;">Your order status has been updated to:</p>
-                        <div class="status-badge">{new_status}</div>
-                        <p style="margin: 15px 0 0 0; color: #333; font-size: 16px;">{status_message}</p>
+                <div class="order-info">
+                    <h3>Order Information</h3>
+                    <p><strong>Order ID:</strong> #{order.id}</p>
+                    <p><strong>Order Date:</strong> {order.created_at.strftime('%B %d, %Y')}</p>
+                    <p><strong>Total Amount:</strong> ₹{order.total_price:.2f}</p>
+                    <p><strong>Payment Method:</strong> {order.get_payment_method_display()}</p>
+                </div>
+                
+                <div class="timeline">
+                    <h3 style="color: #502380; margin-top: 0;">Status History</h3>
+                    <div class="timeline-item">
+                        <strong>Previous Status:</strong> {old_status}
                     </div>
-                    
-                    <div class="order-info">
-                        <h3>Order Information</h3>
-                        <p><strong>Order ID:</strong> #{order.id}</p>
-                        <p><strong>Order Date:</strong> {order.created_at.strftime('%B %d, %Y')}</p>
-                        <p><strong>Total Amount:</strong> ₹{order.total_price:.2f}</p>
-                        <p><strong>Payment Method:</strong> {order.get_payment_method_display()}</p>
+                    <div class="timeline-item">
+                        <strong>Current Status:</strong> {new_status}
                     </div>
-                    
-                    <div class="timeline">
-                        <h3 style="color: #502380; margin-top: 0;">Status History</h3>
-                        <div class="timeline-item">
-                            <strong>Previous Status:</strong> {old_status}
-                        </div>
-                        <div class="timeline-item">
-                            <strong>Current Status:</strong> {new_status}
-                        </div>
-                        <div class="timeline-item">
-                            <strong>Updated:</strong> {order.updated_at.strftime('%B %d, %Y at %I:%M %p')}
-                        </div>
+                    <div class="timeline-item">
+                        <strong>Updated:</strong> {order.updated_at.strftime('%B %d, %Y at %I:%M %p')}
                     </div>
-                    
-                    <p style="color: #666; margin-top: 20px;">You can track your order anytime by logging into your account.</p>
                 </div>
                 
-                <div class="footer">
-                    <p style="margin: 0 0 10px 0;">Thank you for shopping with us!</p>
-                    <p style="margin: 0 0 10px 0;"><strong>Devrup Organics</strong></p>
-                    <p style="margin: 0; font-size: 12px;">© 2025 Devrup Organics. All rights reserved.</p>
-                </div>
+                <p style="color: #666; margin-top: 20px;">You can track your order anytime by logging into your account.</p>
             </div>
-        </body>
-        </html>
-        """
-        
-        send_mail(
-            subject=f"Order Status Update - Order #{order.id}",
-            message=f"Your order #{order.id} status has been updated to {new_status}.",
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=[order.user.email],
-            fail_silently=False,
-            html_message=html_message
-        )
-        
-        logger.info(f"Status update email sent for order {order.id}: {old_status} -> {new_status}")
\ No newline at end of file
+            
+            <div class="footer">
+                <p style="margin: 0 0 10px 0;">Thank you for shopping with us!</p>
+                <p style="margin: 0 0 10px 0;"><strong>Devrup Organics</strong></p>
+                <p style="margin: 0; font-size: 12px;">© 2025 Devrup Organics. All rights reserved.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    
+    send_mail(
+        subject=f"Order Status Update - Order #{order.id}",
+        message=f"Your order #{order.id} status has been updated to {new_status}.",
+        from_email=settings.EMAIL_HOST_USER,
+        recipient_list=[order.user.email],
+        fail_silently=False,
+        html_message=html_message
+    )
+    
+    logger.info(f"Status update email sent for order {order.id}: {old_status} -> {new_status}")
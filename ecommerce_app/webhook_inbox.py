@@ -0,0 +1,150 @@
+# webhook_inbox.py
+# Durable inbox for PhonePe callbacks. The webhook only verifies the callback,
+# stores it as a PaymentWebhookEvent (deduplicated on merchant_order_id +
+# state, so gateway retries are free) and answers 200 - no row locks, no
+# gateway round trip, no emails. The process_payment_webhooks command applies
+# the stored events: it double-checks each with PhonePe's order status API
+# and moves the order along through payments.apply_payment_state.
+#
+# Events for the same merchant order are applied strictly in arrival order:
+# a batch takes at most the oldest open event per order, and an order whose
+# event is being processed or waiting to be retried is skipped until it is done.
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import payment_gateway, payments
+from .models import PaymentWebhookEvent, Transaction
+from .outbox import LEASE, backoff, take_leases
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+PROCESSED = 'processed'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 10
+
+
+def record_event(merchant_order_id, state, phonepe_transaction_id=None, payload=None):
+    """Store a verified callback; returns (event, created) - created is False for a repeat"""
+    try:
+        with transaction.atomic():
+            return PaymentWebhookEvent.objects.create(
+                merchant_order_id=merchant_order_id, state=state,
+                phonepe_transaction_id=phonepe_transaction_id, payload=payload or {}
+            ), True
+    except IntegrityError:
+        return PaymentWebhookEvent.objects.get(merchant_order_id=merchant_order_id, state=state), False
+
+
+def claim(batch_size, lease=LEASE):
+    """Lease the oldest due event of up to batch_size merchant orders that have nothing in flight"""
+    now = timezone.now()
+    with transaction.atomic():
+        open_events = PaymentWebhookEvent.objects.filter(
+            Q(status=PENDING) | Q(status=PROCESSING)
+        ).order_by('received_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            open_events = open_events.select_for_update(skip_locked=True)
+
+        claimed, seen = [], set()
+        for event in open_events.iterator():
+            if event.merchant_order_id in seen:
+                continue
+            # Only an order's oldest open event may run, and only once it's due
+            seen.add(event.merchant_order_id)
+            in_flight = event.status == PROCESSING and event.locked_until and event.locked_until > now
+            if not in_flight and event.available_at <= now:
+                claimed.append(event)
+                if len(claimed) == batch_size:
+                    break
+
+        return take_leases(
+            PaymentWebhookEvent, claimed, ('status', 'locked_until'), status=PROCESSING, locked_until=now + lease
+        )
+
+
+def _owned(event):
+    """The event, if this worker's lease on it still holds"""
+    return PaymentWebhookEvent.objects.filter(pk=event.pk, status=PROCESSING, locked_until=event.locked_until)
+
+
+def apply_event(event, check_status):
+    """Double-check the event with the gateway, then apply it to its Transaction and order"""
+    state = event.state
+    # Outside any database transaction: the gateway round trip holds no locks
+    status_result = check_status(event.merchant_order_id)
+    if status_result['success']:
+        api_state = status_result['data'].get('state') or status_result['data'].get('status')
+        if api_state and api_state != state:
+            logger.warning(f"Status mismatch for {event.merchant_order_id}: webhook={state}, api={api_state}")
+            state = api_state  # Trust API over webhook
+
+    with transaction.atomic():
+        txn = Transaction.objects.select_for_update().select_related('order').get(
+            merchant_order_id=event.merchant_order_id
+        )
+        txn.payment_response = event.payload
+        payments.apply_payment_state(txn, state, payload=event.payload, phonepe_txn_id=event.phonepe_transaction_id)
+
+
+def process(event, check_status, max_attempts=MAX_ATTEMPTS):
+    """Apply one claimed event and record the outcome; returns True if it was applied"""
+    attempts = event.attempts + 1
+    try:
+        apply_event(event, check_status)
+    except Exception as e:
+        if attempts >= max_attempts:
+            logger.error(f"Webhook event {event.pk} ({event.merchant_order_id} {event.state}) failed permanently: {e}")
+            changes = {'status': FAILED, 'processed_at': timezone.now()}
+        else:
+            logger.warning(f"Webhook event {event.pk} ({event.merchant_order_id}) failed, attempt {attempts}: {e}")
+            changes = {'status': PENDING, 'available_at': timezone.now() + backoff(attempts)}
+        if not _owned(event).update(attempts=attempts, locked_until=None, last_error=str(e), **changes):
+            logger.warning(f"Webhook event {event.pk} was re-claimed by another worker; outcome not recorded")
+        return False
+
+    if not _owned(event).update(
+        status=PROCESSED, attempts=attempts, locked_until=None, last_error='', processed_at=timezone.now()
+    ):
+        logger.warning(f"Webhook event {event.pk} was re-claimed by another worker; outcome not recorded")
+    return True
+
+
+def _process_in_thread(event, check_status, max_attempts):
+    try:
+        return process(event, check_status, max_attempts)
+    finally:
+        connection.close()
+
+
+def drain(batch_size=50, workers=4, max_attempts=MAX_ATTEMPTS, check_status=None, pool=None):
+    """
+    Claim one batch of events (one per merchant order) and apply it, on a
+    thread pool when workers > 1. Returns (claimed, processed).
+    """
+    check_status = check_status or payment_gateway.check_order_status
+    events = claim(batch_size)
+    if not events:
+        return 0, 0
+    if pool is None and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda event: _process_in_thread(event, check_status, max_attempts), events))
+    elif pool is not None:
+        results = list(pool.map(lambda event: _process_in_thread(event, check_status, max_attempts), events))
+    else:
+        results = [process(event, check_status, max_attempts) for event in events]
+    return len(events), results.count(True)
+
+
+def counts():
+    """Number of events per status, for monitoring"""
+    rows = PaymentWebhookEvent.objects.values('status').annotate(count=Count('pk')).order_by()
+    return {status: 0 for status in (PENDING, PROCESSING, PROCESSED, FAILED)} | {
+        row['status']: row['count'] for row in rows
+    }